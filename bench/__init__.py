@@ -0,0 +1 @@
+"""Benchmarks and fake devices for tvhub (not installed with the package)."""
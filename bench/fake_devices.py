@@ -0,0 +1,360 @@
+"""Local stand-ins for real TVs, for benchmarks and manual testing.
+
+FakeDMR answers Hisense RenderingControl SOAP calls after a configurable
+delay, and GENA SUBSCRIBE with an initial NOTIFY; FakeSSDPResponder
+answers M-SEARCHes for them. So the hub can be exercised without hardware.
+FakeAdbServer speaks enough of the adb server protocol for tvhub.adb, and
+write_fake_adb() drops an `adb` executable for the subprocess fallback;
+both answer Google TV shell commands after a configurable delay.
+"""
+from __future__ import annotations
+import html
+import re
+import socket
+import socketserver
+import stat
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+
+_DESIRED_RE = re.compile(rb"<Desired(Volume|Mute)>(\d+)</Desired")
+
+
+class _DMRHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "FakeDMR"
+
+    def setup(self):
+        super().setup()
+        self.server.count("connections")
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _reply(self, body: bytes = b"", headers: Dict[str, str] = None, status: int = 200):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/description.xml":
+            self._reply(status=404)
+            return
+        self._reply(self.server.description(), {"Content-Type": 'text/xml; charset="utf-8"'})
+
+    def do_POST(self):
+        self.server.count("requests")
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        action = self.headers.get("SOAPACTION", "").strip('"').rsplit("#", 1)[-1]
+        m = _DESIRED_RE.search(body)
+        out = ""
+        with self.server.lock:
+            if action == "GetVolume":
+                out = f"<CurrentVolume>{self.server.volume}</CurrentVolume>"
+            elif action == "GetMute":
+                out = f"<CurrentMute>{int(self.server.mute)}</CurrentMute>"
+            elif action == "SetVolume" and m:
+                self.server.volume = int(m.group(2))
+            elif action == "SetMute" and m:
+                self.server.mute = m.group(2) == b"1"
+            else:
+                self._reply(status=500)
+                return
+        resp = ('<?xml version="1.0"?><s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">'
+                f'<s:Body><u:{action}Response xmlns:u="urn:schemas-upnp-org:service:RenderingControl:1">'
+                f"{out}</u:{action}Response></s:Body></s:Envelope>").encode()
+        self._reply(resp, {"Content-Type": 'text/xml; charset="utf-8"'})
+
+    def do_SUBSCRIBE(self):
+        with self.server.lock:
+            self.server.subscriptions.append(dict(self.headers.items()))
+        sid = self.headers.get("SID")
+        callback = self.headers.get("CALLBACK", "").strip("<>")
+        if sid is None:
+            sid = f"uuid:{uuid.uuid4()}"
+            if callback:
+                # A new subscriber gets the current state as event 0.
+                threading.Thread(target=self.server.notify, args=(callback, sid),
+                                 daemon=True).start()
+        self._reply(headers={"SID": sid, "TIMEOUT": "Second-300"})
+
+
+class FakeDMR(ThreadingHTTPServer):
+    """A RenderingControl endpoint on host:port (port 0 picks a free one)."""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        super().__init__((host, port), _DMRHandler)
+        self.latency = latency
+        self.volume = 10
+        self.mute = False
+        self.udn = f"uuid:{uuid.uuid4()}"
+        self.manufacturer = "Hisense"
+        self.lock = threading.Lock()
+        self.counters: Dict[str, int] = {"connections": 0, "requests": 0}
+        # Headers of every SUBSCRIBE (new and renewals), in arrival order.
+        self.subscriptions: List[Dict[str, str]] = []
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    @property
+    def control_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/control/RenderingControl"
+
+    @property
+    def event_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/event/RenderingControl"
+
+    @property
+    def location(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/description.xml"
+
+    def description(self) -> bytes:
+        """UPnP device description advertising RenderingControl."""
+        return ('<?xml version="1.0"?><root xmlns="urn:schemas-upnp-org:device-1-0"><device>'
+                "<deviceType>urn:schemas-upnp-org:device:MediaRenderer:1</deviceType>"
+                f"<friendlyName>Living Room TV</friendlyName><manufacturer>{self.manufacturer}</manufacturer>"
+                f"<modelName>65U8</modelName><UDN>{self.udn}</UDN><serviceList><service>"
+                "<serviceType>urn:schemas-upnp-org:service:RenderingControl:1</serviceType>"
+                "<controlURL>/control/RenderingControl</controlURL>"
+                "<eventSubURL>/event/RenderingControl</eventSubURL>"
+                "</service></serviceList></device></root>").encode()
+
+    def notify(self, callback: str, sid: str) -> None:
+        """Send the current volume/mute to a GENA callback URL."""
+        with self.lock:
+            last_change = ('<Event xmlns="urn:schemas-upnp-org:metadata-1-0/RCS/"><InstanceID val="0">'
+                           f'<Volume channel="Master" val="{self.volume}"/>'
+                           f'<Mute channel="Master" val="{int(self.mute)}"/></InstanceID></Event>')
+        body = ('<?xml version="1.0"?><e:propertyset xmlns:e="urn:schemas-upnp-org:event-1-0">'
+                f"<e:property><LastChange>{html.escape(last_change)}</LastChange></e:property>"
+                "</e:propertyset>").encode()
+        req = urllib.request.Request(callback, data=body, method="NOTIFY", headers={
+            "Content-Type": 'text/xml; charset="utf-8"', "NT": "upnp:event",
+            "NTS": "upnp:propchange", "SID": sid, "SEQ": "0"})
+        try:
+            urllib.request.urlopen(req, timeout=3).close()
+        except OSError:
+            pass
+
+    def start(self) -> "FakeDMR":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class FakeSSDPResponder:
+    """Answers SSDP M-SEARCHes on a unicast UDP port (for TVHUB_SSDP_ADDR)
+    with the LOCATION of each FakeDMR in `renderers`."""
+
+    ST = "urn:schemas-upnp-org:device:MediaRenderer:1"
+
+    def __init__(self, renderers: List[FakeDMR], host: str = "127.0.0.1", port: int = 0):
+        self.renderers = renderers
+        self.searches = 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((host, port))
+        self._sock.settimeout(0.2)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._sock.getsockname()[:2]
+
+    def _serve(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                data, peer = self._sock.recvfrom(8192)
+            except socket.timeout:
+                continue
+            text = data.decode("utf-8", "replace")
+            if not text.startswith("M-SEARCH") or (self.ST not in text and "ssdp:all" not in text):
+                continue
+            self.searches += 1
+            for dmr in self.renderers:
+                reply = ("HTTP/1.1 200 OK\r\nCACHE-CONTROL: max-age=1800\r\n"
+                         f"LOCATION: {dmr.location}\r\nST: {self.ST}\r\n"
+                         f"USN: {dmr.udn}::{self.ST}\r\n\r\n")
+                self._sock.sendto(reply.encode(), peer)
+
+    def start(self) -> "FakeSSDPResponder":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+        self._sock.close()
+
+
+# What a Google TV prints for tvhub's status query (dumpsys | grep -m 1).
+RESUMED_LINE = ("  topResumedActivity=ActivityRecord{1a2b3c u0 "
+                "com.google.android.youtube.tv/com.google.android.apps.youtube.tv.activity.ShellActivity t42}")
+
+
+def _shell_output(cmd: str) -> str:
+    return RESUMED_LINE + "\n" if "dumpsys activity" in cmd else ""
+
+
+class _AdbHandler(socketserver.StreamRequestHandler):
+    server: "FakeAdbServer"
+
+    def _request(self) -> str:
+        length = self.rfile.read(4)
+        if len(length) < 4:
+            return ""
+        return self.rfile.read(int(length, 16)).decode("utf-8")
+
+    def _okay(self, message: str = None) -> None:
+        out = b"OKAY"
+        if message is not None:
+            data = message.encode("utf-8")
+            out += b"%04x" % len(data) + data
+        self.wfile.write(out)
+        self.wfile.flush()
+
+    def handle(self):
+        self.server.count("connections")
+        req = self._request()
+        with self.server.lock:
+            self.server.requests.append(req)
+        if req.startswith("host:connect:"):
+            self._okay(f"connected to {req[len('host:connect:'):]}")
+            return
+        if not req.startswith("host:transport:"):
+            self.wfile.write(b"FAIL0010unknown request")
+            return
+        self._okay()
+        service = self._request()
+        with self.server.lock:
+            self.server.requests.append(service)
+        self._okay()
+        if service == "exec:sh":
+            with self.server.lock:
+                self.server.sessions.add(self.connection)
+            try:
+                self._session()
+            finally:
+                with self.server.lock:
+                    self.server.sessions.discard(self.connection)
+        elif service.startswith(("exec:", "shell:")):
+            # One-shot: AdbClient.shell wraps the command and appends its
+            # own `echo <marker>$?`, which we answer with status 0.
+            cmd = service.split(":", 1)[1]
+            marker = re.search(r"^sh -c '(.*)' 2>&1; echo (\S+)\$\?\s*$", cmd, re.S)
+            if marker:
+                rc = self._run(marker.group(1).replace("'\"'\"'", "'"))
+                self.wfile.write(f"{marker.group(2)}{rc}\n".encode())
+            else:
+                self._run(cmd)
+
+    def _run(self, cmd: str) -> int:
+        self.server.count("commands")
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        output, rc = self.server.replies.get(cmd, (_shell_output(cmd), 0))
+        self.wfile.write(output.encode("utf-8"))
+        return rc
+
+    def _session(self) -> None:
+        """A persistent `exec:sh`: commands arrive as `{ cmd\n} 2>&1; echo M$?`."""
+        cmd = []
+        for raw in self.rfile:
+            line = raw.decode("utf-8").rstrip("\n")
+            if line.startswith("{ "):
+                cmd = [line[2:]]
+            elif line.startswith("} 2>&1; echo "):
+                rc = self._run("\n".join(cmd))
+                self.wfile.write(line[len("} 2>&1; echo "):].replace("$?", str(rc)).encode() + b"\n")
+                self.wfile.flush()
+                cmd = []
+            else:
+                cmd.append(line)
+
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+    """An adb server on host:port where every device is a responsive Google TV."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        super().__init__((host, port), _AdbHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.counters: Dict[str, int] = {"connections": 0, "commands": 0}
+        # Shell command -> (output, exit status), for commands that should
+        # answer something other than the Google TV defaults.
+        self.replies: Dict[str, Tuple[str, int]] = {}
+        # host: requests in arrival order, and the open exec:sh sessions.
+        self.requests: List[str] = []
+        self.sessions: Set[socket.socket] = set()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    @property
+    def address(self) -> str:
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    def drop_sessions(self) -> None:
+        """Close every persistent shell, as an adb server restart would."""
+        with self.lock:
+            sessions, self.sessions = list(self.sessions), set()
+        for sock in sessions:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def start(self) -> "FakeAdbServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+_FAKE_ADB = """#!{python}
+import sys, time
+time.sleep({latency!r})
+args = sys.argv[1:]
+if args[:1] == ["connect"]:
+    print("connected to " + args[1])
+elif args[:1] == ["-s"] and args[2:3] == ["shell"]:
+    if "dumpsys activity" in " ".join(args[3:]):
+        print({line!r})
+"""
+
+
+def write_fake_adb(directory: Path, latency: float = 0.0) -> Path:
+    """Write an executable `adb` into directory (for TVHUB_ADB_BIN) and return it."""
+    path = Path(directory) / "adb"
+    path.write_text(_FAKE_ADB.format(python=sys.executable, latency=latency, line=RESUMED_LINE))
+    path.chmod(path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Startup import cost of the hub entry points, lazy vs eager plugins.
+
+Runs each entry module in a fresh interpreter under `python -X importtime`
+and sums the cumulative time of top-level imports. "lazy" is a plain
+import (plugins load on first use); "eager" also loads every plugin, which
+is what startup cost before plugins were loaded lazily. Prints JSON.
+
+    python -m bench.importtime --runs 5
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, Any, List
+
+from .load import REPO_ROOT
+
+MODULES = ["tvhub.app", "tvhub.discover_all"]
+HEAVY = ["zeroconf", "requests", "asyncio", "tvhub.plugins.gtv", "tvhub.plugins.hisense"]
+
+_PROBE = """
+import sys
+import {module}
+{touch}
+print(" ".join(m for m in {heavy!r} if m in sys.modules))
+"""
+
+
+def measure(module: str, eager: bool, data_dir: str) -> Dict[str, Any]:
+    touch = "from tvhub.plugins import load_plugins; load_plugins(eager=True)" if eager else ""
+    env = dict(os.environ, TVHUB_DATA_DIR=data_dir, TVHUB_HISENSE_EVENTS="0",
+               PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c",
+         _PROBE.format(module=module, touch=touch, heavy=HEAVY)],
+        capture_output=True, text=True, env=env, check=True)
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith(" ") or name.startswith("  "):
+            continue  # only top-level imports; nested ones are in their parent's total
+        total_us += int(cumulative)
+    return {"ms": total_us / 1000.0, "loaded": proc.stdout.split()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results: Dict[str, Any] = {}
+    with tempfile.TemporaryDirectory(prefix="tvhub-bench-") as tmp:
+        for module in MODULES:
+            entry: Dict[str, Any] = {}
+            for mode in ("eager", "lazy"):
+                samples: List[Dict[str, Any]] = [measure(module, mode == "eager", tmp)
+                                                 for _ in range(args.runs)]
+                entry[mode] = {
+                    "median_ms": round(statistics.median(s["ms"] for s in samples), 1),
+                    "heavy_modules": samples[-1]["loaded"],
+                }
+            entry["saved_ms"] = round(entry["eager"]["median_ms"] - entry["lazy"]["median_ms"], 1)
+            results[module] = entry
+
+    print(json.dumps({"benchmark": "importtime", "runs": args.runs, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
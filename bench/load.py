@@ -0,0 +1,124 @@
+"""HTTP load driver and latency summary shared by the benchmarks."""
+from __future__ import annotations
+import http.client
+import itertools
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(latencies: List[float], errors: Dict[str, int], elapsed: float) -> Dict[str, Any]:
+    """`errors` counts failed requests by HTTP status (or "connection")."""
+    lat = sorted(latencies)
+    n = len(lat) + sum(errors.values())
+    return {
+        "requests": n,
+        "errors": sum(errors.values()),
+        "error_statuses": dict(sorted(errors.items())),
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(n / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(lat, 50) * 1000, 2),
+            "p95": round(percentile(lat, 95) * 1000, 2),
+            "p99": round(percentile(lat, 99) * 1000, 2),
+            "max": round(lat[-1] * 1000, 2) if lat else 0.0,
+        },
+    }
+
+
+def drive(host: str, port: int, requests: Sequence[Tuple[str, str]], concurrency: int,
+          total: int, timeout: float = 30.0) -> Dict[str, Any]:
+    """Issue `total` requests (cycling through (method, path) pairs) from
+    `concurrency` keep-alive clients and summarize latency.
+
+    Only 2xx responses count as successes; anything else is an error, so
+    a run that mostly exercises error paths can't pass for a fast one."""
+    it = itertools.cycle(requests)
+    it_lock = threading.Lock()
+    remaining = [total]
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def worker() -> None:
+        conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        while True:
+            with it_lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+                method, path = next(it)
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=b"{}" if method == "POST" else None,
+                             headers={"Content-Type": "application/json"})
+                resp = conn.getresponse()
+                resp.read()
+                failure = None if 200 <= resp.status < 300 else str(resp.status)
+            except (OSError, http.client.HTTPException):
+                failure = "connection"
+                conn.close()
+                conn = http.client.HTTPConnection(host, port, timeout=timeout)
+            elapsed = time.perf_counter() - start
+            with lock:
+                if failure is None:
+                    latencies.append(elapsed)
+                else:
+                    errors[failure] = errors.get(failure, 0) + 1
+        conn.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"server on port {port} did not come up")
+
+
+def start_server(module: str, port: int, env: Dict[str, str],
+                 args: Optional[List[str]] = None) -> subprocess.Popen:
+    """Start `python -m module` listening on 127.0.0.1:port with env applied."""
+    full_env = dict(os.environ)
+    full_env.update(env)
+    full_env.update({"TVHUB_HOST": "127.0.0.1", "TVHUB_PORT": str(port),
+                     "PYTHONPATH": REPO_ROOT + os.pathsep + full_env.get("PYTHONPATH", "")})
+    proc = subprocess.Popen([sys.executable, "-m", module] + (args or []), env=full_env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+    except RuntimeError:
+        proc.kill()
+        raise
+    return proc
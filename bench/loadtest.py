@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""Load test of the hub API against simulated Google TVs and Hisense TVs.
+
+Starts a FakeAdbServer (or, with --adb subprocess, a fake `adb` binary)
+and a FakeDMR, both answering after --latency-ms, seeds a temporary data
+dir with --gtv and --hisense devices, starts the server and runs each
+scenario at --concurrency:
+
+    devices   GET /api/devices
+    keys      button presses on the Google TVs
+    status    fresh foreground-app queries on the Google TVs
+    volume    get_volume on the Hisense TVs
+
+Prints one JSON document (throughput and p50/p95/p99 latency per
+scenario, plus spawn/connection counts from /metrics and the fakes).
+Exits 1 if any request got a non-2xx answer (listed under "failed"). With
+--baseline, compares against an earlier document and also exits 1 if any
+scenario lost more than --tolerance of its throughput or p95.
+
+    python -m bench.loadtest --gtv 20 --hisense 20 --out run.json
+    python -m bench.loadtest --gtv 20 --hisense 20 --baseline run.json
+"""
+from __future__ import annotations
+import argparse
+import http.client
+import json
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, Any, List, Tuple
+
+from .fake_devices import FakeAdbServer, FakeDMR, write_fake_adb
+from .load import drive, free_port, start_server
+from .serving import SERVERS, hisense_devices
+
+SCENARIOS = ("devices", "keys", "status", "volume")
+# Names from GoogleTVPlugin.KEYCODES; anything else fails before reaching adb.
+KEYS = ("UP", "DOWN", "LEFT", "RIGHT", "ENTER", "BACK")
+# Counters worth comparing between runs; summed over all label values.
+SCRAPED = ("tvhub_subprocess_spawns_total", "tvhub_http_connections_total",
+           "tvhub_transport_errors_total", "tvhub_registry_reloads_total")
+
+
+def gtv_devices(count: int) -> dict:
+    devices = {}
+    for i in range(count):
+        dev_id = f"bench-gtv-{i}"
+        devices[dev_id] = {
+            "id": dev_id,
+            "name": dev_id,
+            "type": "gtv",
+            "address": f"127.1.{i // 250}.{i % 250 + 2}:5555",
+            "meta": {"pinned": True},
+        }
+    return devices
+
+
+def scenario_requests(name: str, gtv: List[str], hisense: List[str]) -> List[Tuple[str, str]]:
+    if name == "devices":
+        return [("GET", "/api/devices")]
+    if name == "keys":
+        return [("GET", f"/api/device/{d}/action/button?key={KEYS[i % len(KEYS)]}")
+                for i, d in enumerate(gtv)]
+    if name == "status":
+        return [("GET", f"/api/device/{d}/action/status?fresh=1") for d in gtv]
+    if name == "volume":
+        return [("GET", f"/api/device/{d}/action/get_volume") for d in hisense]
+    raise ValueError(f"unknown scenario {name}")
+
+
+def scrape(port: int) -> Dict[str, float]:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        conn.request("GET", "/metrics")
+        text = conn.getresponse().read().decode("utf-8")
+    finally:
+        conn.close()
+    totals = {name: 0.0 for name in SCRAPED}
+    for line in text.splitlines():
+        name = line.split("{", 1)[0].split(" ", 1)[0]
+        if name in totals:
+            totals[name] += float(line.rsplit(" ", 1)[1])
+    return totals
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> Dict[str, Any]:
+    """Per-scenario ratios against baseline; `regressed` lists the losers."""
+    out: Dict[str, Any] = {"tolerance": tolerance, "regressed": []}
+    for name, cur in results.items():
+        old = baseline.get("results", {}).get(name)
+        if not old:
+            continue
+        rps = cur["throughput_rps"] / old["throughput_rps"] if old["throughput_rps"] else None
+        p95 = (cur["latency_ms"]["p95"] / old["latency_ms"]["p95"]
+               if old["latency_ms"]["p95"] else None)
+        out[name] = {"throughput_ratio": rps and round(rps, 3), "p95_ratio": p95 and round(p95, 3)}
+        if (rps is not None and rps < 1 - tolerance) or (p95 is not None and p95 > 1 + tolerance):
+            out["regressed"].append(name)
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--gtv", type=int, default=10)
+    parser.add_argument("--hisense", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--server", choices=sorted(SERVERS), default="flask")
+    parser.add_argument("--adb", choices=("native", "subprocess"), default="native")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--out", type=Path, help="also write the JSON document here")
+    parser.add_argument("--baseline", type=Path, help="earlier --out document to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    latency = args.latency_ms / 1000.0
+    dmr = FakeDMR(latency=latency).start()
+    adb = FakeAdbServer(latency=latency).start()
+    results: Dict[str, Any] = {}
+    try:
+        with tempfile.TemporaryDirectory(prefix="tvhub-bench-") as tmp:
+            gtv, hisense = gtv_devices(args.gtv), hisense_devices(args.hisense, dmr.control_url)
+            (Path(tmp) / "devices.json").write_text(json.dumps({**gtv, **hisense}))
+            # No liveness probing: the fake GTVs' addresses don't accept connections.
+            env = {"TVHUB_DATA_DIR": tmp, "TVHUB_HISENSE_EVENTS": "0",
+                   "TVHUB_PROBE_INTERVAL": "0",
+                   "TVHUB_ADB_MODE": args.adb, "TVHUB_ADB_SERVER": adb.address,
+                   "TVHUB_ADB_BIN": str(write_fake_adb(Path(tmp), latency))}
+            port = free_port()
+            proc = start_server(SERVERS[args.server], port, env)
+            try:
+                for name in args.scenarios.split(","):
+                    reqs = scenario_requests(name, list(gtv), list(hisense))
+                    if not reqs:
+                        continue
+                    drive("127.0.0.1", port, reqs, args.concurrency, min(20, args.requests))
+                    results[name] = drive("127.0.0.1", port, reqs, args.concurrency, args.requests)
+                metrics = scrape(port)
+            finally:
+                proc.terminate()
+                proc.wait(10)
+    finally:
+        dmr.stop()
+        adb.stop()
+
+    doc: Dict[str, Any] = {
+        "benchmark": "loadtest",
+        "params": {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()},
+        "results": results,
+        "metrics": metrics,
+        "fakes": {"adb": dict(adb.counters), "dmr": dict(dmr.counters)},
+        "failed": [name for name, r in results.items() if r["errors"]],
+    }
+    if args.baseline:
+        doc["comparison"] = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+    text = json.dumps(doc, indent=2)
+    if args.out:
+        args.out.write_text(text + "\n")
+    print(text)
+    if doc["failed"] or doc.get("comparison", {}).get("regressed"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
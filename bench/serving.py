@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Compare the Flask (tvhub.app), asyncio (tvhub.asgi) and pre-fork servers.
+
+Seeds a temporary data dir with N Hisense devices backed by one FakeDMR
+that answers after --latency-ms, starts each server in turn and drives
+get_volume at --concurrency. Prints one JSON document with throughput and
+p50/p95/p99 latency per server. "prefork" is not run by default; add it
+with --servers flask,asgi,prefork (TVHUB_WORKERS sets its worker count).
+
+    python -m bench.serving --devices 50 --latency-ms 200 --concurrency 100
+"""
+from __future__ import annotations
+import argparse
+import json
+import tempfile
+from pathlib import Path
+
+from .fake_devices import FakeDMR
+from .load import drive, free_port, start_server
+
+SERVERS = {"flask": "tvhub.app", "asgi": "tvhub.asgi", "prefork": "tvhub.prefork"}
+
+
+def hisense_devices(count: int, control_url: str) -> dict:
+    devices = {}
+    for i in range(count):
+        dev_id = f"bench-hisense-{i}"
+        devices[dev_id] = {
+            "id": dev_id,
+            "name": dev_id,
+            "type": "hisense",
+            # Distinct loopback IPs so each device gets its own HTTP session.
+            "address": f"127.0.{i // 250}.{i % 250 + 2}",
+            "meta": {"rcs_control_url": control_url, "pinned": True},
+        }
+    return devices
+
+
+def seed_hisense(data_dir: Path, count: int, control_url: str) -> list:
+    devices = hisense_devices(count, control_url)
+    (data_dir / "devices.json").write_text(json.dumps(devices))
+    return list(devices)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--servers", default="flask,asgi")
+    args = parser.parse_args(argv)
+
+    dmr = FakeDMR(latency=args.latency_ms / 1000.0).start()
+    results = {}
+    try:
+        for name in args.servers.split(","):
+            with tempfile.TemporaryDirectory(prefix="tvhub-bench-") as tmp:
+                ids = seed_hisense(Path(tmp), args.devices, dmr.control_url)
+                port = free_port()
+                proc = start_server(SERVERS[name], port, {
+                    "TVHUB_DATA_DIR": tmp,
+                    "TVHUB_HISENSE_EVENTS": "0",
+                    "TVHUB_PROBE_INTERVAL": "0",
+                })
+                try:
+                    paths = [("GET", f"/api/device/{i}/action/get_volume") for i in ids]
+                    drive("127.0.0.1", port, paths, args.concurrency, min(20, args.requests))
+                    results[name] = drive("127.0.0.1", port, paths, args.concurrency, args.requests)
+                finally:
+                    proc.terminate()
+                    proc.wait(10)
+    finally:
+        dmr.stop()
+
+    print(json.dumps({
+        "benchmark": "serving",
+        "params": vars(args),
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
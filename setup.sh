@@ -77,50 +77,45 @@ Restart=on-failure
 WantedBy=multi-user.target
 EOF
 
-echo ">>> Writing systemd service: tvhub-discover.service"
-cat >/etc/systemd/system/tvhub-discover.service <<EOF
+echo ">>> Writing systemd service: tvhub-discoverd.service"
+cat >/etc/systemd/system/tvhub-discoverd.service <<EOF
 [Unit]
-Description=TVHub discovery run
+Description=TVHub resident discovery
+After=network.target
 
 [Service]
-Type=oneshot
+Type=simple
 User=tvhub
 Group=tvhub
 WorkingDirectory=/opt/tvhub
 Environment=TVHUB_DATA_DIR=$DATA_DIR
-ExecStart=/opt/tvhub/venv/bin/python -m tvhub.discover_all
-EOF
-
-echo ">>> Writing systemd timer: tvhub-discover.timer"
-cat >/etc/systemd/system/tvhub-discover.timer <<EOF
-[Unit]
-Description=Run TVHub discovery every 30 seconds
-
-[Timer]
-OnBootSec=15
-OnUnitActiveSec=30
-Unit=tvhub-discover.service
+ExecStart=/opt/tvhub/venv/bin/python -m tvhub.discover_all --daemon
+Restart=on-failure
 
 [Install]
-WantedBy=timers.target
+WantedBy=multi-user.target
 EOF
 
+echo ">>> Removing legacy 30s discovery timer if present..."
+systemctl disable --now tvhub-discover.timer 2>/dev/null || true
+rm -f /etc/systemd/system/tvhub-discover.timer /etc/systemd/system/tvhub-discover.service
+
 echo ">>> Reloading systemd..."
 systemctl daemon-reload
 
 echo ">>> Enabling and starting services..."
 systemctl enable tvhub.service
-systemctl enable tvhub-discover.timer
+systemctl enable tvhub-discoverd.service
 
 systemctl restart tvhub.service
-systemctl restart tvhub-discover.timer
+systemctl restart tvhub-discoverd.service
 
 echo ""
 echo "==============================================="
 echo "        TVHub Installation Complete!"
 echo "-----------------------------------------------"
 echo " API running at:        http://<server>:10001"
-echo " Discovery runs every:  30 seconds"
+echo " Discovery:             resident (tvhub-discoverd)"
 echo " ADB installed at:      /opt/platform-tools/adb"
 echo " Service user:          tvhub"
 echo "==============================================="
@@ -0,0 +1,6 @@
+"""Run with `python -m pytest tests` (or `python -m unittest discover -s tests -t .`)."""
+import os
+import tempfile
+
+# tvhub.config reads this on import; keep tests away from /var/lib/tvhub.
+os.environ.setdefault("TVHUB_DATA_DIR", tempfile.mkdtemp(prefix="tvhub-tests-"))
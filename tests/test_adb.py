@@ -0,0 +1,73 @@
+import unittest
+
+from bench.fake_devices import FakeAdbServer
+from tvhub.adb import AdbClient, AdbPool, AdbShell
+
+SERIAL = "10.0.0.5:5555"
+
+
+class AdbTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeAdbServer().start()
+        self.addCleanup(self.server.stop)
+        self.client = AdbClient(self.server.address, timeout=2.0)
+
+
+class AdbClientTest(AdbTestCase):
+    def test_connect_returns_server_message(self):
+        self.assertEqual(self.client.connect(SERIAL), f"connected to {SERIAL}")
+        self.assertEqual(self.server.requests, [f"host:connect:{SERIAL}"])
+
+    def test_service_is_opened_on_the_device_transport(self):
+        self.client.shell(SERIAL, "true")
+        self.assertEqual(self.server.requests[0], f"host:transport:{SERIAL}")
+        self.assertTrue(self.server.requests[1].startswith("exec:sh -c 'true'"))
+
+    def test_one_shot_exit_status_and_output(self):
+        self.server.replies["false"] = ("nope\n", 1)
+        result = self.client.shell(SERIAL, "false")
+        self.assertEqual((result.returncode, result.stdout), (1, "nope\n"))
+
+    def test_one_shot_output_without_trailing_newline(self):
+        self.server.replies["printf hi"] = ("hi", 0)
+        result = self.client.shell(SERIAL, "printf hi")
+        self.assertEqual((result.returncode, result.stdout), (0, "hi"))
+
+
+class AdbShellTest(AdbTestCase):
+    def setUp(self):
+        super().setUp()
+        self.shell = AdbShell(self.client, SERIAL)
+        self.addCleanup(self.shell.close)
+
+    def test_exit_status_and_output_per_command(self):
+        self.server.replies["a"] = ("one\ntwo\n", 0)
+        self.server.replies["b"] = ("", 3)
+        first, second = self.shell.run_many(["a", "b"])
+        self.assertEqual((first.returncode, first.stdout), (0, "one\ntwo\n"))
+        self.assertEqual((second.returncode, second.stdout), (3, ""))
+        self.assertEqual(self.server.requests.count("exec:sh"), 1)
+
+    def test_marker_after_output_without_trailing_newline(self):
+        self.server.replies["printf hi"] = ("hi", 0)
+        self.server.replies["echo next"] = ("next\n", 0)
+        first, second = self.shell.run_many(["printf hi", "echo next"], timeout=2.0)
+        self.assertEqual(first.stdout, "hi")
+        self.assertEqual(second.stdout, "next\n")
+
+    def test_reconnects_after_server_closes_session(self):
+        self.shell.run("true")
+        self.server.drop_sessions()
+        self.server.replies["echo again"] = ("again\n", 0)
+        self.assertEqual(self.shell.run("echo again").stdout, "again\n")
+        self.assertEqual(self.server.requests.count("exec:sh"), 2)
+
+
+class AdbPoolTest(AdbTestCase):
+    def test_connects_once_and_reuses_the_shell(self):
+        pool = AdbPool(self.client)
+        self.addCleanup(pool.close)
+        pool.run(SERIAL, "true")
+        pool.run(SERIAL, "true")
+        self.assertEqual(self.server.requests,
+                         [f"host:connect:{SERIAL}", f"host:transport:{SERIAL}", "exec:sh"])
@@ -0,0 +1,53 @@
+import asyncio
+import threading
+import unittest
+
+from tvhub.commands import CommandQueues
+from tvhub.discovery import DiscoveryCollector, _discover
+from tvhub.plugins import PluginBase
+from tvhub.registry import Device
+
+
+class _SyncPlugin(PluginBase):
+    type = "sync"
+
+    def handle_action(self, registry, device, action, params):
+        return {"ok": True, "thread": threading.current_thread().name}
+
+
+class _AsyncPlugin(PluginBase):
+    type = "async"
+
+    async def handle_action_async(self, registry, device, action, params):
+        await asyncio.sleep(0)
+        return {"ok": True, "thread": threading.current_thread().name}
+
+    async def discover_async(self, registry, timeout=None):
+        await asyncio.sleep(0)
+        registry.upsert(Device(id="found", name="found", type=self.type, address="x", meta={}))
+
+
+DEVICE = Device(id="tv", name="TV", type="x", address="127.0.0.1", meta={})
+
+
+class AsyncHooksTest(unittest.TestCase):
+    def test_queue_runs_native_async_plugins_on_the_plugin_loop(self):
+        result = CommandQueues(None).submit(_AsyncPlugin(), DEVICE, "a", {}).result(5)
+        self.assertEqual(result["thread"], "tvhub-plugin-loop")
+
+    def test_queue_runs_sync_plugins_on_its_own_thread(self):
+        result = CommandQueues(None).submit(_SyncPlugin(), DEVICE, "a", {}).result(5)
+        self.assertEqual(result["thread"], "tvhub-queue-tv")
+
+    def test_default_async_hook_offloads_sync_plugins(self):
+        result = asyncio.run(_SyncPlugin().handle_action_async(None, DEVICE, "a", {}))
+        self.assertTrue(result["thread"].startswith("tvhub-offload"))
+
+    def test_discovery_awaits_discover_async(self):
+        collector = DiscoveryCollector(None)
+        _discover(_AsyncPlugin(), collector, 1.0)
+        self.assertEqual(list(collector.seen), ["found"])
+
+
+if __name__ == "__main__":
+    unittest.main()
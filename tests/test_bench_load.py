@@ -0,0 +1,55 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bench.load import drive, free_port
+from bench.loadtest import KEYS
+
+try:
+    from tvhub.plugins.gtv import GoogleTVPlugin
+except ImportError:
+    GoogleTVPlugin = None
+
+
+class _StatusHandler(BaseHTTPRequestHandler):
+    """Answers /<status> with that status and an empty body."""
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.send_response(int(self.path.strip("/")))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_GET = do_POST = _reply
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+class DriveTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _StatusHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.port = self.server.server_address[1]
+
+    def test_non_2xx_responses_count_as_errors_by_status(self):
+        result = drive("127.0.0.1", self.port, [("GET", "/200"), ("GET", "/404"), ("POST", "/500")],
+                       concurrency=2, total=9)
+        self.assertEqual(result["requests"], 9)
+        self.assertEqual(result["errors"], 6)
+        self.assertEqual(result["error_statuses"], {"404": 3, "500": 3})
+
+    def test_refused_connections_count_as_errors(self):
+        result = drive("127.0.0.1", free_port(), [("GET", "/200")], concurrency=1, total=3)
+        self.assertEqual(result["error_statuses"], {"connection": 3})
+        self.assertEqual(result["latency_ms"]["max"], 0.0)
+
+
+class LoadtestKeysTest(unittest.TestCase):
+    @unittest.skipUnless(GoogleTVPlugin, "needs zeroconf")
+    def test_keys_are_in_the_gtv_keymap(self):
+        self.assertEqual([k for k in KEYS if k not in GoogleTVPlugin.KEYCODES], [])
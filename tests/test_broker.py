@@ -0,0 +1,33 @@
+import secrets
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from tvhub import core
+from tvhub.broker import BrokerClient, BrokerServer
+
+
+class BrokerFanoutTest(unittest.TestCase):
+    def setUp(self):
+        address = str(Path(tempfile.mkdtemp(prefix="tvhub-broker-")) / "broker.sock")
+        authkey = secrets.token_bytes(16)
+        server = BrokerServer(address, authkey)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.client = BrokerClient(address, authkey)
+
+    def test_failing_fanout_ends_with_an_error_record(self):
+        def broken(*args):
+            yield {"type": "result", "device": "a"}
+            raise RuntimeError("selector blew up")
+
+        with mock.patch.object(core, "run_fanout", broken), \
+                mock.patch.object(core, "scene_list", lambda: {"ok": True}):
+            records = list(self.client.run_fanout({}, "power", {}))
+            self.assertEqual(records[0], {"type": "result", "device": "a"})
+            self.assertEqual(records[1]["type"], "error")
+            self.assertEqual(records[1]["status"], 500)
+            self.assertIn("selector blew up", records[1]["result"]["error"])
+            # The connection went back to the pool in a usable state.
+            self.assertEqual(self.client.scene_list(), {"ok": True})
@@ -0,0 +1,29 @@
+import gzip
+import unittest
+from unittest import mock
+
+from tvhub import core
+
+BODY = b'{"ok":true,"devices":[]}'
+
+
+class DevicesResponseTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(core, "_devices_body",
+                                    lambda: ('"abc"', BODY, gzip.compress(BODY)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_gzip_and_identity_have_distinct_etags(self):
+        _, plain, body = core.devices_response()
+        self.assertEqual(body, BODY)
+        _, zipped, body = core.devices_response(accept_encoding="gzip, deflate")
+        self.assertEqual(gzip.decompress(body), BODY)
+        self.assertEqual(zipped["Content-Encoding"], "gzip")
+        self.assertEqual((plain["ETag"], zipped["ETag"]), ('"abc"', '"abc-gz"'))
+
+    def test_if_none_match_is_checked_against_the_chosen_representation(self):
+        self.assertEqual(core.devices_response('"abc"')[0], 304)
+        self.assertEqual(core.devices_response('W/"abc-gz"', "gzip")[0], 304)
+        self.assertEqual(core.devices_response('"abc"', "gzip")[0], 200)
+        self.assertEqual(core.devices_response('"abc-gz"')[0], 200)
@@ -0,0 +1,62 @@
+import json
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from tvhub.discovery import DiscoveryService, DiscoveryState
+from tvhub.registry import Device, DeviceRegistry
+
+
+class _Plugin:
+    type = "gtv"
+
+
+def _device(dev_id: str, dev_type: str = "gtv", **meta) -> Device:
+    return Device(id=dev_id, name=dev_id, type=dev_type, address=f"{dev_id}:5555", meta=meta)
+
+
+class DiscoveryServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = Path(tempfile.mkdtemp(prefix="tvhub-discovery-"))
+        self.registry = DeviceRegistry(self.dir / "devices.json")
+        self.service = DiscoveryService(self.registry, {}, grace=0.2)
+        self.service.state = DiscoveryState(self.dir / "state.json", self.dir / "changes.jsonl")
+
+    def _on_disk(self):
+        return sorted(json.loads((self.dir / "devices.json").read_text()))
+
+    def test_announcement_keeps_devices_added_to_the_file_meanwhile(self):
+        self.service.device_seen(_Plugin(), _device("adb-1"))
+        # Someone hand-seeds a TV while the daemon runs.
+        data = json.loads((self.dir / "devices.json").read_text())
+        data["hisense-lounge"] = {"id": "hisense-lounge", "name": "Lounge", "type": "hisense",
+                                  "address": "10.0.0.5", "meta": {}}
+        (self.dir / "devices.json").write_text(json.dumps(data))
+        self.service.device_seen(_Plugin(), _device("adb-2"))
+        self.assertEqual(self._on_disk(), ["adb-1", "adb-2", "hisense-lounge"])
+
+    def test_removal_waits_for_the_grace_period(self):
+        self.service.device_seen(_Plugin(), _device("adb-1"))
+        self.service.device_gone(_Plugin(), "adb-1")
+        self.assertIsNotNone(self.registry.get("adb-1"))
+        time.sleep(0.4)
+        self.assertIsNone(self.registry.get("adb-1"))
+        self.assertEqual(self._on_disk(), [])
+
+    def test_device_that_returns_within_grace_is_kept(self):
+        self.service.device_seen(_Plugin(), _device("adb-1"))
+        self.service.device_gone(_Plugin(), "adb-1")
+        self.service.device_seen(_Plugin(), _device("adb-1"))
+        time.sleep(0.4)
+        self.assertIsNotNone(self.registry.get("adb-1"))
+
+    def test_pinned_device_is_never_removed(self):
+        self.service.device_seen(_Plugin(), _device("adb-1", pinned=True))
+        self.service.device_gone(_Plugin(), "adb-1")
+        time.sleep(0.4)
+        self.assertIsNotNone(self.registry.get("adb-1"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import threading
+import time
+import unittest
+
+from bench.fake_devices import FakeDMR
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+if requests is not None:
+    from tvhub.upnp import EventSubscriber, _Subscription
+
+NOTIFY_BODY = (b'<?xml version="1.0"?><e:propertyset xmlns:e="urn:schemas-upnp-org:event-1-0">'
+               b"<e:property><LastChange>&lt;Event&gt;&lt;InstanceID val=&quot;0&quot;&gt;"
+               b"&lt;Volume channel=&quot;Master&quot; val=&quot;7&quot;/&gt;"
+               b"&lt;/InstanceID&gt;&lt;/Event&gt;</LastChange></e:property></e:propertyset>")
+
+
+@unittest.skipUnless(requests, "needs requests")
+class EventSubscriberTest(unittest.TestCase):
+    def setUp(self):
+        self.dmr = FakeDMR().start()
+        self.addCleanup(self.dmr.stop)
+        self.events = []
+        self.got_event = threading.Event()
+        self.subscriber = EventSubscriber(self._on_event)
+        self.addCleanup(self.subscriber.close)
+
+    def _on_event(self, key, values):
+        self.events.append((key, values))
+        self.got_event.set()
+
+    def test_subscribe_delivers_initial_notify(self):
+        self.dmr.volume = 23
+        self.assertTrue(self.subscriber.ensure("tv", self.dmr.event_url))
+        self.assertTrue(self.got_event.wait(3))
+        (key, values), = self.events
+        self.assertEqual((key, values["Volume"], values["Mute"]), ("tv", "23", "0"))
+        headers = self.dmr.subscriptions[0]
+        self.assertEqual(headers["NT"], "upnp:event")
+        self.assertEqual(headers["TIMEOUT"], "Second-300")
+        self.assertTrue(self.subscriber.is_active("tv"))
+
+    def test_second_ensure_does_not_resubscribe(self):
+        self.subscriber.ensure("tv", self.dmr.event_url)
+        self.assertTrue(self.subscriber.ensure("tv", self.dmr.event_url))
+        self.assertEqual(len(self.dmr.subscriptions), 1)
+
+    def test_renew_sends_sid_and_keeps_it(self):
+        self.subscriber.ensure("tv", self.dmr.event_url)
+        sub = self.subscriber._subs["tv"]
+        sid = sub.sid
+        self.assertTrue(self.subscriber._renew(sub))
+        renewal = self.dmr.subscriptions[-1]
+        self.assertEqual(renewal["SID"], sid)
+        self.assertNotIn("CALLBACK", renewal)
+        self.assertEqual(sub.sid, sid)
+
+    def test_failed_renew_resubscribes(self):
+        self.subscriber.ensure("tv", self.dmr.event_url)
+        sub = self.subscriber._subs["tv"]
+        old_sid = sub.sid
+        self.dmr.stop()
+        self.assertFalse(self.subscriber._renew(sub))
+        self.assertIsNone(sub.sid)
+        self.assertNotIn(old_sid, self.subscriber._by_sid)
+
+    def test_notify_before_subscribe_response_is_delivered(self):
+        self.subscriber._notify("uuid:early", NOTIFY_BODY)
+        self.subscriber._set_sid(_Subscription("tv", self.dmr.event_url), "uuid:early", "Second-60")
+        self.assertEqual([(k, v["Volume"]) for k, v in self.events], [("tv", "7")])
+
+    def test_unclaimed_early_notifies_expire(self):
+        self.subscriber.EARLY_TTL = 0.05
+        self.subscriber._notify("uuid:stale", NOTIFY_BODY)
+        time.sleep(0.1)
+        self.subscriber._notify("uuid:other", NOTIFY_BODY)
+        self.assertEqual(list(self.subscriber._early), ["uuid:other"])
+        self.subscriber._set_sid(_Subscription("tv", self.dmr.event_url), "uuid:stale", None)
+        self.assertEqual(self.events, [])
+
+    def test_early_buffer_evicts_oldest_when_full(self):
+        self.subscriber.EARLY_MAX = 2
+        for sid in ("uuid:a", "uuid:b", "uuid:c"):
+            self.subscriber._notify(sid, NOTIFY_BODY)
+        self.assertEqual(list(self.subscriber._early), ["uuid:b", "uuid:c"])
@@ -0,0 +1,66 @@
+import socket
+import unittest
+
+from tvhub.liveness import LivenessMonitor
+from tvhub.registry import Device
+
+
+def _closed_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class _Plugin:
+    """Probes a port nobody listens on, like a TV whose probe port differs
+    from the one its transport uses."""
+
+    def __init__(self, port: int):
+        self.port = port
+
+    def probe_address(self, device):
+        return "127.0.0.1", self.port
+
+
+class _Registry:
+    def __init__(self, *devices):
+        self.devices = {d.id: d for d in devices}
+
+    def all(self):
+        return list(self.devices.values())
+
+    def refresh(self):
+        return False
+
+
+class LivenessTest(unittest.TestCase):
+    def setUp(self):
+        self.device = Device(id="tv", name="TV", type="fake", address="127.0.0.1", meta={})
+        self.monitor = LivenessMonitor(_Registry(self.device), {"fake": _Plugin(_closed_port())},
+                                       interval=60, timeout=0.2, failures=2)
+
+    def test_failed_probes_open_the_breaker(self):
+        for _ in range(2):
+            self.monitor.probe(self.device)
+        self.assertIs(self.monitor.online("tv"), False)
+        self.assertFalse(self.monitor.allow("tv"))
+
+    def test_device_answering_actions_is_not_marked_offline(self):
+        self.monitor.answered("tv")
+        for _ in range(5):
+            self.monitor.probe(self.device)
+            self.monitor.answered("tv")
+            self.monitor.probe(self.device)
+        self.assertIs(self.monitor.online("tv"), True)
+        self.assertTrue(self.monitor.allow("tv"))
+
+    def test_answer_closes_an_open_breaker(self):
+        for _ in range(2):
+            self.monitor.probe(self.device)
+        self.monitor.answered("tv")
+        self.assertIs(self.monitor.online("tv"), True)
+        self.assertTrue(self.monitor.allow("tv"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from tvhub.registry import Device
+from tvhub.sqlite_registry import SQLiteDeviceRegistry
+
+
+def _device(dev_id: str) -> Device:
+    return Device(id=dev_id, name=dev_id, type="gtv", address=f"{dev_id}:5555", meta={})
+
+
+class SQLiteRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = Path(tempfile.mkdtemp(prefix="tvhub-sqlite-"))
+        self.registry = self._open()
+
+    def _open(self) -> SQLiteDeviceRegistry:
+        return SQLiteDeviceRegistry(self.dir / "devices.db", self.dir / "devices.json")
+
+    def _seen_from_other_thread(self):
+        seen = []
+        t = threading.Thread(target=lambda: seen.append(sorted(d.id for d in self.registry.all())))
+        t.start()
+        t.join()
+        return seen[0]
+
+    def test_batch_is_invisible_to_other_threads_until_commit(self):
+        with self.registry.batch():
+            self.registry.upsert(_device("a"))
+            self.assertEqual([d.id for d in self.registry.all()], ["a"])
+            self.assertEqual(self._seen_from_other_thread(), [])
+        self.assertEqual(self._seen_from_other_thread(), ["a"])
+
+    def test_rolled_back_batch_is_never_seen(self):
+        generation = self.registry.generation
+        with self.assertRaises(RuntimeError):
+            with self.registry.batch():
+                self.registry.upsert(_device("a"))
+                self.assertEqual(self._seen_from_other_thread(), [])
+                raise RuntimeError
+        self.assertEqual(self._seen_from_other_thread(), [])
+        self.assertEqual(self.registry.generation, generation)
+
+    def test_other_instance_sees_changes_on_refresh(self):
+        other = self._open()
+        self.registry.upsert(_device("a"))
+        self.registry.remove("a")
+        self.registry.upsert(_device("b"))
+        self.assertTrue(other.refresh())
+        self.assertEqual(sorted(d.id for d in other.all()), ["b"])
+        self.assertEqual(other.generation, self.registry.generation)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from bench.fake_devices import FakeDMR, FakeSSDPResponder
+from tvhub.registry import Device, DeviceRegistry
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+if requests is not None:
+    from tvhub.plugins import hisense
+    from tvhub.upnp import ssdp_search
+
+
+@unittest.skipUnless(requests, "needs requests")
+class SSDPDiscoveryTest(unittest.TestCase):
+    """Discovery against a unicast responder, as TVHUB_SSDP_ADDR sets up."""
+
+    def setUp(self):
+        self.dmr = FakeDMR().start()
+        self.addCleanup(self.dmr.stop)
+        self.responder = FakeSSDPResponder([self.dmr]).start()
+        self.addCleanup(self.responder.stop)
+        patcher = mock.patch.object(hisense, "SSDP_ADDRESS", self.responder.address)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.dir = Path(tempfile.mkdtemp(prefix="tvhub-ssdp-"))
+        self.registry = DeviceRegistry(self.dir / "devices.json")
+        self.plugin = hisense.HisenseTVPlugin()
+
+    def test_search_reports_each_responder_once(self):
+        found = []
+        count = ssdp_search(hisense.MEDIA_RENDERER, 0.6, found.append,
+                            address=self.responder.address)
+        self.assertEqual(count, 1)
+        self.assertEqual(found[0]["LOCATION"], self.dmr.location)
+        self.assertGreaterEqual(self.responder.searches, 1)
+
+    def test_discovered_tv_is_registered_and_removable(self):
+        self.plugin.discover(self.registry, timeout=1.0)
+        (device,) = self.registry.all()
+        self.assertEqual(device.address, "127.0.0.1")
+        self.assertEqual(device.meta["udn"], self.dmr.udn)
+        self.assertEqual(device.meta["rcs_control_url"], self.dmr.control_url)
+        self.assertEqual(device.meta["rcs_event_url"], self.dmr.event_url)
+        self.assertTrue(self.plugin.removable(device))
+
+    def test_other_renderers_are_ignored(self):
+        self.dmr.manufacturer = "Acme"
+        self.plugin.discover(self.registry, timeout=1.0)
+        self.assertEqual(self.registry.all(), [])
+
+    def test_adopted_seeded_tv_stays_unremovable(self):
+        self.registry.upsert(Device(id="den", name="Den TV", type="hisense",
+                                    address="127.0.0.1", meta={}))
+        self.plugin.discover(self.registry, timeout=1.0)
+        (device,) = self.registry.all()
+        self.assertEqual((device.id, device.name), ("den", "Den TV"))
+        self.assertEqual(device.meta["udn"], self.dmr.udn)
+        self.assertFalse(self.plugin.removable(device))
+        # Later runs keep it that way.
+        self.plugin.discover(self.registry, timeout=1.0)
+        self.assertFalse(self.plugin.removable(self.registry.get("den")))
@@ -0,0 +1,319 @@
+"""Minimal client for the adb server's smart-socket protocol.
+
+Talks to the local adb server (default 127.0.0.1:5037) directly instead of
+forking the adb binary, and keeps one long-lived ``exec:sh`` session per
+device so that a keypress is a single write on an open socket.
+
+Protocol recap: each request is ``<4 hex digit length><payload>``, answered
+with ``OKAY`` or ``FAIL<4 hex length><message>``. ``host:transport:<serial>``
+binds the socket to a device; the next request (``shell:...`` /
+``exec:...``) turns it into a raw stream for that service.
+"""
+from __future__ import annotations
+import itertools
+import select
+import socket
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .config import ADB_SERVER
+
+
+class AdbError(Exception):
+    """The adb server refused a request (FAIL) or the stream broke."""
+
+
+class AdbServerUnavailable(AdbError):
+    """Nothing is listening on the adb server port."""
+
+
+class AdbTransportError(AdbError):
+    """The server has no usable transport for the device (nothing was sent)."""
+
+
+@dataclass
+class ShellResult:
+    """Mirrors the bits of subprocess.CompletedProcess the plugins use."""
+    returncode: int
+    stdout: str
+    stderr: str = ""
+
+
+def _parse_server(spec: str) -> Tuple[str, int]:
+    host, _, port = spec.rpartition(":")
+    return (host or "127.0.0.1", int(port or 5037))
+
+
+class AdbClient:
+    def __init__(self, server: str = ADB_SERVER, timeout: float = 5.0):
+        self.host, self.port = _parse_server(server)
+        self.timeout = timeout
+
+    # --- wire helpers ---
+
+    def _open(self, timeout: Optional[float] = None) -> socket.socket:
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout or self.timeout)
+        except ConnectionRefusedError as e:
+            raise AdbServerUnavailable(f"adb server not running on {self.host}:{self.port}") from e
+        except OSError as e:
+            raise AdbServerUnavailable(str(e)) from e
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    @staticmethod
+    def _recv_exact(sock: socket.socket, n: int) -> bytes:
+        buf = b""
+        while len(buf) < n:
+            chunk = sock.recv(n - len(buf))
+            if not chunk:
+                raise AdbError("adb server closed connection")
+            buf += chunk
+        return buf
+
+    def _request(self, sock: socket.socket, payload: str) -> None:
+        data = payload.encode("utf-8")
+        sock.sendall(b"%04x" % len(data) + data)
+        status = self._recv_exact(sock, 4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            raise AdbError(self._read_string(sock))
+        raise AdbError(f"unexpected adb reply {status!r}")
+
+    def _read_string(self, sock: socket.socket) -> str:
+        length = int(self._recv_exact(sock, 4), 16)
+        return self._recv_exact(sock, length).decode("utf-8", "replace")
+
+    # --- host services ---
+
+    def connect(self, addr: str) -> str:
+        """Equivalent of `adb connect addr`; returns the server's message."""
+        sock = self._open()
+        try:
+            self._request(sock, f"host:connect:{addr}")
+            msg = self._read_string(sock)
+        finally:
+            sock.close()
+        if "connected" not in msg or "cannot" in msg or "failed" in msg:
+            raise AdbError(msg)
+        return msg
+
+    def open_service(self, serial: str, service: str,
+                     timeout: Optional[float] = None) -> socket.socket:
+        """Return a socket streaming `service` (e.g. 'shell:ls') on `serial`."""
+        sock = self._open(timeout)
+        try:
+            self._request(sock, f"host:transport:{serial}")
+            self._request(sock, service)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    # --- device services ---
+
+    def exec_lines(self, serial: str, cmd: str,
+                   timeout: Optional[float] = None) -> Iterator[str]:
+        """Run `cmd` via exec: and yield output lines as they arrive.
+
+        Closing the generator early closes the socket, which stops the
+        command on the device.
+        """
+        sock = self.open_service(serial, f"exec:{cmd}", timeout)
+        try:
+            f = sock.makefile("rb")
+            for raw in f:
+                yield raw.decode("utf-8", "replace").rstrip("\r\n")
+        finally:
+            sock.close()
+
+    def shell(self, serial: str, cmd: str, timeout: Optional[float] = None) -> ShellResult:
+        """One-shot command with exit status, no process spawn."""
+        marker = "__TVHUB_RC__"
+        lines: List[str] = []
+        for line in self.exec_lines(serial, f"sh -c {_sh_quote(cmd)} 2>&1; echo {marker}$?", timeout):
+            found = _find_marker(line, marker)
+            if found is not None:
+                return _result(lines, found[1], found[0])
+            lines.append(line)
+        return _result(lines, 0, "")
+
+
+def _sh_quote(s: str) -> str:
+    return "'" + s.replace("'", "'\"'\"'") + "'"
+
+
+def _find_marker(line: str, marker: str) -> Optional[Tuple[str, int]]:
+    """(output before the marker, exit status) if line holds `marker<rc>`.
+
+    The marker can follow output that didn't end in a newline, so it is
+    looked for anywhere in the line, not just at the start.
+    """
+    i = line.find(marker)
+    if i < 0:
+        return None
+    rc = line[i + len(marker):].strip()
+    return line[:i], int(rc) if rc.lstrip("-").isdigit() else 0
+
+
+def _result(lines: List[str], rc: int, tail: str) -> ShellResult:
+    if tail:
+        return ShellResult(rc, "\n".join(lines + [tail]))
+    return ShellResult(rc, "\n".join(lines) + ("\n" if lines else ""))
+
+
+class AdbShell:
+    """A persistent `exec:sh` session on one device.
+
+    Commands are written to the shell's stdin followed by an echo of a
+    unique marker with the exit status, so each command costs one
+    round trip and no new adb transport.
+    """
+
+    def __init__(self, client: AdbClient, serial: str):
+        self.client = client
+        self.serial = serial
+        self._sock: Optional[socket.socket] = None
+        self._rfile = None
+        self._lock = threading.Lock()
+        self._seq = itertools.count(1)
+
+    def _ensure_open(self) -> None:
+        if self._sock is None:
+            try:
+                self._sock = self.client.open_service(self.serial, "exec:sh")
+            except AdbServerUnavailable:
+                raise
+            except (OSError, AdbError) as e:
+                raise AdbTransportError(str(e)) from e
+            self._rfile = self._sock.makefile("rb")
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+
+    def _close(self) -> None:
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._rfile = None
+
+    def _stale(self) -> bool:
+        """True if the server already hung up on our idle session."""
+        try:
+            readable, _, _ = select.select([self._sock], [], [], 0)
+            return bool(readable) and not self._sock.recv(1, socket.MSG_PEEK)
+        except OSError:
+            return True
+
+    def _send(self, cmd: str) -> str:
+        marker = f"__TVHUB_DONE_{next(self._seq)}__"
+        self._sock.sendall(f"{{ {cmd}\n}} 2>&1; echo {marker}$?\n".encode("utf-8"))
+        return marker
+
+    def _collect(self, marker: str) -> ShellResult:
+        lines = []
+        while True:
+            raw = self._rfile.readline()
+            if not raw:
+                raise AdbError("adb shell session closed")
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            found = _find_marker(line, marker)
+            if found is not None:
+                return _result(lines, found[1], found[0])
+            lines.append(line)
+
+    def run(self, cmd: str, timeout: Optional[float] = None) -> ShellResult:
+        return self.run_many([cmd], timeout)[-1]
+
+    def run_many(self, cmds, timeout: Optional[float] = None) -> list:
+        """Pipeline several commands: write them all, then read all results.
+
+        A session that was idle may have died under us (TV slept, adb
+        server restarted); one the server has visibly closed is replaced
+        before writing, and if writing to it fails, the commands are sent
+        once more on a fresh session. Once they have been written, a read
+        error or timeout closes the session and raises: the device may
+        already have run them, and keypresses must not be delivered twice.
+        """
+        with self._lock:
+            if self._sock is not None and self._stale():
+                self._close()
+            reused = self._sock is not None
+            for attempt in (0, 1):
+                try:
+                    self._ensure_open()
+                    self._sock.settimeout(timeout or self.client.timeout)
+                    markers = [self._send(c) for c in cmds]
+                    break
+                except (AdbServerUnavailable, AdbTransportError):
+                    raise
+                except (OSError, AdbError):
+                    self._close()
+                    if attempt or not reused:
+                        raise
+            try:
+                return [self._collect(m) for m in markers]
+            except BaseException:
+                self._close()
+                raise
+
+
+class AdbPool:
+    """Per-device persistent shells, created on first use and reused."""
+
+    def __init__(self, client: Optional[AdbClient] = None):
+        self.client = client or AdbClient()
+        self._shells: Dict[str, AdbShell] = {}
+        self._lock = threading.Lock()
+        # One lock per address for `adb connect`, so a TV that doesn't
+        # answer only holds up callers for that TV.
+        self._connect_locks: Dict[str, threading.Lock] = {}
+
+    def shell(self, addr: str) -> AdbShell:
+        with self._lock:
+            sh = self._shells.get(addr)
+            if sh is not None:
+                return sh
+            connect_lock = self._connect_locks.setdefault(addr, threading.Lock())
+        with connect_lock:
+            with self._lock:
+                sh = self._shells.get(addr)
+            if sh is None:
+                if ":" in addr:
+                    # Network device: make sure the server has a transport.
+                    self.client.connect(addr)
+                sh = AdbShell(self.client, addr)
+                with self._lock:
+                    self._shells[addr] = sh
+            return sh
+
+    def run(self, addr: str, cmd: str, timeout: Optional[float] = None) -> ShellResult:
+        return self.run_many(addr, [cmd], timeout)[-1]
+
+    def run_many(self, addr: str, cmds, timeout: Optional[float] = None) -> list:
+        try:
+            return self.shell(addr).run_many(cmds, timeout)
+        except AdbTransportError:
+            # The server lost the transport (e.g. "device not found");
+            # adb connect again and retry. Nothing was sent yet.
+            self.drop(addr)
+            return self.shell(addr).run_many(cmds, timeout)
+
+    def drop(self, addr: str) -> None:
+        with self._lock:
+            sh = self._shells.pop(addr, None)
+        if sh is not None:
+            sh.close()
+
+    def close(self) -> None:
+        with self._lock:
+            shells = list(self._shells.values())
+            self._shells.clear()
+        for sh in shells:
+            sh.close()
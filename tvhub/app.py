@@ -1,22 +1,54 @@
 #!/usr/bin/env python3
 from __future__ import annotations
-from flask import Flask, jsonify, request, render_template_string
-from typing import Dict, Any
+import json
+from flask import Flask, Response, jsonify, request, render_template_string, stream_with_context
+from typing import Dict, Any, Tuple
 
-from .registry import DeviceRegistry
-from .plugins import load_plugins
+from .events import bus
+from .discovery import read_changes
+from .config import HTTP_HOST, HTTP_PORT
+from . import metrics
 
 app = Flask(__name__)
 
-registry = DeviceRegistry()
-plugins = load_plugins()
+# Where requests are answered: tvhub.core in this process, or, in a
+# pre-fork worker, a tvhub.broker.BrokerClient with the same functions.
+# tvhub.core opens the registry and loads plugins when imported, so it is
+# only imported here if nothing else was set before the first request.
+backend: Any = None
 
-def refresh_registry():
-    """Reload devices from devices.json so API sees latest discoveries."""
-    try:
-        registry.load()
-    except Exception as e:
-        app.logger.exception("Error refreshing registry: %s", e)
+
+def _backend():
+    global backend
+    if backend is None:
+        from . import core
+        backend = core
+    return backend
+
+SSE_KEEPALIVE = 15.0
+
+
+def sse_format(event: Dict[str, Any]) -> str:
+    return "data: " + json.dumps(event) + "\n\n"
+
+
+def sse_hello() -> str:
+    return sse_format({"type": "hello", "generation": _backend().refresh_registry()})
+
+
+def fanout_request(body: Dict[str, Any], query: Dict[str, Any]
+                   ) -> Tuple[Dict[str, Any], Dict[str, Any], Any]:
+    """(selector, params, deadline) from a bulk request body and query string.
+
+    Body: {"selector": {...}, "params": {...}, "deadline": 5}; the query
+    may supply ids/type/tag/deadline instead.
+    """
+    selector = dict(body.get("selector") or {}) if isinstance(body.get("selector"), dict) else {}
+    for key in ("ids", "type", "tag"):
+        if query.get(key):
+            selector[key] = query[key]
+    params = body.get("params") if isinstance(body.get("params"), dict) else {}
+    return selector, params, query.get("deadline", body.get("deadline"))
 
 REMOTE_HTML = """<!doctype html>
 <html>
@@ -193,18 +225,110 @@ REMOTE_HTML = """<!doctype html>
 let devices = [];
 let current = null;
 
+// Persistent channel: a WebSocket carries key presses and pushed state when
+// the server supports it (tvhub.asgi); otherwise actions go over fetch and
+// state arrives via server-sent events.
+let ws = null;
+let wsSeq = 0;
+const wsPending = {};
+
+function connectEvents() {
+  const proto = location.protocol === 'https:' ? 'wss://' : 'ws://';
+  let opened = false;
+  try {
+    ws = new WebSocket(proto + location.host + '/ws');
+  } catch (e) {
+    ws = null;
+  }
+  if (!ws) {
+    connectSSE();
+    return;
+  }
+  ws.onopen = () => { opened = true; };
+  ws.onmessage = (msg) => {
+    const ev = JSON.parse(msg.data);
+    if (ev.type === 'result') {
+      const done = wsPending[ev.id];
+      delete wsPending[ev.id];
+      if (done) done(ev.result);
+    } else {
+      onEvent(ev);
+    }
+  };
+  ws.onclose = () => {
+    ws = null;
+    Object.keys(wsPending).forEach(id => {
+      wsPending[id]({ok: false, error: 'connection lost'});
+      delete wsPending[id];
+    });
+    if (opened) {
+      setTimeout(connectEvents, 1000);
+    } else {
+      connectSSE();
+    }
+  };
+}
+
+function connectSSE() {
+  if (!window.EventSource) return;
+  const es = new EventSource('/api/events');
+  es.onmessage = (msg) => onEvent(JSON.parse(msg.data));
+}
+
+function onEvent(ev) {
+  if (ev.type === 'devices') {
+    loadDevices();
+  } else if (ev.type === 'state' && ev.online !== undefined) {
+    loadDevices();
+  } else if (ev.type === 'state' && current && ev.device === current.id) {
+    if (ev.volume !== undefined) {
+      document.getElementById('hisenseVolume').value = ev.volume;
+      document.getElementById('hisenseVolLabel').textContent = 'Volume: ' + ev.volume;
+    }
+    if (ev.mute !== undefined) {
+      document.getElementById('status').textContent = 'Mute: ' + (ev.mute ? 'ON' : 'OFF');
+    }
+    if (ev.package) {
+      document.getElementById('status').textContent = 'Now showing ' + ev.package;
+    }
+  }
+}
+
+async function callAction(action, params) {
+  const id = current.id;
+  if (ws && ws.readyState === WebSocket.OPEN) {
+    const seq = ++wsSeq;
+    return new Promise(resolve => {
+      wsPending[seq] = resolve;
+      ws.send(JSON.stringify({id: seq, device: id, action: action, params: params || {}}));
+    });
+  }
+  const res = await fetch('/api/device/' + encodeURIComponent(id) + '/action/' + action, {
+    method: 'POST',
+    headers: {'Content-Type': 'application/json'},
+    body: JSON.stringify(params || {})
+  });
+  return res.json();
+}
+
 async function loadDevices() {
   const res = await fetch('/api/devices');
   const data = await res.json();
+  const keep = current ? current.id : null;
   devices = data.devices || [];
   const sel = document.getElementById('deviceSelect');
   sel.innerHTML = '';
   devices.forEach(d => {
     const opt = document.createElement('option');
     opt.value = d.id;
-    opt.textContent = d.name + ' (' + d.type + ')';
+    opt.textContent = d.name + ' (' + d.type + ')' + (d.online === false ? ' - offline' : '');
     sel.appendChild(opt);
   });
+  if (keep && devices.some(d => d.id === keep)) {
+    sel.value = keep;
+    current = devices.find(d => d.id === keep);
+    return;
+  }
   if (devices.length > 0) {
     sel.value = devices[0].id;
     current = devices[0];
@@ -238,12 +362,7 @@ async function sendGTV(button) {
   if (!current) return;
   const st = document.getElementById('status');
   st.textContent = 'Sending ' + button + '...';
-  const res = await fetch('/api/device/' + encodeURIComponent(current.id) + '/action/button', {
-    method: 'POST',
-    headers: {'Content-Type': 'application/json'},
-    body: JSON.stringify({key: button})
-  });
-  const data = await res.json();
+  const data = await callAction('button', {key: button});
   if (data.ok) {
     st.textContent = 'Sent ' + button;
   } else {
@@ -255,8 +374,7 @@ async function refreshHisense() {
   if (!current) return;
   const st = document.getElementById('status');
   st.textContent = 'Refreshing volume...';
-  const res = await fetch('/api/device/' + encodeURIComponent(current.id) + '/action/get_volume');
-  const data = await res.json();
+  const data = await callAction('get_volume');
   const volLabel = document.getElementById('hisenseVolLabel');
   if (data.ok) {
     const v = data.volume;
@@ -272,12 +390,7 @@ async function setHisenseVolume(v) {
   if (!current) return;
   const volLabel = document.getElementById('hisenseVolLabel');
   volLabel.textContent = 'Volume: ' + v + ' (setting...)';
-  const res = await fetch('/api/device/' + encodeURIComponent(current.id) + '/action/set_volume', {
-    method: 'POST',
-    headers: {'Content-Type': 'application/json'},
-    body: JSON.stringify({volume: v})
-  });
-  const data = await res.json();
+  const data = await callAction('set_volume', {volume: v});
   if (data.ok) {
     volLabel.textContent = 'Volume: ' + data.volume;
   } else {
@@ -288,24 +401,18 @@ async function setHisenseVolume(v) {
 async function hisenseStep(delta) {
   if (!current) return;
   const action = delta > 0 ? 'volume_up' : 'volume_down';
-  const res = await fetch('/api/device/' + encodeURIComponent(current.id) + '/action/' + action, {
-    method: 'POST',
-    headers: {'Content-Type': 'application/json'},
-    body: JSON.stringify({step: Math.abs(delta)})
-  });
-  const data = await res.json();
+  const data = await callAction(action, {step: Math.abs(delta)});
   if (data.ok) {
-    document.getElementById('hisenseVolume').value = data.to;
-    document.getElementById('hisenseVolLabel').textContent = 'Volume: ' + data.to;
+    // Steps merged into a pending set_volume come back as {volume}.
+    const v = data.to !== undefined ? data.to : data.volume;
+    document.getElementById('hisenseVolume').value = v;
+    document.getElementById('hisenseVolLabel').textContent = 'Volume: ' + v;
   }
 }
 
 async function toggleHisenseMute() {
   if (!current) return;
-  const res = await fetch('/api/device/' + encodeURIComponent(current.id) + '/action/toggle_mute', {
-    method: 'POST'
-  });
-  const data = await res.json();
+  const data = await callAction('toggle_mute');
   const st = document.getElementById('status');
   if (data.ok) {
     st.textContent = 'Mute: ' + (data.to ? 'ON' : 'OFF');
@@ -314,7 +421,10 @@ async function toggleHisenseMute() {
   }
 }
 
-window.addEventListener('load', loadDevices);
+window.addEventListener('load', () => {
+  loadDevices();
+  connectEvents();
+});
 </script>
 </body>
 </html>
@@ -329,49 +439,87 @@ def remote():
 
 @app.route("/api/devices")
 def api_devices():
-    # Always reload in case discovery has updated devices.json
-    refresh_registry()
-
-    ds = [
-        {
-            "id": d.id,
-            "name": d.name,
-            "type": d.type,
-            "address": d.address,
-            "meta": d.meta,
-            "actions": list(plugins.get(d.type).actions().keys()) if d.type in plugins else [],
-        }
-        for d in registry.all()
-    ]
-    return jsonify({"ok": True, "devices": ds})
+    status, headers, body = _backend().devices_response(request.headers.get("If-None-Match", ""),
+                                                        request.headers.get("Accept-Encoding", ""))
+    return Response(body, status=status, headers=headers)
+
+@app.route("/metrics")
+def api_metrics():
+    return Response(_backend().metrics_text(), content_type=metrics.CONTENT_TYPE)
+
+@app.route("/api/changes")
+def api_changes():
+    """Discovery change log (added/changed/removed), entries after ?since=<seq>."""
+    since = request.args.get("since", 0, type=int)
+    return jsonify({"ok": True, "changes": read_changes(since)})
 
 @app.route("/api/device/<dev_id>/action/<action>", methods=["GET", "POST"])
 def api_action(dev_id, action):
-    device = registry.get(dev_id)
-    if not device:
-        return jsonify({"ok": False, "error": f"Unknown device {dev_id}"}), 404
-    plugin = plugins.get(device.type)
-    if not plugin:
-        return jsonify({"ok": False, "error": f"No plugin for type {device.type}"}), 400
-
     params: Dict[str, Any] = {}
     if request.method == "GET":
         params.update(request.args)
     else:
         if request.is_json:
-            params.update(request.get_json(silent=True) or {})
+            data = request.get_json(silent=True)
+            if data is not None and not isinstance(data, dict):
+                return jsonify({"ok": False, "error": "Body must be a JSON object"}), 400
+            params.update(data or {})
         params.update(request.args)
 
-    try:
-        result = plugin.handle_action(registry, device, action, params)
-        code = 200 if result.get("ok") else 500
-        return jsonify(result), code
-    except Exception as e:
-        return jsonify({"ok": False, "error": str(e)}), 500
+    body, code = _backend().run_action(dev_id, action, params)
+    return jsonify(body), code
+
+@app.route("/api/devices/action/<action>", methods=["POST"])
+def api_fanout(action):
+    """Run an action on all selected devices; streams one JSON line per device."""
+    body = request.get_json(silent=True) or {}
+    selector, params, deadline = fanout_request(body if isinstance(body, dict) else {},
+                                                request.args)
+    records = _backend().run_fanout(selector, action, params, deadline)
+    first = next(records)
+    if first["type"] == "error":
+        return jsonify(first["result"]), first["status"]
+
+    def stream():
+        yield json.dumps(first) + "\n"
+        for record in records:
+            yield json.dumps(record) + "\n"
+
+    return Response(stream_with_context(stream()), mimetype="application/x-ndjson")
+
+@app.route("/api/scenes")
+def api_scenes():
+    return jsonify(_backend().scene_list())
+
+@app.route("/api/scene/<name>", methods=["GET", "POST"])
+def api_scene(name):
+    """Run a scene from scenes.json; the reply times every step."""
+    body, code = _backend().run_scene(name)
+    return jsonify(body), code
+
+@app.route("/api/events")
+def api_events():
+    """Server-sent events: registry changes and device state (volume, mute, app)."""
+    _backend().ensure_registry_watch()
+    sub = bus.subscribe()
+
+    def stream():
+        try:
+            yield sse_hello()
+            while True:
+                event = sub.get(timeout=SSE_KEEPALIVE)
+                yield sse_format(event) if event else ": keepalive\n\n"
+        finally:
+            sub.close()
+
+    return Response(stream_with_context(stream()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 def main():
-    app.run(host="0.0.0.0", port=10001)
+    from . import core
+    core.start_services()
+    app.run(host=HTTP_HOST, port=HTTP_PORT)
 
 
 if __name__ == "__main__":
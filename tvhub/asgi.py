@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""asyncio serving mode: the same API as tvhub.app as a plain ASGI app.
+
+Device calls are handed to the per-device queues (tvhub.commands) and
+awaited, so a slow or dead TV ties up only its own queue's thread (or
+nothing, for plugins overriding PluginBase.handle_action_async, which run
+on a shared event loop) instead of a server worker, and many calls can be
+in flight on one event loop.
+
+Also serves /ws, a WebSocket the remote page uses for key presses and
+pushed state (uvicorn needs the `websockets` package for it), and
+/api/events as server-sent events.
+
+Run with `python -m tvhub.asgi` (needs uvicorn) or point any ASGI server
+at `tvhub.asgi:app`.
+"""
+from __future__ import annotations
+import asyncio
+import json
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from .core import (registry, devices_response, run_action_async, run_frame_async,
+                   ensure_registry_watch, run_fanout_async, run_scene_async,
+                   scene_list, liveness, start_services)
+from .discovery import read_changes
+from .config import HTTP_HOST, HTTP_PORT
+from .events import bus
+from . import metrics
+from .app import REMOTE_HTML, SSE_KEEPALIVE, fanout_request, sse_format, sse_hello
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+async def _send(send, status: int, body: bytes, content_type: bytes,
+                headers: Headers = ()) -> None:
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type),
+                    (b"content-length", str(len(body)).encode())] + list(headers),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_json(send, body: Dict[str, Any], status: int = 200) -> None:
+    await _send(send, status, json.dumps(body).encode("utf-8"), b"application/json")
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+def _header(scope, name: bytes) -> bytes:
+    for k, v in scope.get("headers", []):
+        if k == name:
+            return v
+    return b""
+
+
+async def _lifespan(receive, send) -> None:
+    service = None
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            service = start_services()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            liveness.stop(timeout=5)
+            if service is not None:
+                service.stop(timeout=5)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def _fanout(receive, send, action: str, query: Dict[str, Any]) -> None:
+    body: Any = {}
+    raw = await _read_body(receive)
+    if raw:
+        try:
+            body = json.loads(raw)
+        except ValueError:
+            pass
+    selector, params, deadline = fanout_request(body if isinstance(body, dict) else {}, query)
+    records = run_fanout_async(selector, action, params, deadline)
+    first = await records.__anext__()
+    if first["type"] == "error":
+        await _send_json(send, first["result"], first["status"])
+        return
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"application/x-ndjson")],
+    })
+    try:
+        await send({"type": "http.response.body", "body": (json.dumps(first) + "\n").encode(),
+                    "more_body": True})
+        async for record in records:
+            await send({"type": "http.response.body", "body": (json.dumps(record) + "\n").encode(),
+                        "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        await records.aclose()
+
+
+async def _events(receive, send) -> None:
+    """Server-sent events stream until the client goes away."""
+    ensure_registry_watch()
+    sub = bus.subscribe(asyncio.get_running_loop())
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no")],
+    })
+    disconnected = asyncio.ensure_future(receive())
+    try:
+        await send({"type": "http.response.body", "body": sse_hello().encode(), "more_body": True})
+        while True:
+            getter = asyncio.ensure_future(sub.get_async(timeout=SSE_KEEPALIVE))
+            await asyncio.wait({getter, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                getter.cancel()
+                break
+            event = getter.result()
+            chunk = sse_format(event) if event else ": keepalive\n\n"
+            await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+    except OSError:
+        pass
+    finally:
+        disconnected.cancel()
+        sub.close()
+
+
+async def _websocket(receive, send) -> None:
+    """Bidirectional channel: action frames in, results and pushed events out."""
+    message = await receive()
+    if message["type"] != "websocket.connect":
+        return
+    await send({"type": "websocket.accept"})
+    ensure_registry_watch()
+    sub = bus.subscribe(asyncio.get_running_loop())
+    lock = asyncio.Lock()
+
+    async def emit(payload: Dict[str, Any]) -> None:
+        async with lock:
+            await send({"type": "websocket.send", "text": json.dumps(payload)})
+
+    async def reply(frame: Any, previous: Optional[asyncio.Future]) -> None:
+        if previous is not None:
+            await asyncio.wait({previous})
+        await emit(await run_frame_async(frame))
+
+    async def push() -> None:
+        while True:
+            event = await sub.get_async()
+            if event:
+                await emit(event)
+
+    pusher = asyncio.ensure_future(push())
+    inflight = set()
+    # Last queued frame per device: key presses for one TV keep their order,
+    # different TVs proceed in parallel.
+    tails: Dict[str, asyncio.Future] = {}
+    try:
+        await emit({"type": "hello", "generation": registry.generation})
+        while True:
+            message = await receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            raw = message.get("text") or (message.get("bytes") or b"").decode("utf-8", "replace")
+            try:
+                frame = json.loads(raw)
+            except ValueError:
+                await emit({"type": "result", "id": None, "status": 400,
+                            "result": {"ok": False, "error": "Invalid JSON"}})
+                continue
+            key = str(frame.get("device")) if isinstance(frame, dict) else ""
+            previous = tails.get(key)
+            task = asyncio.ensure_future(reply(frame, previous))
+            tails[key] = task
+            inflight.add(task)
+            task.add_done_callback(inflight.discard)
+            task.add_done_callback(lambda t, k=key: tails.get(k) is t and tails.pop(k))
+    finally:
+        pusher.cancel()
+        for task in inflight:
+            task.cancel()
+        sub.close()
+
+
+async def app(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] == "websocket":
+        if scope["path"] == "/ws":
+            await _websocket(receive, send)
+        else:
+            await send({"type": "websocket.close", "code": 1008})
+        return
+    if scope["type"] != "http":
+        return
+
+    method = scope["method"]
+    path = scope["path"]
+    query = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+
+    if path in ("/", "/remote") and method == "GET":
+        await _send(send, 200, REMOTE_HTML.encode("utf-8"), b"text/html; charset=utf-8")
+        return
+
+    if path == "/api/devices" and method == "GET":
+        status, headers, body = devices_response(
+            _header(scope, b"if-none-match").decode("latin-1"),
+            _header(scope, b"accept-encoding").decode("latin-1"))
+        content_type = headers.pop("Content-Type", "application/json").encode()
+        await _send(send, status, body, content_type,
+                    [(k.lower().encode(), v.encode()) for k, v in headers.items()])
+        return
+
+    if path == "/metrics" and method == "GET":
+        await _send(send, 200, metrics.render().encode("utf-8"), metrics.CONTENT_TYPE.encode())
+        return
+
+    if path == "/api/events" and method == "GET":
+        await _events(receive, send)
+        return
+
+    if path == "/api/changes" and method == "GET":
+        try:
+            since = int(query.get("since", 0))
+        except ValueError:
+            since = 0
+        await _send_json(send, {"ok": True, "changes": read_changes(since)})
+        return
+
+    if path == "/api/scenes" and method == "GET":
+        await _send_json(send, scene_list())
+        return
+
+    # ASGI servers hand us an already percent-decoded path.
+    parts = path.split("/")
+    # ['', 'api', 'scene', <name>]
+    if len(parts) == 4 and parts[1:3] == ["api", "scene"]:
+        if method not in ("GET", "POST"):
+            await _send_json(send, {"ok": False, "error": "Method not allowed"}, 405)
+            return
+        body, code = await run_scene_async(parts[3])
+        await _send_json(send, body, code)
+        return
+    # ['', 'api', 'devices', 'action', <action>]
+    if len(parts) == 5 and parts[1:4] == ["api", "devices", "action"]:
+        if method != "POST":
+            await _send_json(send, {"ok": False, "error": "Method not allowed"}, 405)
+            return
+        await _fanout(receive, send, parts[4], query)
+        return
+    # ['', 'api', 'device', <dev_id>, 'action', <action>]
+    if len(parts) == 6 and parts[1:3] == ["api", "device"] and parts[4] == "action":
+        if method not in ("GET", "POST"):
+            await _send_json(send, {"ok": False, "error": "Method not allowed"}, 405)
+            return
+        params: Dict[str, Any] = {}
+        if method == "POST":
+            raw = await _read_body(receive)
+            if _header(scope, b"content-type").startswith(b"application/json") and raw:
+                try:
+                    data = json.loads(raw)
+                except ValueError:
+                    data = None
+                if data is not None and not isinstance(data, dict):
+                    await _send_json(send, {"ok": False, "error": "Body must be a JSON object"}, 400)
+                    return
+                params.update(data or {})
+        params.update(query)
+        body, code = await run_action_async(parts[3], parts[5], params)
+        await _send_json(send, body, code)
+        return
+
+    await _send_json(send, {"ok": False, "error": "Not found"}, 404)
+
+
+def main():
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("tvhub.asgi needs uvicorn: pip install uvicorn")
+    uvicorn.run(app, host=HTTP_HOST, port=HTTP_PORT, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
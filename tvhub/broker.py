@@ -0,0 +1,246 @@
+"""Device broker for the pre-fork server (see tvhub.prefork).
+
+One broker process owns everything stateful: the registry, plugins and
+their device connections, the per-device command queues, liveness and
+latency state, status/volume caches. HTTP workers hold none of it; they
+forward each call over a local socket to the broker with BrokerClient,
+whose methods mirror the functions tvhub.app calls on tvhub.core. So a
+key press from any worker lands in the same device queue, and every
+worker sees the same registry generation and online state.
+
+Messages are tuples (op, *args) pickled by multiprocessing.connection;
+most ops answer with one reply, "fanout" streams records ending in None
+and "events" streams bus events for as long as the worker listens.
+"""
+from __future__ import annotations
+import json
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from .events import bus
+
+log = logging.getLogger("tvhub")
+
+Response = Tuple[Dict[str, Any], int]
+
+# Seconds between keepalives on an idle "events" stream, so a broker-side
+# send notices when the worker went away.
+_EVENTS_IDLE = 15.0
+
+
+class BrokerServer:
+    """Answers BrokerClient calls with tvhub.core, one thread per connection."""
+
+    def __init__(self, address: str, authkey: bytes):
+        self.address = address
+        self._listener = Listener(address, family="AF_UNIX", authkey=authkey)
+
+    def serve_forever(self) -> None:
+        while True:
+            try:
+                conn = self._listener.accept()
+            except (OSError, AuthenticationError) as e:
+                log.warning("Broker accept failed: %s", e)
+                continue
+            threading.Thread(target=self._serve, args=(conn,), name="tvhub-broker",
+                             daemon=True).start()
+
+    def _serve(self, conn: Connection) -> None:
+        from . import core
+        ops = {
+            "devices": core.devices_response,
+            "action": core.run_action,
+            "scene": core.run_scene,
+            "scenes": core.scene_list,
+            "generation": core.refresh_registry,
+            "metrics": core.metrics_text,
+        }
+        try:
+            while True:
+                op, *args = conn.recv()
+                if op == "fanout":
+                    try:
+                        for record in core.run_fanout(*args):
+                            conn.send(record)
+                    except (EOFError, OSError):
+                        raise
+                    except Exception as e:
+                        # End the stream cleanly so the worker can reuse
+                        # the connection instead of waiting on it.
+                        log.exception("Broker fanout failed")
+                        error = BrokerError(str(e), 500)
+                        conn.send({"type": "error", "status": error.status,
+                                   "result": _error_body(error)})
+                    conn.send(None)
+                elif op == "events":
+                    self._stream_events(conn)
+                    return
+                else:
+                    try:
+                        conn.send(("ok", ops[op](*args)))
+                    except Exception as e:
+                        log.exception("Broker op %s failed", op)
+                        conn.send(("error", str(e)))
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _stream_events(conn: Connection) -> None:
+        from . import core
+        core.ensure_registry_watch()
+        sub = bus.subscribe()
+        try:
+            while True:
+                conn.send(sub.get(timeout=_EVENTS_IDLE))
+        finally:
+            sub.close()
+
+
+class BrokerError(Exception):
+    """The broker could not run a call; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int = 503):
+        super().__init__(message)
+        self.status = status
+
+
+def _error_body(e: BrokerError) -> Dict[str, Any]:
+    return {"ok": False, "error": str(e), "broker": True}
+
+
+class BrokerClient:
+    """tvhub.core's API for tvhub.app, served by a BrokerServer.
+
+    Connections are pooled; each is used by one request at a time. Every
+    method answers like tvhub.core would when the broker can't: an error
+    response (503 if unreachable, 500 if the call failed in the broker)
+    rather than an exception.
+    """
+
+    def __init__(self, address: str, authkey: bytes, pool_size: int = 32):
+        self.address = address
+        self.authkey = authkey
+        self._pool: "queue.LifoQueue[Connection]" = queue.LifoQueue(maxsize=pool_size)
+        self._events_thread: Optional[threading.Thread] = None
+        self._events_lock = threading.Lock()
+        # Last generation the broker reported, for when it can't be asked.
+        self._generation = 0
+
+    def _connect(self) -> Connection:
+        return Client(self.address, family="AF_UNIX", authkey=self.authkey)
+
+    @contextmanager
+    def _conn(self) -> Iterator[Connection]:
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        except BaseException:
+            # Unknown state (half-read stream, dead broker): don't reuse.
+            conn.close()
+            raise
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def _call(self, op: str, *args: Any) -> Any:
+        try:
+            with self._conn() as conn:
+                conn.send((op, *args))
+                status, value = conn.recv()
+        except (OSError, EOFError) as e:
+            raise BrokerError(f"Broker unavailable: {e}") from e
+        if status != "ok":
+            raise BrokerError(value, 500)
+        return value
+
+    # --- the tvhub.core functions tvhub.app uses ---
+
+    def devices_response(self, if_none_match: str = "", accept_encoding: str = ""
+                         ) -> Tuple[int, Dict[str, str], bytes]:
+        try:
+            return self._call("devices", if_none_match, accept_encoding)
+        except BrokerError as e:
+            return (e.status, {"Content-Type": "application/json", "Cache-Control": "no-cache"},
+                    json.dumps(_error_body(e)).encode("utf-8"))
+
+    def run_action(self, dev_id: str, action: str, params: Dict[str, Any]) -> Response:
+        try:
+            return self._call("action", dev_id, action, params)
+        except BrokerError as e:
+            return _error_body(e), e.status
+
+    def run_fanout(self, selector: Dict[str, Any], action: str, params: Dict[str, Any],
+                   deadline: Any = None) -> Iterator[Dict[str, Any]]:
+        """Records as tvhub.core.run_fanout yields them; losing the broker
+        ends the stream with an "error" record."""
+        try:
+            with self._conn() as conn:
+                conn.send(("fanout", selector, action, params, deadline))
+                while True:
+                    record = conn.recv()
+                    if record is None:
+                        return
+                    yield record
+        except (OSError, EOFError) as e:
+            error = BrokerError(f"Broker unavailable: {e}")
+            yield {"type": "error", "status": error.status, "result": _error_body(error)}
+
+    def run_scene(self, name: str) -> Response:
+        try:
+            return self._call("scene", name)
+        except BrokerError as e:
+            return _error_body(e), e.status
+
+    def scene_list(self) -> Dict[str, Any]:
+        try:
+            return self._call("scenes")
+        except BrokerError as e:
+            return {**_error_body(e), "scenes": {}, "errors": {}}
+
+    def refresh_registry(self) -> int:
+        try:
+            self._generation = self._call("generation")
+        except BrokerError as e:
+            log.warning("Could not refresh registry generation: %s", e)
+        return self._generation
+
+    def metrics_text(self) -> str:
+        try:
+            return self._call("metrics")
+        except BrokerError as e:
+            # Still a valid exposition, so the scrape shows why it is empty.
+            return (f"# {e}\n"
+                    "# HELP tvhub_broker_up Whether the device broker answered.\n"
+                    "# TYPE tvhub_broker_up gauge\ntvhub_broker_up 0\n")
+
+    def ensure_registry_watch(self) -> None:
+        """Start (once) relaying the broker's events into this worker's bus."""
+        with self._events_lock:
+            if self._events_thread is None:
+                self._events_thread = threading.Thread(target=self._relay_events,
+                                                       name="tvhub-broker-events", daemon=True)
+                self._events_thread.start()
+
+    def _relay_events(self) -> None:
+        while True:
+            try:
+                conn = self._connect()
+                conn.send(("events",))
+                while True:
+                    event = conn.recv()
+                    if event is not None:
+                        bus.publish(event)
+            except (OSError, EOFError) as e:
+                log.warning("Lost broker event stream, reconnecting: %s", e)
+                threading.Event().wait(1.0)
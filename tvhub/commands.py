@@ -0,0 +1,130 @@
+"""Per-device command queues.
+
+Every action for a device goes through that device's queue, so commands
+run one at a time and in arrival order (two tablets dragging a volume
+slider no longer interleave, and read-modify-write actions like
+volume_up are atomic). While a command runs, later ones wait; a new
+command may be merged into the one queued just before it through
+PluginBase.coalesce(), so superseded writes are never sent. Everyone
+whose command was merged gets the merged command's result.
+
+A device with too many waiting commands rejects new ones (QueueFull)
+instead of building an ever-growing backlog.
+"""
+from __future__ import annotations
+import collections
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Deque, Dict, List, Optional
+
+from .registry import Device, DeviceRegistry
+from .plugins import call_action
+from .config import DEVICE_QUEUE_DEPTH
+from .metrics import ACTION_SECONDS, ACTIONS, ACTIONS_COALESCED
+
+
+class QueueFull(Exception):
+    """The device already has DEVICE_QUEUE_DEPTH commands waiting."""
+
+
+class _Command:
+    __slots__ = ("device", "action", "params", "futures")
+
+    def __init__(self, device: Device, action: str, params: Dict[str, Any]):
+        self.device = device
+        self.action = action
+        self.params = params
+        self.futures: List[Future] = [Future()]
+
+
+class DeviceQueue:
+    def __init__(self, registry: DeviceRegistry, plugin, max_depth: int):
+        self.registry = registry
+        self.plugin = plugin
+        self.max_depth = max_depth
+        self._pending: Deque[_Command] = collections.deque()
+        self._lock = threading.Lock()
+        self._running = False
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def submit(self, device: Device, action: str, params: Dict[str, Any]) -> Future:
+        with self._lock:
+            if self._pending:
+                tail = self._pending[-1]
+                merged = self.plugin.coalesce((tail.action, tail.params), (action, params))
+                if merged is not None:
+                    fut: Future = Future()
+                    tail.device = device
+                    tail.action, tail.params = merged
+                    tail.futures.append(fut)
+                    ACTIONS_COALESCED.labels(self.plugin.type).inc()
+                    return fut
+            if len(self._pending) >= self.max_depth:
+                raise QueueFull(f"{len(self._pending)} commands already queued")
+            cmd = _Command(device, action, params)
+            self._pending.append(cmd)
+            if not self._running:
+                self._running = True
+                threading.Thread(target=self._drain, name=f"tvhub-queue-{device.id}",
+                                 daemon=True).start()
+            return cmd.futures[0]
+
+    def _drain(self) -> None:
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._running = False
+                    return
+                cmd = self._pending.popleft()
+            # Snapshot: nothing can be merged into a command once it left the
+            # queue. Waiters that gave up (cancelled) are dropped, and a
+            # command nobody waits for any more is not sent at all.
+            futures = [f for f in cmd.futures if f.set_running_or_notify_cancel()]
+            if not futures:
+                continue
+            ptype = self.plugin.type
+            start = time.perf_counter()
+            try:
+                result = call_action(self.plugin, self.registry, cmd.device, cmd.action, cmd.params)
+            except Exception as e:
+                ACTION_SECONDS.labels(ptype, cmd.action, cmd.device.id).observe(time.perf_counter() - start)
+                ACTIONS.labels(ptype, cmd.action, "error").inc()
+                for fut in futures:
+                    fut.set_exception(e)
+                continue
+            ACTION_SECONDS.labels(ptype, cmd.action, cmd.device.id).observe(time.perf_counter() - start)
+            ok = isinstance(result, dict) and result.get("ok")
+            ACTIONS.labels(ptype, cmd.action, "ok" if ok else "error").inc()
+            if len(futures) > 1 and isinstance(result, dict):
+                result = {**result, "coalesced": len(futures)}
+            for fut in futures:
+                fut.set_result(result)
+
+
+class CommandQueues:
+    """One DeviceQueue per device id, created on first use."""
+
+    def __init__(self, registry: DeviceRegistry, max_depth: int = DEVICE_QUEUE_DEPTH):
+        self.registry = registry
+        self.max_depth = max_depth
+        self._queues: Dict[str, DeviceQueue] = {}
+        self._lock = threading.Lock()
+
+    def _queue(self, device: Device, plugin) -> DeviceQueue:
+        with self._lock:
+            q = self._queues.get(device.id)
+            if q is None or q.plugin is not plugin:
+                q = DeviceQueue(self.registry, plugin, self.max_depth)
+                self._queues[device.id] = q
+            return q
+
+    def submit(self, plugin, device: Device, action: str, params: Dict[str, Any]) -> Future:
+        """Queue an action; the future resolves to the plugin's result dict."""
+        return self._queue(device, plugin).submit(device, action, params)
+
+    def depth(self, dev_id: str) -> Optional[int]:
+        q = self._queues.get(dev_id)
+        return len(q) if q is not None else None
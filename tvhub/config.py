@@ -1,16 +1,103 @@
 import os
 from pathlib import Path
 
+# Also load plugins registered by other packages ("tvhub.plugins" entry points)
+PLUGIN_ENTRY_POINTS = os.environ.get("TVHUB_PLUGIN_ENTRY_POINTS", "1") not in ("", "0", "false", "no")
+
 # Base directory for data (can be overridden by env TVHUB_DATA_DIR)
 DATA_DIR = Path(os.environ.get("TVHUB_DATA_DIR", "/var/lib/tvhub"))
 
 # File for device registry
 DEVICES_FILE = DATA_DIR / "devices.json"
+# "json" keeps devices in DEVICES_FILE; "sqlite" in REGISTRY_DB (WAL mode,
+# see tvhub.sqlite_registry), importing DEVICES_FILE on first use.
+REGISTRY_BACKEND = os.environ.get("TVHUB_REGISTRY", "json").lower()
+REGISTRY_DB = DATA_DIR / "devices.db"
+
+# Where the API listens (tvhub.app and tvhub.asgi)
+HTTP_HOST = os.environ.get("TVHUB_HOST", "0.0.0.0")
+HTTP_PORT = int(os.environ.get("TVHUB_PORT", "10001"))
+
+# Pre-fork server (tvhub.prefork): HTTP worker processes, and the socket
+# they reach the device broker on.
+HTTP_WORKERS = int(os.environ.get("TVHUB_WORKERS", "0")) or (os.cpu_count() or 1)
+BROKER_SOCKET = Path(os.environ.get("TVHUB_BROKER_SOCKET", str(DATA_DIR / "broker.sock")))
+
+# gzip /api/devices for clients that accept it (bodies under 1 KiB are sent as is)
+HTTP_GZIP = os.environ.get("TVHUB_GZIP", "1") not in ("", "0", "false", "no")
+
+# Async plugin hooks: threads available for running sync plugins from an event loop
+ASYNC_OFFLOAD_THREADS = int(os.environ.get("TVHUB_ASYNC_THREADS", "64"))
+
+# Bulk actions (/api/devices/action/<action>): devices called at once, and
+# the default overall deadline in seconds (a request may ask for less).
+FANOUT_WORKERS = int(os.environ.get("TVHUB_FANOUT_WORKERS", "16"))
+FANOUT_DEADLINE = float(os.environ.get("TVHUB_FANOUT_DEADLINE", "10"))
+
+# Liveness probing (see tvhub.liveness): seconds between rounds (0 = off),
+# connect timeout, and misses in a row before a device counts as offline.
+PROBE_INTERVAL = float(os.environ.get("TVHUB_PROBE_INTERVAL", "10"))
+PROBE_TIMEOUT = float(os.environ.get("TVHUB_PROBE_TIMEOUT", "0.5"))
+PROBE_FAILURES = int(os.environ.get("TVHUB_PROBE_FAILURES", "2"))
+PROBE_WORKERS = int(os.environ.get("TVHUB_PROBE_WORKERS", "16"))
+
+# Adaptive transport timeouts (see tvhub.latency): bounds in seconds, retries
+# earned per successful call and the most that can be banked per device.
+LATENCY_FILE = DATA_DIR / "latency.json"
+LATENCY_MIN_TIMEOUT = float(os.environ.get("TVHUB_MIN_TIMEOUT", "0.5"))
+LATENCY_MAX_TIMEOUT = float(os.environ.get("TVHUB_MAX_TIMEOUT", "15"))
+LATENCY_RETRY_RATIO = float(os.environ.get("TVHUB_RETRY_RATIO", "0.1"))
+LATENCY_RETRY_BURST = float(os.environ.get("TVHUB_RETRY_BURST", "3"))
+LATENCY_SAVE_INTERVAL = 60.0
+
+# Scenes (see tvhub.scenes) and the default time one scene step may take.
+SCENES_FILE = DATA_DIR / "scenes.json"
+SCENE_STEP_TIMEOUT = float(os.environ.get("TVHUB_SCENE_STEP_TIMEOUT", "10"))
+
+# Commands waiting per device (see tvhub.commands); more are answered 503.
+DEVICE_QUEUE_DEPTH = int(os.environ.get("TVHUB_DEVICE_QUEUE_DEPTH", "8"))
+
+# Per-plugin deadline for one discovery run; mDNS browsing also stops early
+# once no new answers arrived for DISCOVERY_QUIET seconds.
+DISCOVERY_TIMEOUT = float(os.environ.get("TVHUB_DISCOVERY_TIMEOUT", "3"))
+DISCOVERY_QUIET = float(os.environ.get("TVHUB_DISCOVERY_QUIET_MS", "750")) / 1000.0
+DISCOVERY_INTERVAL = float(os.environ.get("TVHUB_DISCOVERY_INTERVAL", "30"))
+# Run resident discovery inside the API process (see tvhub.discovery)
+EMBED_DISCOVERY = os.environ.get("TVHUB_EMBED_DISCOVERY", "") not in ("", "0", "false", "no")
+# Discovery: rounds a device may be missing before it is dropped, and a
+# rolling log of added/changed/removed devices for consumers.
+DISCOVERY_GRACE_ROUNDS = int(os.environ.get("TVHUB_DISCOVERY_GRACE", "3"))
+DISCOVERY_STATE_FILE = DATA_DIR / "discovery_state.json"
+DISCOVERY_CHANGES_FILE = DATA_DIR / "discovery_changes.jsonl"
+DISCOVERY_CHANGES_KEEP = 500
 
 # Path to adb binary (can be overridden)
 ADB_BIN = os.environ.get("TVHUB_ADB_BIN", "/opt/platform-tools/adb")
 
+# "native" talks to the adb server socket directly (see tvhub.adb) and only
+# falls back to forking ADB_BIN when no server is running; "subprocess"
+# always forks.
+ADB_MODE = os.environ.get("TVHUB_ADB_MODE", "native")
+ADB_SERVER = os.environ.get("TVHUB_ADB_SERVER", "127.0.0.1:5037")
+
+# Characters per `input text` command when typing long strings.
+GTV_TEXT_CHUNK = int(os.environ.get("TVHUB_GTV_TEXT_CHUNK", "48"))
+# How long a Google TV status (foreground activity) answer is reused.
+GTV_STATUS_TTL = float(os.environ.get("TVHUB_GTV_STATUS_TTL", "2"))
+
 # Hisense defaults
 HISENSE_DMR_PORT = 2870
 HISENSE_INSTANCE_ID = 0
 HISENSE_CHANNEL = "Master"
+# Max keep-alive connections per Hisense TV
+HISENSE_POOL_SIZE = int(os.environ.get("TVHUB_HISENSE_POOL_SIZE", "2"))
+# SSDP discovery: MediaRenderers whose manufacturer/model/name contains this
+# are treated as Hisense TVs. Descriptions are cached across runs.
+HISENSE_SSDP_MATCH = os.environ.get("TVHUB_HISENSE_SSDP_MATCH", "hisense").lower()
+_ssdp_host, _, _ssdp_port = os.environ.get("TVHUB_SSDP_ADDR", "239.255.255.250:1900").rpartition(":")
+SSDP_ADDRESS = (_ssdp_host, int(_ssdp_port))
+SSDP_CACHE_FILE = DATA_DIR / "ssdp_cache.json"
+# Subscribe to RenderingControl events so volume/mute reads come from memory.
+# NOTIFY callbacks arrive on HISENSE_EVENT_PORT (0 = any free port).
+HISENSE_EVENTS = os.environ.get("TVHUB_HISENSE_EVENTS", "1") not in ("", "0", "false", "no")
+HISENSE_EVENT_PORT = int(os.environ.get("TVHUB_HISENSE_EVENT_PORT", "0"))
@@ -0,0 +1,474 @@
+"""Request handling shared by the Flask app and the asyncio (ASGI) server.
+
+Holds the process-wide registry and plugins, and turns API calls into
+(body, status) pairs so each front end only deals with HTTP plumbing.
+"""
+from __future__ import annotations
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeout
+from typing import Dict, Any, Iterator, AsyncIterator, List, Optional, Tuple
+
+from .registry import Device, open_registry
+from .plugins import load_plugins, PluginBase
+from .events import bus
+from .commands import CommandQueues, QueueFull
+from .liveness import LivenessMonitor
+from .scenes import SceneBook, Step, run_scene as _run_scene, run_scene_async as _run_scene_async
+from . import metrics
+from .metrics import ACTIONS
+from .discovery import DiscoveryService
+from .config import FANOUT_WORKERS, FANOUT_DEADLINE, HTTP_GZIP, EMBED_DISCOVERY
+
+log = logging.getLogger("tvhub")
+
+registry = open_registry()
+plugins = load_plugins()
+queues = CommandQueues(registry)
+liveness = LivenessMonitor(registry, plugins)
+scenes = SceneBook()
+
+Response = Tuple[Dict[str, Any], int]
+
+_GZIP_MIN = 1024
+
+# /api/devices body for one (registry generation, liveness version):
+# (key, etag, body, gzipped)
+_devices_cache: Optional[Tuple[Tuple[int, int], str, bytes, Optional[bytes]]] = None
+_devices_lock = threading.Lock()
+_fanout_pool: Optional[ThreadPoolExecutor] = None
+_scene_pool: Optional[ThreadPoolExecutor] = None
+# Guards lazy creation of the registry watcher and the fan-out/scene pools.
+_watch_lock = threading.Lock()
+_watch_thread: Optional[threading.Thread] = None
+
+
+def refresh_registry() -> int:
+    """Pick up discovery changes to devices.json; returns the registry generation.
+
+    Only re-reads the file when it actually changed on disk.
+    """
+    try:
+        registry.refresh()
+    except Exception as e:
+        log.exception("Error refreshing registry: %s", e)
+    return registry.generation
+
+
+def _watch_registry(interval: float) -> None:
+    last = refresh_registry()
+    while True:
+        time.sleep(interval)
+        if not bus.subscribers:
+            continue
+        generation = refresh_registry()
+        if generation != last:
+            last = generation
+            bus.publish({"type": "devices", "generation": generation})
+
+
+def start_services() -> Optional[DiscoveryService]:
+    """Start the background work of the process that owns device state:
+    liveness probing and, if enabled, embedded discovery (returned so it
+    can be stopped)."""
+    liveness.start()
+    if EMBED_DISCOVERY:
+        # Same registry object as the API, so announcements show up immediately.
+        return DiscoveryService(registry, plugins).start()
+    return None
+
+
+def ensure_registry_watch(interval: float = 1.0) -> None:
+    """Start (once) the thread that pushes registry changes to event subscribers."""
+    global _watch_thread
+    with _watch_lock:
+        if _watch_thread is None:
+            _watch_thread = threading.Thread(target=_watch_registry, args=(interval,),
+                                             name="tvhub-registry-watch", daemon=True)
+            _watch_thread.start()
+
+
+def metrics_text() -> str:
+    return metrics.render()
+
+
+def device_list() -> Dict[str, Any]:
+    generation = refresh_registry()
+    actions = {t: list(plugins.actions(t)) for t in plugins}
+    ds = [
+        {
+            "id": d.id,
+            "name": d.name,
+            "type": d.type,
+            "address": d.address,
+            "meta": d.meta,
+            "actions": actions.get(d.type, []),
+            "online": liveness.online(d.id),
+        }
+        for d in registry.all()
+    ]
+    return {"ok": True, "generation": generation, "devices": ds}
+
+
+def _devices_body() -> Tuple[str, bytes, Optional[bytes]]:
+    """Serialized device list, rebuilt only when the registry generation or a
+    device's online state moves."""
+    global _devices_cache
+    key = (refresh_registry(), liveness.version)
+    cached = _devices_cache
+    if cached and cached[0] == key:
+        return cached[1:]
+    with _devices_lock:
+        if _devices_cache and _devices_cache[0] == key:
+            return _devices_cache[1:]
+        body = json.dumps(device_list(), separators=(",", ":")).encode("utf-8")
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        gz = gzip.compress(body, 6) if HTTP_GZIP and len(body) >= _GZIP_MIN else None
+        _devices_cache = (key, etag, body, gz)
+        return etag, body, gz
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = (t.strip() for t in if_none_match.split(","))
+    return etag in (t[2:] if t.startswith("W/") else t for t in tags)
+
+
+def devices_response(if_none_match: str = "", accept_encoding: str = ""
+                     ) -> Tuple[int, Dict[str, str], bytes]:
+    """(status, headers, body) for GET /api/devices, honouring If-None-Match and gzip."""
+    etag, body, gz = _devices_body()
+    if gz is not None and "gzip" in accept_encoding.lower():
+        # A different representation needs its own validator.
+        etag = etag[:-1] + '-gz"'
+        body = gz
+    else:
+        gz = None
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if _etag_matches(if_none_match, etag):
+        return 304, headers, b""
+    headers["Content-Type"] = "application/json"
+    if gz is not None:
+        headers["Content-Encoding"] = "gzip"
+    return 200, headers, body
+
+
+def _resolve(dev_id: str) -> Tuple[Optional[Device], Optional[PluginBase], Optional[Response]]:
+    refresh_registry()
+    device = registry.get(dev_id)
+    if not device:
+        return None, None, ({"ok": False, "error": f"Unknown device {dev_id}"}, 404)
+    plugin = plugins.get(device.type)
+    if not plugin:
+        return device, None, ({"ok": False, "error": f"No plugin for type {device.type}"}, 400)
+    return device, plugin, None
+
+
+def _busy(plugin: PluginBase, dev_id: str, action: str, e: QueueFull) -> Response:
+    ACTIONS.labels(plugin.type, action, "busy").inc()
+    return {"ok": False, "error": f"Device {dev_id} is busy: {e}", "busy": True}, 503
+
+
+def _offline(plugin: PluginBase, dev_id: str, action: str) -> Response:
+    ACTIONS.labels(plugin.type, action, "offline").inc()
+    return {"ok": False, "error": f"Device {dev_id} is offline", "offline": True}, 503
+
+
+def _outcome(device: Device, result: Dict[str, Any]) -> Response:
+    if not result.get("ok"):
+        # Maybe it just went away; find out before the next action waits too.
+        liveness.check(device)
+        return result, 500
+    liveness.answered(device.id)
+    return result, 200
+
+
+def _timed_out(timeout: float) -> Response:
+    return {"ok": False, "error": f"No reply within {timeout:g}s", "timed_out": True}, 504
+
+
+def run_action(dev_id: str, action: str, params: Dict[str, Any],
+               timeout: Optional[float] = None) -> Response:
+    device, plugin, error = _resolve(dev_id)
+    if error:
+        return error
+    if not liveness.allow(dev_id):
+        return _offline(plugin, dev_id, action)
+    try:
+        result = queues.submit(plugin, device, action, params).result(timeout)
+        return _outcome(device, result)
+    except FutureTimeout:
+        # The command still runs (or stays queued) on the device's thread.
+        liveness.check(device)
+        return _timed_out(timeout)
+    except QueueFull as e:
+        return _busy(plugin, dev_id, action, e)
+    except Exception as e:
+        return {"ok": False, "error": str(e)}, 500
+
+
+async def run_action_async(dev_id: str, action: str, params: Dict[str, Any],
+                           timeout: Optional[float] = None) -> Response:
+    device, plugin, error = _resolve(dev_id)
+    if error:
+        return error
+    if not liveness.allow(dev_id):
+        return _offline(plugin, dev_id, action)
+    try:
+        # The device queue runs the command on its own thread; just wait here.
+        result = await asyncio.wait_for(
+            asyncio.wrap_future(queues.submit(plugin, device, action, params)), timeout)
+        return _outcome(device, result)
+    except asyncio.CancelledError:
+        raise
+    except asyncio.TimeoutError:
+        liveness.check(device)
+        return _timed_out(timeout)
+    except QueueFull as e:
+        return _busy(plugin, dev_id, action, e)
+    except Exception as e:
+        return {"ok": False, "error": str(e)}, 500
+
+
+def _frame_request(frame: Any) -> Tuple[Optional[Tuple[str, str, Dict[str, Any]]], Optional[Response]]:
+    if not isinstance(frame, dict) or not frame.get("device") or not frame.get("action"):
+        return None, ({"ok": False, "error": "Frame needs device and action"}, 400)
+    params = frame.get("params") or {}
+    if not isinstance(params, dict):
+        return None, ({"ok": False, "error": "params must be an object"}, 400)
+    return (str(frame["device"]), str(frame["action"]), params), None
+
+
+async def run_frame_async(frame: Any) -> Dict[str, Any]:
+    """Run one action frame from the WebSocket channel.
+
+    Frames look like {"id": 7, "device": "...", "action": "button",
+    "params": {"key": "UP"}}; the reply echoes the id.
+    """
+    req, error = _frame_request(frame)
+    body, code = error if error else await run_action_async(*req)
+    return {"type": "result", "id": frame.get("id") if isinstance(frame, dict) else None,
+            "status": code, "result": body}
+
+
+# --- bulk actions ---
+
+def _as_list(value: Any) -> List[str]:
+    if value is None or value == "":
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value]
+    return [v.strip() for v in str(value).split(",") if v.strip()]
+
+
+def select_devices(selector: Dict[str, Any]) -> Tuple[List[Device], Optional[Response]]:
+    """Devices matching a selector; all given criteria must match.
+
+    Keys: "ids" (list or comma string), "type", "tag" (matched against
+    meta["tags"]), "meta" (exact key/value pairs) or "all": true.
+    """
+    ids = _as_list(selector.get("ids"))
+    dtype = selector.get("type")
+    tags = _as_list(selector.get("tag"))
+    meta = selector.get("meta") or {}
+    if not isinstance(meta, dict):
+        return [], ({"ok": False, "error": "selector meta must be an object"}, 400)
+    if not (ids or dtype or tags or meta or selector.get("all")):
+        return [], ({"ok": False, "error": "Empty selector (use ids, type, tag, meta or all)"}, 400)
+    refresh_registry()
+    found = []
+    for d in registry.all():
+        if ids and d.id not in ids:
+            continue
+        if dtype and d.type != dtype:
+            continue
+        if tags and not set(tags) & set(_as_list(d.meta.get("tags"))):
+            continue
+        if any(d.meta.get(k) != v for k, v in meta.items()):
+            continue
+        found.append(d)
+    return found, None
+
+
+def _fanout_deadline(requested: Any, limit: float = FANOUT_DEADLINE) -> float:
+    try:
+        value = float(requested)
+    except (TypeError, ValueError):
+        return limit
+    return max(0.0, min(value, limit))
+
+
+def _fanout_result(dev_id: str, response: Response, started: float) -> Dict[str, Any]:
+    body, code = response
+    return {"type": "result", "device": dev_id, "status": code, "result": body,
+            "ms": round((time.monotonic() - started) * 1000, 1)}
+
+
+def _fanout_done(devices: List[Device], results: Dict[str, int],
+                 started: float) -> Dict[str, Any]:
+    return {
+        "type": "done",
+        "ok": sum(1 for code in results.values() if code < 400),
+        "failed": sum(1 for code in results.values() if code >= 400),
+        "timed_out": [d.id for d in devices if d.id not in results],
+        "ms": round((time.monotonic() - started) * 1000, 1),
+    }
+
+
+def _fanout_executor() -> ThreadPoolExecutor:
+    global _fanout_pool
+    with _watch_lock:
+        if _fanout_pool is None:
+            _fanout_pool = ThreadPoolExecutor(max_workers=FANOUT_WORKERS,
+                                              thread_name_prefix="tvhub-fanout")
+        return _fanout_pool
+
+
+def run_fanout(selector: Dict[str, Any], action: str, params: Dict[str, Any],
+               deadline: Any = None, limit: float = FANOUT_DEADLINE) -> Iterator[Dict[str, Any]]:
+    """Run one action on every selected device, yielding results as they finish.
+
+    Yields a "start" record, one "result" per device in completion order,
+    then "done". Devices still busy at the deadline (at most `limit`
+    seconds; API callers get FANOUT_DEADLINE) are reported as timed_out;
+    their calls finish in the background.
+    """
+    started = time.monotonic()
+    devices, error = select_devices(selector)
+    if error:
+        body, code = error
+        yield {"type": "error", "status": code, "result": body}
+        return
+    yield {"type": "start", "action": action, "devices": [d.id for d in devices]}
+    end = started + _fanout_deadline(deadline, limit)
+    pool = _fanout_executor()
+    pending = {pool.submit(run_action, d.id, action, dict(params)): d.id for d in devices}
+    results: Dict[str, int] = {}
+    while pending:
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            break
+        done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for fut in done:
+            dev_id = pending.pop(fut)
+            record = _fanout_result(dev_id, fut.result(), started)
+            results[dev_id] = record["status"]
+            yield record
+    for fut in pending:
+        fut.cancel()
+    yield _fanout_done(devices, results, started)
+
+
+async def run_fanout_async(selector: Dict[str, Any], action: str, params: Dict[str, Any],
+                           deadline: Any = None, limit: float = FANOUT_DEADLINE
+                           ) -> AsyncIterator[Dict[str, Any]]:
+    """run_fanout for the asyncio server; calls past the deadline are cancelled."""
+    started = time.monotonic()
+    devices, error = select_devices(selector)
+    if error:
+        body, code = error
+        yield {"type": "error", "status": code, "result": body}
+        return
+    yield {"type": "start", "action": action, "devices": [d.id for d in devices]}
+    end = started + _fanout_deadline(deadline, limit)
+    gate = asyncio.Semaphore(FANOUT_WORKERS)
+
+    async def call(dev_id: str) -> Response:
+        async with gate:
+            return await run_action_async(dev_id, action, dict(params))
+
+    pending = {asyncio.ensure_future(call(d.id)): d.id for d in devices}
+    results: Dict[str, int] = {}
+    try:
+        while pending:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            done, _ = await asyncio.wait(pending, timeout=remaining,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                dev_id = pending.pop(task)
+                record = _fanout_result(dev_id, task.result(), started)
+                results[dev_id] = record["status"]
+                yield record
+    finally:
+        for task in pending:
+            task.cancel()
+    yield _fanout_done(devices, results, started)
+
+
+# --- scenes ---
+
+def _fanout_step_response(records: List[Dict[str, Any]]) -> Response:
+    """Collapse a selector step's bulk-action records into one step result."""
+    if records[0]["type"] == "error":
+        return records[0]["result"], records[0]["status"]
+    done = records[-1]
+    body = {
+        "ok": not done["failed"] and not done["timed_out"],
+        "devices": {r["device"]: r["result"] for r in records if r["type"] == "result"},
+        "failed": done["failed"],
+    }
+    if done["timed_out"]:
+        body.update(timed_out=True, pending=done["timed_out"])
+        return body, 504
+    return body, (200 if body["ok"] else 500)
+
+
+def _scene_step(step: Step) -> Response:
+    if step.device:
+        return run_action(step.device, step.action, dict(step.params), step.timeout)
+    # A scene's own step timeout applies, not the API's FANOUT_DEADLINE cap.
+    return _fanout_step_response(list(run_fanout(step.selector, step.action, dict(step.params),
+                                                 step.timeout, limit=step.timeout)))
+
+
+async def _scene_step_async(step: Step) -> Response:
+    if step.device:
+        return await run_action_async(step.device, step.action, dict(step.params), step.timeout)
+    records = [r async for r in run_fanout_async(step.selector, step.action, dict(step.params),
+                                                 step.timeout, limit=step.timeout)]
+    return _fanout_step_response(records)
+
+
+def _scene_executor() -> ThreadPoolExecutor:
+    global _scene_pool
+    with _watch_lock:
+        if _scene_pool is None:
+            _scene_pool = ThreadPoolExecutor(max_workers=FANOUT_WORKERS,
+                                             thread_name_prefix="tvhub-scene")
+        return _scene_pool
+
+
+def _unknown_scene(name: str) -> Response:
+    error = scenes.errors.get(name)
+    if error:
+        return {"ok": False, "error": f"Scene {name} is invalid: {error}"}, 400
+    return {"ok": False, "error": f"Unknown scene {name}"}, 404
+
+
+def run_scene(name: str) -> Response:
+    """Run a scene from scenes.json; the body has a per-step timing breakdown."""
+    scene = scenes.get(name)
+    if scene is None:
+        return _unknown_scene(name)
+    return _run_scene(scene, _scene_step, _scene_executor())
+
+
+async def run_scene_async(name: str) -> Response:
+    scene = scenes.get(name)
+    if scene is None:
+        return _unknown_scene(name)
+    return await _run_scene_async(scene, _scene_step_async)
+
+
+def scene_list() -> Dict[str, Any]:
+    return {"ok": True, **scenes.describe()}
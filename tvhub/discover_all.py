@@ -1,23 +1,40 @@
 #!/usr/bin/env python3
 """Run discovery for all plugins and update the registry.
 
-You can call this from a systemd timer.
+You can call this from a systemd timer, or run it resident with --daemon
+(see tvhub.discovery.DiscoveryService). Each plugin's results are diffed
+against the registry (see tvhub.discovery) instead of wiping and
+re-inserting, so devices don't flicker out while discovery runs.
+Plugins run concurrently; a JSON summary with per-plugin timings is printed.
 """
-from .registry import DeviceRegistry
+import argparse
+import json
+import logging
+
+from .registry import open_registry
 from .plugins import load_plugins
+from .discovery import DiscoveryState, DiscoveryService, run_discovery
+from .config import DISCOVERY_TIMEOUT
 
-def main():
-    reg = DeviceRegistry()
-    plugins = load_plugins()
-    # Clear types we will re-discover
-    for t in plugins.keys():
-        reg.remove_type(t)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--daemon", action="store_true",
+                        help="stay resident and apply announcements as they happen")
+    parser.add_argument("--timeout", type=float, default=DISCOVERY_TIMEOUT,
+                        help="per-plugin discovery deadline in seconds")
+    args = parser.parse_args(argv)
 
-    for t, plugin in plugins.items():
-        try:
-            plugin.discover(reg)
-        except Exception as e:
-            print(f"Discovery failed for {t}: {e}")
+    reg = open_registry()
+    plugins = load_plugins()
+    if args.daemon:
+        logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+        DiscoveryService(reg, plugins).run_forever()
+        return
+    state = DiscoveryState()
+    runs = run_discovery(reg, plugins, state, timeout=args.timeout)
+    state.save()
+    summary = {t: run.as_dict() for t, run in runs.items()}
+    print(json.dumps({"ok": all(r.ok for r in runs.values()), "plugins": summary}))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,393 @@
+from __future__ import annotations
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeout
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from .registry import DeviceRegistry, Device
+from .plugins import native_async, call_discover_async
+from .metrics import DISCOVERY_SECONDS, DISCOVERY_RUNS
+from .config import (
+    DISCOVERY_INTERVAL,
+    DISCOVERY_TIMEOUT,
+    DISCOVERY_GRACE_ROUNDS,
+    DISCOVERY_STATE_FILE,
+    DISCOVERY_CHANGES_FILE,
+    DISCOVERY_CHANGES_KEEP,
+)
+
+log = logging.getLogger(__name__)
+
+
+class DiscoveryCollector:
+    """Registry stand-in passed to plugin.discover().
+
+    Plugins keep calling upsert() as before; the devices are only recorded
+    here and merged into the real registry afterwards by merge_discovery().
+    """
+
+    def __init__(self, registry: DeviceRegistry):
+        self.registry = registry
+        self.seen: Dict[str, Device] = {}
+
+    def upsert(self, device: Device) -> None:
+        self.seen[device.id] = device
+
+    def all(self) -> List[Device]:
+        return self.registry.all()
+
+    def get(self, dev_id: str) -> Optional[Device]:
+        return self.seen.get(dev_id) or self.registry.get(dev_id)
+
+
+@dataclass
+class DiscoveryDiff:
+    type: str
+    added: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    missing: List[str] = field(default_factory=list)   # absent, still in grace period
+    removed: List[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+
+class DiscoveryState:
+    """Per-device miss counters plus the on-disk change log."""
+
+    def __init__(self, state_path: Path = DISCOVERY_STATE_FILE,
+                 changes_path: Path = DISCOVERY_CHANGES_FILE):
+        self.state_path = state_path
+        self.changes_path = changes_path
+        self.misses: Dict[str, int] = {}
+        self.seq = 0
+        try:
+            data = json.loads(self.state_path.read_text())
+            self.misses = {k: int(v) for k, v in data.get("misses", {}).items()}
+            self.seq = int(data.get("seq", 0))
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    def save(self) -> None:
+        tmp = self.state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"misses": self.misses, "seq": self.seq}))
+        os.replace(tmp, self.state_path)
+
+    def log(self, diff: DiscoveryDiff, registry: DeviceRegistry,
+            gone: Dict[str, Device]) -> None:
+        if not diff:
+            return
+        now = time.time()
+        lines = []
+        for event, ids in (("added", diff.added), ("changed", diff.changed), ("removed", diff.removed)):
+            for dev_id in ids:
+                dev = gone.get(dev_id) or registry.get(dev_id)
+                self.seq += 1
+                entry: Dict[str, Any] = {"seq": self.seq, "ts": now, "event": event,
+                                         "type": diff.type, "id": dev_id}
+                if dev is not None:
+                    entry["device"] = asdict(dev)
+                lines.append(json.dumps(entry))
+        with self.changes_path.open("a") as f:
+            f.write("\n".join(lines) + "\n")
+        self._trim()
+
+    def _trim(self) -> None:
+        try:
+            lines = self.changes_path.read_text().splitlines()
+        except OSError:
+            return
+        if len(lines) <= DISCOVERY_CHANGES_KEEP * 2:
+            return
+        tmp = self.changes_path.with_suffix(".tmp")
+        tmp.write_text("\n".join(lines[-DISCOVERY_CHANGES_KEEP:]) + "\n")
+        os.replace(tmp, self.changes_path)
+
+
+def read_changes(since: int = 0, path: Path = DISCOVERY_CHANGES_FILE) -> List[Dict[str, Any]]:
+    """Return change log entries with seq > since, oldest first."""
+    out: List[Dict[str, Any]] = []
+    try:
+        with path.open() as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("seq", 0) > since:
+                    out.append(entry)
+    except OSError:
+        pass
+    return out
+
+
+def _merge_seen(registry: DeviceRegistry, device: Device, diff: DiscoveryDiff) -> None:
+    existing = registry.get(device.id)
+    if existing is None:
+        registry.upsert(device)
+        diff.added.append(device.id)
+        return
+    merged = Device(
+        id=device.id,
+        name=device.name,
+        type=device.type,
+        address=device.address,
+        meta={**existing.meta, **device.meta},
+    )
+    if merged != existing:
+        registry.upsert(merged)
+        diff.changed.append(device.id)
+
+
+def _removable(plugin, device: Device) -> bool:
+    check = getattr(plugin, "removable", None)
+    return check(device) if check else not device.meta.get("pinned")
+
+
+def merge_discovery(registry: DeviceRegistry, plugin, seen: Dict[str, Device],
+                    state: DiscoveryState,
+                    grace_rounds: int = DISCOVERY_GRACE_ROUNDS) -> DiscoveryDiff:
+    """Apply one discovery round for plugin.type to the registry.
+
+    New devices are added, devices whose details moved are updated, and
+    devices not seen for grace_rounds consecutive rounds are removed.
+    Plugins without active discovery never lose devices, nor do devices
+    the plugin declares non-removable (by default those with meta "pinned").
+    """
+    diff = DiscoveryDiff(type=plugin.type)
+    gone: Dict[str, Device] = {}
+    with registry.batch():
+        for dev_id, device in seen.items():
+            state.misses.pop(dev_id, None)
+            _merge_seen(registry, device, diff)
+
+        if getattr(plugin, "active_discovery", True):
+            for device in registry.all():
+                if device.type != plugin.type or device.id in seen:
+                    continue
+                if not _removable(plugin, device):
+                    continue
+                misses = state.misses.get(device.id, 0) + 1
+                if misses >= grace_rounds:
+                    state.misses.pop(device.id, None)
+                    gone[device.id] = device
+                    registry.remove(device.id)
+                    diff.removed.append(device.id)
+                else:
+                    state.misses[device.id] = misses
+                    diff.missing.append(device.id)
+    state.log(diff, registry, gone)
+    return diff
+
+
+@dataclass
+class PluginRun:
+    """Outcome of one plugin's discover() within run_discovery()."""
+    type: str
+    ok: bool = False
+    seconds: float = 0.0
+    found: int = 0
+    timed_out: bool = False
+    error: Optional[str] = None
+    diff: Optional[DiscoveryDiff] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        out = asdict(self)
+        out["seconds"] = round(self.seconds, 3)
+        return out
+
+
+def _discover(plugin, collector: DiscoveryCollector, timeout: float) -> float:
+    start = time.monotonic()
+    if native_async(plugin, "discover_async"):
+        call_discover_async(plugin, collector, timeout)
+        return time.monotonic() - start
+    try:
+        accepts_timeout = "timeout" in inspect.signature(plugin.discover).parameters
+    except (TypeError, ValueError):
+        accepts_timeout = False
+    if accepts_timeout:
+        plugin.discover(collector, timeout=timeout)
+    else:
+        plugin.discover(collector)
+    return time.monotonic() - start
+
+
+def run_discovery(registry: DeviceRegistry, plugins: Dict[str, Any], state: DiscoveryState,
+                  timeout: float = DISCOVERY_TIMEOUT,
+                  lock: Optional[threading.Lock] = None) -> Dict[str, PluginRun]:
+    """Run every plugin's discover() concurrently and merge results as they land.
+
+    Each plugin gets `timeout` seconds (passed through if its discover()
+    takes a timeout argument, so it can also finish early). A plugin still
+    running at the deadline is reported as timed out and its late results
+    are dropped; it is not counted as a miss for its devices.
+    """
+    runs: Dict[str, PluginRun] = {t: PluginRun(type=t) for t in plugins}
+    if not plugins:
+        return runs
+    pool = ThreadPoolExecutor(max_workers=len(plugins), thread_name_prefix="tvhub-discover")
+    futures = {}
+    for t, plugin in plugins.items():
+        collector = DiscoveryCollector(registry)
+        futures[pool.submit(_discover, plugin, collector, timeout)] = (t, plugin, collector)
+    started = time.monotonic()
+    try:
+        # A little slack so plugins honouring the deadline aren't cut off.
+        for fut in as_completed(futures, timeout=timeout + 1.0):
+            t, plugin, collector = futures[fut]
+            run = runs[t]
+            try:
+                run.seconds = fut.result()
+            except Exception as e:
+                run.seconds = time.monotonic() - started
+                run.error = f"{type(e).__name__}: {e}"
+                continue
+            run.ok = True
+            run.found = len(collector.seen)
+            if lock is not None:
+                with lock:
+                    run.diff = merge_discovery(registry, plugin, collector.seen, state)
+            else:
+                run.diff = merge_discovery(registry, plugin, collector.seen, state)
+    except FutureTimeout:
+        for fut, (t, _, _) in futures.items():
+            if not fut.done():
+                runs[t].timed_out = True
+                runs[t].seconds = time.monotonic() - started
+                runs[t].error = f"deadline of {timeout:g}s exceeded"
+    finally:
+        pool.shutdown(wait=False)
+    for t, run in runs.items():
+        DISCOVERY_SECONDS.labels(t).observe(run.seconds)
+        DISCOVERY_RUNS.labels(t, "timeout" if run.timed_out else "ok" if run.ok else "error").inc()
+    return runs
+
+
+class DiscoveryService:
+    """Resident discovery: applies plugin announcements as they happen.
+
+    Plugins that support watch() push devices in as soon as they announce;
+    the rest are polled with discover() every `interval` seconds. A device a
+    watcher reports gone is only removed if it doesn't announce again within
+    `grace` seconds (by default as long as DISCOVERY_GRACE_ROUNDS polling
+    rounds), so one dropped mDNS record doesn't make it flicker out. Runs on
+    a background thread (embedded in tvhub.app) or in the foreground via
+    run_forever() (python -m tvhub.discover_all --daemon).
+    """
+
+    def __init__(self, registry: DeviceRegistry, plugins: Dict[str, Any],
+                 interval: float = DISCOVERY_INTERVAL, grace: Optional[float] = None):
+        self.registry = registry
+        self.plugins = plugins
+        self.interval = interval
+        self.grace = grace if grace is not None else DISCOVERY_GRACE_ROUNDS * interval
+        self.state = DiscoveryState()
+        # dev_id -> timer that removes it when its grace period ends
+        self._gone: Dict[str, threading.Timer] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._polled: List[Any] = []
+
+    # --- sink interface used by PluginBase.watch() ---
+
+    def device_seen(self, plugin, device: Device) -> None:
+        with self._lock:
+            diff = DiscoveryDiff(type=plugin.type)
+            self.state.misses.pop(device.id, None)
+            pending = self._gone.pop(device.id, None)
+            if pending is not None:
+                pending.cancel()
+            with self.registry.batch():
+                _merge_seen(self.registry, device, diff)
+            self.state.log(diff, self.registry, {})
+        if diff:
+            log.info("%s: added=%s changed=%s", plugin.type, diff.added, diff.changed)
+
+    def device_gone(self, plugin, dev_id: str) -> None:
+        with self._lock:
+            device = self.registry.get(dev_id)
+            if device is None or device.type != plugin.type or not _removable(plugin, device):
+                return
+            if dev_id in self._gone:
+                return
+            timer = threading.Timer(self.grace, self._expire, (plugin, dev_id))
+            timer.daemon = True
+            self._gone[dev_id] = timer
+            timer.start()
+        log.info("%s: %s went away, removing in %gs unless it returns", plugin.type, dev_id,
+                 self.grace)
+
+    def _expire(self, plugin, dev_id: str) -> None:
+        with self._lock:
+            if self._gone.pop(dev_id, None) is None:
+                return  # seen again meanwhile
+            device = self.registry.get(dev_id)
+            if device is None or not _removable(plugin, device):
+                return
+            self.registry.remove(dev_id)
+            diff = DiscoveryDiff(type=plugin.type, removed=[dev_id])
+            self.state.log(diff, self.registry, {dev_id: device})
+        log.info("%s: removed=%s", plugin.type, diff.removed)
+
+    # --- lifecycle ---
+
+    def _poll(self) -> None:
+        polled = {p.type: p for p in self._polled}
+        runs = run_discovery(self.registry, polled, self.state, lock=self._lock)
+        for run in runs.values():
+            if not run.ok:
+                log.warning("Discovery failed for %s: %s", run.type, run.error)
+        with self._lock:
+            self.state.save()
+
+    def _run(self) -> None:
+        self._polled = []
+        for t, plugin in self.plugins.items():
+            try:
+                watching = plugin.watch(self)
+            except Exception as e:
+                log.warning("Watch failed for %s, falling back to polling: %s", t, e)
+                watching = False
+            if not watching:
+                self._polled.append(plugin)
+        while not self._stop.is_set():
+            if self._polled:
+                self._poll()
+            self._stop.wait(self.interval)
+        for plugin in self.plugins.values():
+            try:
+                plugin.unwatch()
+            except Exception:
+                pass
+        with self._lock:
+            self.state.save()
+
+    def start(self) -> "DiscoveryService":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="tvhub-discovery", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        with self._lock:
+            for timer in self._gone.values():
+                timer.cancel()
+            self._gone.clear()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run_forever(self) -> None:
+        try:
+            self._run()
+        except KeyboardInterrupt:
+            self._stop.set()
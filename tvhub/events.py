@@ -0,0 +1,94 @@
+"""In-process event bus for pushing registry and device-state changes to clients.
+
+Publishers (registry watcher, plugins) call bus.publish() from any thread.
+Each subscriber gets a bounded queue; a slow client loses its oldest
+events rather than holding up the publisher.
+"""
+from __future__ import annotations
+import asyncio
+import collections
+import threading
+import time
+from typing import Any, Deque, Dict, List, Optional
+
+from .metrics import EVENT_SUBSCRIBERS
+
+
+class Subscription:
+    def __init__(self, bus: "EventBus", maxlen: int,
+                 loop: Optional[asyncio.AbstractEventLoop] = None):
+        self._bus = bus
+        self._events: Deque[Dict[str, Any]] = collections.deque(maxlen=maxlen)
+        self._cond = threading.Condition()
+        self._loop = loop
+        self._async_wakeup: Optional[asyncio.Event] = asyncio.Event() if loop else None
+
+    def _push(self, event: Dict[str, Any]) -> None:
+        with self._cond:
+            self._events.append(event)
+            self._cond.notify()
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._async_wakeup.set)
+            except RuntimeError:
+                # Loop closed; the subscriber is gone.
+                self.close()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Next event, or None after timeout (blocking; for threaded servers)."""
+        with self._cond:
+            if not self._events:
+                self._cond.wait(timeout)
+            return self._events.popleft() if self._events else None
+
+    async def get_async(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Next event, or None after timeout (for the asyncio server)."""
+        while True:
+            with self._cond:
+                if self._events:
+                    return self._events.popleft()
+                self._async_wakeup.clear()
+            try:
+                await asyncio.wait_for(self._async_wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+    def close(self) -> None:
+        self._bus._unsubscribe(self)
+
+
+class EventBus:
+    def __init__(self, maxlen: int = 256):
+        self.maxlen = maxlen
+        self._subs: List[Subscription] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> Subscription:
+        sub = Subscription(self, self.maxlen, loop)
+        with self._lock:
+            self._subs.append(sub)
+        return sub
+
+    def _unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            if sub in self._subs:
+                self._subs.remove(sub)
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        event.setdefault("ts", time.time())
+        with self._lock:
+            subs = list(self._subs)
+        for sub in subs:
+            sub._push(event)
+
+    def publish_state(self, device_id: str, **state: Any) -> None:
+        """Shorthand for device state updates (volume, mute, foreground app...)."""
+        self.publish({"type": "state", "device": device_id, **state})
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subs)
+
+
+bus = EventBus()
+EVENT_SUBSCRIBERS.set_function(lambda: bus.subscribers)
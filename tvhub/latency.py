@@ -0,0 +1,177 @@
+"""Per-device response-time model, adaptive timeouts and a retry budget.
+
+Each transport endpoint (an adb device, a Hisense DMR) keeps a smoothed
+response time and its mean deviation, updated the way TCP estimates its
+retransmission timeout (RFC 6298): srtt += (rtt - srtt) / 8, rttvar +=
+(|rtt - srtt| - rttvar) / 4. The timeout for the next call is
+
+    clamp(TIMEOUT_FACTOR * (srtt + 4 * rttvar), LATENCY_MIN_TIMEOUT, LATENCY_MAX_TIMEOUT)
+
+doubled (up to 8x) after each timeout until the device answers again. A
+TV that normally answers in 20 ms gives up in half a second, while one that
+takes 800 ms stops timing out. Endpoints with no history use the old fixed
+timeout.
+
+Retries of idempotent calls are limited by a per-endpoint budget: every
+success earns LATENCY_RETRY_RATIO of a retry (up to LATENCY_RETRY_BURST),
+so a dead device can't multiply load, and each retry waits a jittered
+fraction of the smoothed response time.
+
+The model is saved to latency.json in the data dir (at most every
+LATENCY_SAVE_INTERVAL seconds) and reloaded on start.
+"""
+from __future__ import annotations
+import atexit
+import json
+import logging
+import os
+import random
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple, Type, TypeVar
+
+from .config import (
+    LATENCY_FILE, LATENCY_MIN_TIMEOUT, LATENCY_MAX_TIMEOUT, LATENCY_RETRY_RATIO,
+    LATENCY_RETRY_BURST, LATENCY_SAVE_INTERVAL,
+)
+
+log = logging.getLogger("tvhub")
+
+T = TypeVar("T")
+
+TIMEOUT_FACTOR = 3.0
+
+
+class _Endpoint:
+    __slots__ = ("srtt", "rttvar", "samples", "backoff", "budget")
+
+    def __init__(self, srtt: Optional[float] = None, rttvar: float = 0.0, samples: int = 0):
+        self.srtt = srtt
+        self.rttvar = rttvar
+        self.samples = samples
+        self.backoff = 1
+        self.budget = float(LATENCY_RETRY_BURST)
+
+
+class LatencyModel:
+    def __init__(self, path: Path = LATENCY_FILE):
+        self.path = path
+        self._endpoints: Dict[str, _Endpoint] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saved = time.monotonic()
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            data = json.loads(self.path.read_text())
+            for key, v in data.items():
+                self._endpoints[key] = _Endpoint(float(v["srtt"]), float(v["rttvar"]),
+                                                 int(v.get("samples", 0)))
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            pass
+
+    def _endpoint(self, key: str) -> _Endpoint:
+        ep = self._endpoints.get(key)
+        if ep is None:
+            ep = self._endpoints.setdefault(key, _Endpoint())
+        return ep
+
+    # --- model ---
+
+    def observe(self, key: str, seconds: float) -> None:
+        """Record how long a successful call to key took."""
+        with self._lock:
+            ep = self._endpoint(key)
+            if ep.srtt is None:
+                ep.srtt, ep.rttvar = seconds, seconds / 2
+            else:
+                ep.rttvar += (abs(seconds - ep.srtt) - ep.rttvar) / 4
+                ep.srtt += (seconds - ep.srtt) / 8
+            ep.samples += 1
+            ep.backoff = 1
+            ep.budget = min(float(LATENCY_RETRY_BURST), ep.budget + LATENCY_RETRY_RATIO)
+            self._dirty = True
+        self._maybe_save()
+
+    def timed_out(self, key: str) -> None:
+        """Record a timeout: the next timeout for key doubles (up to the cap)."""
+        with self._lock:
+            ep = self._endpoint(key)
+            ep.backoff = min(ep.backoff * 2, 8)
+
+    def timeout(self, key: str, default: float) -> float:
+        """Seconds to allow the next call to key; `default` until it has history."""
+        ep = self._endpoints.get(key)
+        if ep is None or ep.srtt is None:
+            return default
+        base = max(LATENCY_MIN_TIMEOUT, TIMEOUT_FACTOR * (ep.srtt + 4 * ep.rttvar))
+        return min(base * ep.backoff, LATENCY_MAX_TIMEOUT)
+
+    # --- retries ---
+
+    def _take_retry(self, key: str) -> bool:
+        with self._lock:
+            ep = self._endpoint(key)
+            if ep.budget < 1:
+                return False
+            ep.budget -= 1
+            return True
+
+    def _pause(self, key: str, attempt: int) -> float:
+        ep = self._endpoints.get(key)
+        base = ep.srtt if ep is not None and ep.srtt is not None else 0.05
+        # Full jitter over an exponentially growing window.
+        return random.uniform(0, min(base * (2 ** attempt), 1.0))
+
+    def call(self, key: str, fn: Callable[[float], T], default: float,
+             retry_on: Tuple[Type[BaseException], ...] = (), timeouts: Tuple[Type[BaseException], ...] = (),
+             attempts: int = 2) -> T:
+        """Run fn(timeout), timing it into the model.
+
+        Exceptions in `timeouts` count as timeouts; those in `retry_on`
+        (only pass these for idempotent calls) are retried while the
+        endpoint's budget allows, up to `attempts` tries in total.
+        """
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                result = fn(self.timeout(key, default))
+            except BaseException as e:
+                if timeouts and isinstance(e, timeouts):
+                    self.timed_out(key)
+                attempt += 1
+                if (not retry_on or not isinstance(e, retry_on) or attempt >= attempts
+                        or not self._take_retry(key)):
+                    raise
+                time.sleep(self._pause(key, attempt))
+                continue
+            self.observe(key, time.monotonic() - start)
+            return result
+
+    # --- persistence ---
+
+    def _maybe_save(self) -> None:
+        if self._dirty and time.monotonic() - self._saved >= LATENCY_SAVE_INTERVAL:
+            self.save()
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {k: {"srtt": ep.srtt, "rttvar": ep.rttvar, "samples": ep.samples}
+                    for k, ep in self._endpoints.items() if ep.srtt is not None}
+            self._dirty = False
+            self._saved = time.monotonic()
+        tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            tmp.write_text(json.dumps(data))
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.debug("Could not save %s: %s", self.path, e)
+
+
+model = LatencyModel()
+atexit.register(model.save)
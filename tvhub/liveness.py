@@ -0,0 +1,196 @@
+"""Background reachability probing and per-device circuit breakers.
+
+Every PROBE_INTERVAL seconds each device gets a plain TCP connect to the
+port its plugin names (PluginBase.probe_address: the adb port for Google
+TVs, the DMR port for Hisense). After PROBE_FAILURES misses in a row the
+device is marked offline and its breaker opens: actions are refused at
+once instead of waiting out the transport timeout. The first successful
+probe closes it again. A failed action triggers an immediate probe, so a
+TV that was just switched off is noticed without waiting for the next
+round, and a successful one counts as proof of life: a device that has
+answered an action within the last PROBE_FAILURES rounds is never marked
+offline by probes (its probe port may simply differ from the one its
+transport uses).
+
+Online/offline changes are published as state events and show up as
+"online" in /api/devices.
+"""
+from __future__ import annotations
+import logging
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Set
+
+from .registry import DeviceRegistry, Device
+from .events import bus
+from .metrics import DEVICES_OFFLINE
+from .config import PROBE_INTERVAL, PROBE_TIMEOUT, PROBE_FAILURES, PROBE_WORKERS
+
+log = logging.getLogger("tvhub")
+
+
+@dataclass
+class DeviceHealth:
+    online: Optional[bool] = None   # None until the first probe answers either way
+    failures: int = 0
+    checked: float = 0.0            # monotonic time of the last probe
+    changed: float = 0.0
+    answered: float = 0.0           # monotonic time of the last successful action
+
+
+class LivenessMonitor:
+    def __init__(self, registry: DeviceRegistry, plugins: Any,
+                 interval: float = PROBE_INTERVAL, timeout: float = PROBE_TIMEOUT,
+                 failures: int = PROBE_FAILURES):
+        self.registry = registry
+        self.plugins = plugins
+        self.interval = interval
+        self.timeout = timeout
+        self.failures = max(1, failures)
+        # Bumped whenever a device goes online/offline (part of the /api/devices cache key).
+        self.version = 0
+        self._health: Dict[str, DeviceHealth] = {}
+        self._inflight: Set[str] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+        DEVICES_OFFLINE.set_function(self.offline_count)
+
+    # --- queries (cheap; called on every action) ---
+
+    def online(self, dev_id: str) -> Optional[bool]:
+        h = self._health.get(dev_id)
+        return h.online if h is not None else None
+
+    def allow(self, dev_id: str) -> bool:
+        """False while the device's breaker is open (known offline)."""
+        h = self._health.get(dev_id)
+        if h is None or h.online is not False:
+            return True
+        # Probing stopped or stalled: don't keep refusing on stale news.
+        return time.monotonic() - h.checked > 3 * self.interval
+
+    def offline_count(self) -> int:
+        return sum(1 for h in list(self._health.values()) if h.online is False)
+
+    def snapshot(self) -> Dict[str, Optional[bool]]:
+        return {dev_id: h.online for dev_id, h in list(self._health.items())}
+
+    # --- probing ---
+
+    def _address(self, device: Device):
+        plugin = self.plugins.get(device.type)
+        return plugin.probe_address(device) if plugin is not None else None
+
+    def _connect(self, address) -> bool:
+        try:
+            with socket.create_connection(address, self.timeout):
+                return True
+        except OSError:
+            return False
+
+    def probe(self, device: Device) -> Optional[bool]:
+        """Probe one device now and update its breaker; None if it can't be probed."""
+        try:
+            address = self._address(device)
+        except Exception as e:
+            log.debug("No probe address for %s: %s", device.id, e)
+            address = None
+        if address is None:
+            return None
+        reachable = self._connect(address)
+        self._record(device.id, reachable)
+        return reachable
+
+    def answered(self, dev_id: str) -> None:
+        """The device just completed an action, so it is up whatever probes say."""
+        with self._lock:
+            self._health.setdefault(dev_id, DeviceHealth()).answered = time.monotonic()
+        self._record(dev_id, True)
+
+    def _record(self, dev_id: str, reachable: bool) -> None:
+        now = time.monotonic()
+        with self._lock:
+            h = self._health.setdefault(dev_id, DeviceHealth())
+            h.checked = now
+            if not reachable and h.answered and now - h.answered < self.interval * self.failures:
+                reachable = True
+            h.failures = 0 if reachable else h.failures + 1
+            if reachable:
+                online = True
+            elif h.failures >= self.failures:
+                online = False
+            else:
+                return
+            if h.online == online:
+                return
+            h.online, h.changed = online, now
+            self.version += 1
+        log.info("%s is %s", dev_id, "online" if online else "offline")
+        bus.publish_state(dev_id, online=online)
+
+    def _probe_guarded(self, device: Device) -> None:
+        try:
+            self.probe(device)
+        finally:
+            with self._lock:
+                self._inflight.discard(device.id)
+
+    def check(self, device: Device) -> None:
+        """Probe a device soon (e.g. after an action failed), without blocking."""
+        if self._pool is None:
+            return
+        with self._lock:
+            if device.id in self._inflight:
+                return
+            self._inflight.add(device.id)
+        try:
+            self._pool.submit(self._probe_guarded, device)
+        except RuntimeError:  # pool shut down
+            with self._lock:
+                self._inflight.discard(device.id)
+
+    def probe_all(self) -> None:
+        devices = self.registry.all()
+        ids = {d.id for d in devices}
+        with self._lock:
+            for dev_id in [k for k in self._health if k not in ids]:
+                del self._health[dev_id]
+            todo = [d for d in devices if d.id not in self._inflight]
+            self._inflight.update(d.id for d in todo)
+        wait([self._pool.submit(self._probe_guarded, d) for d in todo])
+
+    # --- lifecycle ---
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.registry.refresh()
+                self.probe_all()
+            except Exception as e:
+                log.exception("Liveness probing failed: %s", e)
+            self._stop.wait(self.interval)
+
+    def start(self) -> "LivenessMonitor":
+        if self.interval <= 0:
+            return self
+        if self._thread is None:
+            self._stop.clear()
+            self._pool = ThreadPoolExecutor(max_workers=PROBE_WORKERS,
+                                            thread_name_prefix="tvhub-probe")
+            self._thread = threading.Thread(target=self._run, name="tvhub-liveness", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
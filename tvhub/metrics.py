@@ -0,0 +1,215 @@
+"""Process metrics in the Prometheus text format, served at /metrics.
+
+Counters, histograms and gauges are plain Python objects cheap enough to
+leave on: a labelled child is created once per label combination and then
+updated under its own small lock, and histograms keep fixed bucket counts
+rather than samples. All metrics are declared at the bottom of this module
+so the full catalogue is in one place.
+"""
+from __future__ import annotations
+import bisect
+import math
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+_METRICS: List["_Metric"] = []
+
+# Seconds; covers a cached reply (sub-ms) up to a device timing out.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        _METRICS.append(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """The child for these (string) label values, created on first use."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}")
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+        return child
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(c.value)}"
+                for k, c in list(self._children.items())]
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "_lock")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, child in list(self._children.items()):
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            running = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                running += n
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {running}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {running}")
+        return lines
+
+
+class Gauge(_Metric):
+    """A value read at scrape time from a callback (no bookkeeping in between)."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, help)
+        self._fn = fn
+
+    def set_function(self, fn: Callable[[], float]) -> None:
+        self._fn = fn
+
+    def _samples(self) -> List[str]:
+        if self._fn is None:
+            return []
+        try:
+            return [f"{self.name} {_format_value(self._fn())}"]
+        except Exception:
+            return []
+
+
+def error_kind(exc: BaseException) -> str:
+    """Coarse error class for labels, without importing the libraries involved."""
+    names = {c.__name__ for c in type(exc).__mro__}
+    if any("Timeout" in n for n in names) or isinstance(exc, TimeoutError):
+        return "timeout"
+    if "HTTPError" in names:
+        return "http"
+    if isinstance(exc, OSError) or "ConnectionError" in names:
+        return "connect"
+    return "exception"
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# --- the catalogue ---
+
+ACTION_SECONDS = Histogram(
+    "tvhub_action_seconds", "Time spent running device actions",
+    ("plugin", "action", "device"))
+ACTIONS = Counter(
+    "tvhub_actions_total", "Device actions by outcome (ok, error, busy, offline)",
+    ("plugin", "action", "outcome"))
+ACTIONS_COALESCED = Counter(
+    "tvhub_actions_coalesced_total", "Commands merged into an already queued one",
+    ("plugin",))
+TRANSPORT_ERRORS = Counter(
+    "tvhub_transport_errors_total", "Device transport errors by kind (timeout, http, connect, adb_exit...)",
+    ("plugin", "kind"))
+SUBPROCESS_SPAWNS = Counter(
+    "tvhub_subprocess_spawns_total", "Child processes started", ("plugin", "command"))
+HTTP_CONNECTIONS = Counter(
+    "tvhub_http_connections_total", "New HTTP connections opened to devices", ("plugin",))
+REGISTRY_RELOADS = Counter(
+    "tvhub_registry_reloads_total", "Times devices.json was re-read after changing on disk")
+DISCOVERY_SECONDS = Histogram(
+    "tvhub_discovery_seconds", "Duration of one plugin's discovery run", ("plugin",),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 30.0))
+DISCOVERY_RUNS = Counter(
+    "tvhub_discovery_runs_total", "Discovery runs by outcome (ok, error, timeout)",
+    ("plugin", "outcome"))
+EVENT_SUBSCRIBERS = Gauge(
+    "tvhub_event_subscribers", "Connected WebSocket/SSE clients")
+DEVICES_OFFLINE = Gauge(
+    "tvhub_devices_offline", "Devices whose liveness probe is failing (breaker open)")
@@ -1,19 +1,110 @@
 from __future__ import annotations
+import asyncio
 import importlib
-import pkgutil
-from typing import Dict, Type
+import json
+import logging
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Type, Optional, Tuple
+
+from ..config import ASYNC_OFFLOAD_THREADS, PLUGIN_ENTRY_POINTS
 
 from ..registry import DeviceRegistry, Device
 
+# Runs sync plugins for the default async hooks; sized so many slow devices
+# can be waited on at once without starving each other.
+_offload: Optional[ThreadPoolExecutor] = None
+# Event loop (on its own thread) that runs plugins with native async I/O
+# for callers on plain threads: the device queues and discovery.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_pools_lock = threading.Lock()
+
+
+def _offload_pool() -> ThreadPoolExecutor:
+    global _offload
+    with _pools_lock:
+        if _offload is None:
+            _offload = ThreadPoolExecutor(max_workers=ASYNC_OFFLOAD_THREADS,
+                                          thread_name_prefix="tvhub-offload")
+        return _offload
+
+
+def _plugin_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _pools_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="tvhub-plugin-loop",
+                             daemon=True).start()
+        return _loop
+
+
+def native_async(plugin: Any, hook: str) -> bool:
+    """True if plugin overrides the async hook (e.g. "handle_action_async")."""
+    return getattr(type(plugin), hook, None) is not getattr(PluginBase, hook)
+
+
+def call_action(plugin: "PluginBase", registry: DeviceRegistry, device: Device, action: str,
+                params: Dict[str, Any]) -> Any:
+    """Run an action from a plain thread: native async plugins on the shared
+    plugin loop, sync ones right here (the caller's thread is the offload)."""
+    if native_async(plugin, "handle_action_async"):
+        coro = plugin.handle_action_async(registry, device, action, params)
+        return asyncio.run_coroutine_threadsafe(coro, _plugin_loop()).result()
+    return plugin.handle_action(registry, device, action, params)
+
+
+def call_discover_async(plugin: "PluginBase", registry: DeviceRegistry,
+                        timeout: Optional[float] = None) -> None:
+    """Run a native async plugin's discover_async from a plain thread."""
+    coro = plugin.discover_async(registry, timeout)
+    asyncio.run_coroutine_threadsafe(coro, _plugin_loop()).result()
+
 class PluginBase:
     """Base class plugins should subclass."""
     type: str = "base"
     friendly_name: str = "Base Plugin"
+    # False for plugins whose discover() cannot see all their devices (e.g.
+    # hand-seeded ones); discovery then never removes devices of this type.
+    active_discovery: bool = True
 
-    def discover(self, registry: DeviceRegistry) -> None:
-        """Discover devices of this type and upsert them into registry."""
+    def discover(self, registry: DeviceRegistry, timeout: Optional[float] = None) -> None:
+        """Discover devices of this type and upsert them into registry.
+
+        Should return within `timeout` seconds, earlier if results settle.
+        """
         raise NotImplementedError
 
+    def removable(self, device: Device) -> bool:
+        """May discovery drop this device once it stops being seen?"""
+        return not device.meta.get("pinned")
+
+    def probe_address(self, device: Device) -> Optional[Tuple[str, int]]:
+        """(host, port) whose TCP connect tells whether the device is up.
+
+        Defaults to the device address when it has a port; None skips
+        liveness probing for the device.
+        """
+        host, sep, port = device.address.rpartition(":")
+        if not sep or not port.isdigit():
+            return None
+        return host, int(port)
+
+    def watch(self, sink) -> bool:
+        """Start continuous discovery, reporting to sink as devices come and go.
+
+        sink.device_seen(plugin, device) / sink.device_gone(plugin, dev_id)
+        may be called from any thread. Return False if the plugin can only
+        be polled via discover().
+        """
+        return False
+
+    def unwatch(self) -> None:
+        """Stop continuous discovery started by watch()."""
+
     def actions(self) -> Dict[str, str]:
         '''Return mapping of action name -> description.'''
         return {}
@@ -22,17 +113,178 @@ class PluginBase:
         """Perform an action on a device."""
         raise NotImplementedError
 
+    def coalesce(self, queued: Tuple[str, Dict[str, Any]],
+                 incoming: Tuple[str, Dict[str, Any]]) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Merge an incoming (action, params) into the command queued just before it.
+
+        Return one (action, params) with the effect of running both in
+        order, or None to queue the incoming command separately (the
+        default). See tvhub.commands.
+        """
+        return None
+
+    # Async variants. Plugins with native async I/O override these; the
+    # device queues (tvhub.commands) and discovery then run them on a
+    # shared event loop (see call_action). The defaults run the sync method
+    # on a worker thread, so callers on an event loop never block on a
+    # device whichever kind of plugin they get.
+
+    async def handle_action_async(self, registry: DeviceRegistry, device: Device, action: str, params):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _offload_pool(), self.handle_action, registry, device, action, params)
+
+    async def discover_async(self, registry: DeviceRegistry, timeout: Optional[float] = None) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(_offload_pool(), self.discover, registry, timeout)
+
+
+log = logging.getLogger("tvhub.plugins")
+
+MANIFEST_FILE = Path(__file__).with_name("manifest.json")
+ENTRY_POINT_GROUP = "tvhub.plugins"
+
+
+@dataclass
+class PluginSpec:
+    """What the hub knows about a plugin without importing it."""
+    type: str
+    module: str
+    cls: str
+    friendly_name: str = ""
+    actions: Dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, ptype: str, data: Dict[str, Any]) -> "PluginSpec":
+        return cls(type=ptype, module=data["module"], cls=data["class"],
+                   friendly_name=data.get("friendly_name", ptype),
+                   actions=dict(data.get("actions") or {}))
+
+
+def _entry_point_specs() -> List[PluginSpec]:
+    """External plugins registered under the "tvhub.plugins" entry point group.
+
+    The entry point name is the device type. It may point at a manifest
+    dict (same keys as manifest.json, imported without the plugin itself)
+    or straight at the PluginBase subclass, which then has to be imported
+    to be listed.
+    """
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return []
+    try:
+        eps = entry_points(group=ENTRY_POINT_GROUP)
+    except TypeError:  # Python < 3.10
+        eps = entry_points().get(ENTRY_POINT_GROUP, [])
+    specs = []
+    for ep in eps:
+        try:
+            target = ep.load()
+            if isinstance(target, dict):
+                specs.append(PluginSpec.from_dict(ep.name, target))
+            elif isinstance(target, type) and issubclass(target, PluginBase):
+                # Actions come from the instance once it is first used.
+                specs.append(PluginSpec(type=ep.name, module=target.__module__,
+                                        cls=target.__name__, friendly_name=target.friendly_name))
+            else:
+                log.warning("Entry point %s is neither a manifest nor a plugin class", ep.name)
+        except Exception as e:
+            log.warning("Skipping plugin entry point %s: %s", ep.name, e)
+    return specs
+
+
+def load_manifest() -> Dict[str, PluginSpec]:
+    """Built-in manifest plus entry-point plugins (which may override built-ins)."""
+    specs = {t: PluginSpec.from_dict(t, d)
+             for t, d in json.loads(MANIFEST_FILE.read_text()).items()}
+    if PLUGIN_ENTRY_POINTS:
+        for spec in _entry_point_specs():
+            specs[spec.type] = spec
+    return specs
+
+
+class Plugins(Mapping):
+    """type -> plugin instance, importing each plugin module on first use.
+
+    Listing types, friendly names and actions reads the manifest only;
+    indexing (plugins["gtv"], plugins.get(...), .items()) imports and
+    instantiates that plugin once.
+    """
+
+    def __init__(self, specs: Dict[str, PluginSpec]):
+        self.specs = specs
+        self._loaded: Dict[str, PluginBase] = {}
+        self._failed: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, ptype: str) -> PluginBase:
+        plugin = self._loaded.get(ptype)
+        if plugin is not None:
+            return plugin
+        spec = self.specs[ptype]
+        with self._lock:
+            if ptype in self._loaded:
+                return self._loaded[ptype]
+            if ptype in self._failed:
+                raise KeyError(ptype)
+            try:
+                cls: Type[PluginBase] = getattr(importlib.import_module(spec.module), spec.cls)
+                plugin = cls()
+            except Exception as e:
+                log.error("Cannot load plugin %s from %s: %s", ptype, spec.module, e)
+                self._failed[ptype] = str(e)
+                raise KeyError(ptype) from e
+            if spec.actions and set(plugin.actions()) != set(spec.actions):
+                log.warning("Manifest actions for %s differ from the plugin's", ptype)
+            self._loaded[ptype] = plugin
+            return plugin
+
+    def __contains__(self, ptype: object) -> bool:
+        return ptype in self.specs and ptype not in self._failed
+
+    def __iter__(self) -> Iterator[str]:
+        return (t for t in self.specs if t not in self._failed)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def items(self):
+        # A plugin that fails to import is left out rather than raising.
+        out = []
+        for t in list(self):
+            try:
+                out.append((t, self[t]))
+            except KeyError:
+                pass
+        return out
+
+    def values(self):
+        return [p for _, p in self.items()]
+
+    def actions(self, ptype: str) -> Dict[str, str]:
+        """Actions for a type: the plugin's own once loaded, else the manifest's."""
+        plugin = self._loaded.get(ptype)
+        if plugin is not None:
+            return plugin.actions()
+        spec = self.specs.get(ptype)
+        if spec is None:
+            return {}
+        if not spec.actions and ptype in self:
+            try:
+                return self[ptype].actions()
+            except KeyError:
+                return {}
+        return dict(spec.actions)
+
+    @property
+    def loaded(self) -> List[str]:
+        return list(self._loaded)
+
 
-def load_plugins() -> Dict[str, PluginBase]:
-    import tvhub.plugins as pkg
-    plugin_map: Dict[str, PluginBase] = {}
-    for _, mod_name, _ in pkgutil.iter_modules(pkg.__path__):
-        if mod_name.startswith("_"):
-            continue
-        module = importlib.import_module(f"tvhub.plugins.{mod_name}")
-        for attr in dir(module):
-            obj = getattr(module, attr)
-            if isinstance(obj, type) and issubclass(obj, PluginBase) and obj is not PluginBase:
-                plugin = obj()
-                plugin_map[plugin.type] = plugin
-    return plugin_map
+def load_plugins(eager: bool = False) -> Plugins:
+    """All known plugins; modules are imported on first use unless eager."""
+    plugins = Plugins(load_manifest())
+    if eager:
+        plugins.items()
+    return plugins
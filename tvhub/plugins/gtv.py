@@ -1,31 +1,133 @@
 from __future__ import annotations
+import re
+import socket
 import subprocess
-from typing import Dict, Any, List
+import threading
+import time
+from typing import Dict, Any, List, Optional, Callable, Tuple
 
 from zeroconf import Zeroconf, ServiceBrowser, ServiceListener, ServiceInfo
 
 from . import PluginBase
 from ..registry import DeviceRegistry, Device
-from ..config import ADB_BIN
+from ..adb import AdbPool, AdbError, AdbServerUnavailable, ShellResult
+from ..events import bus
+from ..latency import model as latency
+from ..metrics import SUBPROCESS_SPAWNS, TRANSPORT_ERRORS, error_kind
+from ..config import (
+    ADB_BIN, ADB_MODE, DISCOVERY_TIMEOUT, DISCOVERY_QUIET, GTV_TEXT_CHUNK,
+    GTV_STATUS_TTL,
+)
 
 SERVICE = "_adb-tls-connect._tcp.local."
 
+# Filter on the TV so only the resumed-activity line crosses the wire;
+# grep -m 1 exits on the first hit, which also cuts dumpsys short.
+STATUS_CMD = "dumpsys activity activities | grep -m 1 -E 'ResumedActivity:|topResumedActivity='"
+_COMPONENT_RE = re.compile(r"\s([\w.]+)/([\w.$]+)")
+
+
+def _spawn(args: List[str], timeout: float) -> subprocess.CompletedProcess:
+    """subprocess.run for the adb binary, counted per subcommand."""
+    SUBPROCESS_SPAWNS.labels("gtv", args[3] if args[1] == "-s" else args[1]).inc()
+    return subprocess.run(args, capture_output=True, text=True, timeout=timeout)
+
+
+def _noted(res):
+    if res.returncode != 0:
+        TRANSPORT_ERRORS.labels("gtv", "adb_exit").inc()
+    return res
+
+
+def _failed(e: BaseException) -> ShellResult:
+    TRANSPORT_ERRORS.labels("gtv", "adb" if isinstance(e, AdbError) else error_kind(e)).inc()
+    return ShellResult(1, "", str(e))
+
+
+def _is_resumed_line(line: str) -> bool:
+    return "ResumedActivity:" in line or "topResumedActivity=" in line
+
 class _GtvListener(ServiceListener):
-    def __init__(self):
+    def __init__(self,
+                 on_found: Optional[Callable[[str, ServiceInfo], None]] = None,
+                 on_removed: Optional[Callable[[str], None]] = None):
         self.found: Dict[str, ServiceInfo] = {}
+        self.on_found = on_found
+        self.on_removed = on_removed
+        self._cond = threading.Condition()
+        self._last_change = 0.0
+
+    def _record(self, name: str, info: ServiceInfo) -> None:
+        with self._cond:
+            is_new = name not in self.found
+            self.found[name] = info
+            if is_new:
+                self._last_change = time.monotonic()
+            self._cond.notify_all()
+        if self.on_found:
+            self.on_found(name, info)
+
+    def wait_settled(self, deadline: float, quiet: float, expected: int = 0) -> None:
+        """Block until deadline, or earlier once answers stop coming in.
+
+        Returns as soon as `expected` services are known, or when at least
+        one answer arrived and nothing new showed up for `quiet` seconds.
+        """
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    return
+                if self.found:
+                    if expected and len(self.found) >= expected:
+                        return
+                    if now - self._last_change >= quiet:
+                        return
+                self._cond.wait(min(deadline - now, quiet))
 
     def remove_service(self, zc, type_, name):
         self.found.pop(name, None)
+        if self.on_removed:
+            self.on_removed(name)
 
     def add_service(self, zc, type_, name):
         info = zc.get_service_info(type_, name)
         if info:
-            self.found[name] = info
+            self._record(name, info)
 
     def update_service(self, zc, type_, name):
         info = zc.get_service_info(type_, name)
         if info:
-            self.found[name] = info
+            self._record(name, info)
+
+def _sh_quote(s: str) -> str:
+    return "'" + s.replace("'", "'\\''") + "'"
+
+
+def _text_commands(text: str, chunk: int) -> List[str]:
+    """Turn text into `input text` / ENTER commands for the device shell.
+
+    `input text` reads "%s" as a space, so spaces are encoded that way and
+    a literal "%s" in the input is split across two commands. Newlines
+    become ENTER key events. Each chunk is single-quoted for the shell.
+    """
+    cmds: List[str] = []
+    for i, line in enumerate(text.split("\n")):
+        if i:
+            cmds.append("input keyevent 66")
+        pieces: List[str] = []
+        cur = ""
+        for ch in line:
+            if len(cur) >= chunk or (ch == "s" and cur.endswith("%")):
+                pieces.append(cur)
+                cur = ""
+            cur += ch
+        if cur:
+            pieces.append(cur)
+        for piece in pieces:
+            cmds.append("input text " + _sh_quote(piece.replace(" ", "%s")))
+    return cmds
+
 
 class GoogleTVPlugin(PluginBase):
     type = "gtv"
@@ -62,84 +164,279 @@ class GoogleTVPlugin(PluginBase):
         "9": 16,
     }
 
-    def discover(self, registry: DeviceRegistry) -> None:
+    def __init__(self):
+        self._zc: Optional[Zeroconf] = None
+        self._browser: Optional[ServiceBrowser] = None
+        self._pool = AdbPool()
+        # address -> (monotonic time, status result)
+        self._status_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        # Last foreground (package, activity) pushed to event subscribers.
+        self._foreground: Dict[str, Tuple[str, Optional[str]]] = {}
+
+    @staticmethod
+    def _device_id(name: str) -> str:
+        return name.split(".")[0]  # e.g. adb-XXXX
+
+    def _device_from_info(self, name: str, info: ServiceInfo) -> Optional[Device]:
+        if not info.addresses:
+            return None
+        ip_bytes = info.addresses[0]
+        ip = ".".join(map(str, ip_bytes))
+        port = info.port
+        dev_id = self._device_id(name)
+        return Device(
+            id=dev_id,
+            name=dev_id,
+            type=self.type,
+            address=f"{ip}:{port}",
+            meta={"raw_name": name},
+        )
+
+    def discover(self, registry: DeviceRegistry, timeout: Optional[float] = None) -> None:
+        deadline = time.monotonic() + (timeout if timeout is not None else DISCOVERY_TIMEOUT)
+        # Stop as soon as every TV we already know about has answered.
+        expected = sum(1 for d in registry.all() if d.type == self.type)
         zc = Zeroconf()
         listener = _GtvListener()
         browser = ServiceBrowser(zc, SERVICE, listener)
-        import time
-        time.sleep(3)
-        zc.close()
+        try:
+            listener.wait_settled(deadline, DISCOVERY_QUIET, expected)
+        finally:
+            zc.close()
 
         for name, info in listener.found.items():
-            if not info.addresses:
-                continue
-            ip_bytes = info.addresses[0]
-            ip = ".".join(map(str, ip_bytes))
-            port = info.port
-            dev_id = name.split(".")[0]  # e.g. adb-XXXX
-            device = Device(
-                id=dev_id,
-                name=dev_id,
-                type=self.type,
-                address=f"{ip}:{port}",
-                meta={"raw_name": name},
-            )
-            registry.upsert(device)
+            device = self._device_from_info(name, info)
+            if device:
+                registry.upsert(device)
+
+    def watch(self, sink) -> bool:
+        """Keep one Zeroconf browser alive and forward announcements to sink."""
+        if self._zc is not None:
+            return True
+
+        def found(name: str, info: ServiceInfo) -> None:
+            device = self._device_from_info(name, info)
+            if device:
+                sink.device_seen(self, device)
+
+        def removed(name: str) -> None:
+            sink.device_gone(self, self._device_id(name))
+
+        self._zc = Zeroconf()
+        self._browser = ServiceBrowser(self._zc, SERVICE, _GtvListener(found, removed))
+        return True
+
+    def unwatch(self) -> None:
+        if self._zc is not None:
+            self._zc.close()
+        self._zc = None
+        self._browser = None
 
     def actions(self) -> Dict[str, str]:
         return {
             "button": "Send a remote button by name or keycode",
             "text": "Send text input",
             "keyevent": "Send a raw numeric keyevent",
-            "status": "Basic adb shell dumpsys activity activities",
+            "sequence": "Send several buttons/keycodes in one device command",
+            "status": "Foreground activity (cached briefly; pass fresh=1 to bypass)",
         }
 
     # --- internal helpers ---
 
     def _adb(self, addr: str, args: List[str]) -> subprocess.CompletedProcess:
-        cmd = [ADB_BIN, "-s", addr] + args
-        return subprocess.run(cmd, capture_output=True, text=True, timeout=5)
+        return latency.call(f"adb-cli:{addr}", lambda t: _spawn([ADB_BIN, "-s", addr] + args, t),
+                            5, timeouts=(subprocess.TimeoutExpired,))
 
-    def _button(self, device: Device, name: str) -> Dict[str, Any]:
-        name = name.upper()
+    def _shell(self, device: Device, cmd: str):
+        """Run a shell command on the device, over the pooled native session if possible."""
+        if ADB_MODE == "native":
+            try:
+                return _noted(latency.call(
+                    f"adb:{device.address}",
+                    lambda t: self._pool.run(device.address, cmd, timeout=t),
+                    5, timeouts=(socket.timeout,)))
+            except AdbServerUnavailable:
+                # Fall through: the adb binary starts the server, so the
+                # next call can go native again.
+                pass
+            except (AdbError, OSError) as e:
+                return _failed(e)
+        _spawn([ADB_BIN, "connect", device.address], timeout=5)
+        return _noted(self._adb(device.address, ["shell", cmd]))
+
+    def _shell_many(self, device: Device, cmds: List[str], extra: float = 0) -> List[Any]:
+        """Pipeline several commands over one session (one adb spawn in fallback mode).
+
+        Gets the device's usual timeout plus `extra` seconds; the run is too
+        long to say anything about the device's latency, so it isn't timed.
+        """
+        if ADB_MODE == "native":
+            timeout = latency.timeout(f"adb:{device.address}", 5) + extra
+            try:
+                return [_noted(r) for r in self._pool.run_many(device.address, cmds, timeout=timeout)]
+            except AdbServerUnavailable:
+                pass
+            except (AdbError, OSError) as e:
+                return [_failed(e)]
+        _spawn([ADB_BIN, "connect", device.address], timeout=5)
+        cmd = [ADB_BIN, "-s", device.address, "shell", " && ".join(cmds)]
+        return [_noted(_spawn(cmd, timeout=latency.timeout(f"adb-cli:{device.address}", 5) + extra))]
+
+    def _keycode(self, name: str) -> Optional[int]:
+        name = str(name).strip().upper()
         if name in self.KEYCODES:
-            code = self.KEYCODES[name]
-        elif name.isdigit():
-            code = int(name)
-        else:
-            return {"ok": False, "error": "Unknown key", "input": name}
-        # connect
-        subprocess.run([ADB_BIN, "connect", device.address], capture_output=True, text=True, timeout=5)
-        res = self._adb(device.address, ["shell", "input", "keyevent", str(code)])
+            return self.KEYCODES[name]
+        if name.isdigit():
+            return int(name)
+        return None
+
+    def _send_keys(self, device: Device, codes: List[int]):
+        self._status_cache.pop(device.address, None)
+        return self._shell(device, "input keyevent " + " ".join(str(c) for c in codes))
+
+    def _button(self, device: Device, name: str) -> Dict[str, Any]:
+        code = self._keycode(name)
+        if code is None:
+            return {"ok": False, "error": "Unknown key", "input": name.upper()}
+        res = self._send_keys(device, [code])
         ok = (res.returncode == 0)
         return {"ok": ok, "code": code, "stdout": res.stdout, "stderr": res.stderr}
 
-    def _text(self, device: Device, text: str) -> Dict[str, Any]:
-        subprocess.run([ADB_BIN, "connect", device.address], capture_output=True, text=True, timeout=5)
-        res = self._adb(device.address, ["shell", "input", "text", text.replace(" ", "%s")])
+    def _sequence(self, device: Device, keys) -> Dict[str, Any]:
+        if isinstance(keys, str):
+            keys = [k for k in keys.split(",") if k.strip()]
+        codes = []
+        for k in keys or []:
+            code = self._keycode(k)
+            if code is None:
+                return {"ok": False, "error": "Unknown key", "input": str(k).upper()}
+            codes.append(code)
+        if not codes:
+            return {"ok": False, "error": "No keys given"}
+        res = self._send_keys(device, codes)
         ok = (res.returncode == 0)
-        return {"ok": ok, "stdout": res.stdout, "stderr": res.stderr}
+        return {"ok": ok, "codes": codes, "stdout": res.stdout, "stderr": res.stderr}
 
-    def _status(self, device: Device) -> Dict[str, Any]:
-        subprocess.run([ADB_BIN, "connect", device.address], capture_output=True, text=True, timeout=5)
-        res = self._adb(device.address, ["shell", "dumpsys", "activity", "activities"])
-        ok = (res.returncode == 0)
+    def _text(self, device: Device, text: str) -> Dict[str, Any]:
+        cmds = _text_commands(text, GTV_TEXT_CHUNK)
+        self._status_cache.pop(device.address, None)
+        if not cmds:
+            return {"ok": True, "chars": 0, "chunks": 0, "seconds": 0.0}
+        start = time.monotonic()
+        # Every chunk is written up front; the device works through them
+        # while we wait for the results.
+        results = self._shell_many(device, cmds, extra=len(cmds))
+        elapsed = time.monotonic() - start
+        ok = all(r.returncode == 0 for r in results)
+        return {
+            "ok": ok,
+            "chars": len(text),
+            "chunks": len(cmds),
+            "seconds": round(elapsed, 3),
+            "chars_per_sec": round(len(text) / elapsed, 1) if elapsed else None,
+            "stdout": "".join(r.stdout for r in results),
+            "stderr": "".join(r.stderr for r in results),
+        }
+
+    def _status_line(self, device: Device) -> Tuple[bool, Optional[str], str]:
+        """Return (ok, resumed-activity line, stderr), reading no further than needed."""
+        if ADB_MODE == "native":
+            try:
+                # Read-only, so a dropped or stalled session may be retried.
+                res = latency.call(f"adb:{device.address}",
+                                   lambda t: self._pool.run(device.address, STATUS_CMD, timeout=t),
+                                   5, retry_on=(OSError,), timeouts=(socket.timeout,))
+                # grep exits 1 when nothing matched (e.g. screen off); not an error.
+                lines = [l.strip() for l in res.stdout.splitlines() if _is_resumed_line(l)]
+                return res.returncode in (0, 1), (lines[0] if lines else None), ""
+            except AdbServerUnavailable:
+                pass
+            except (AdbError, OSError) as e:
+                return False, None, _failed(e).stderr
+        _spawn([ADB_BIN, "connect", device.address], timeout=5)
+        SUBPROCESS_SPAWNS.labels("gtv", "shell").inc()
+        proc = subprocess.Popen([ADB_BIN, "-s", device.address, "shell", STATUS_CMD],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
         top = None
-        if ok:
-            for line in res.stdout.splitlines():
-                line = line.strip()
-                if "ResumedActivity:" in line or "topResumedActivity=" in line:
-                    top = line
+        key = f"adb-cli:{device.address}"
+        start = time.monotonic()
+        try:
+            timer = threading.Timer(latency.timeout(key, 5), proc.kill)
+            timer.start()
+            for line in proc.stdout:
+                if _is_resumed_line(line):
+                    top = line.strip()
                     break
-        return {"ok": ok, "top": top, "stdout": res.stdout[:4000], "stderr": res.stderr}
+        finally:
+            timer.cancel()
+            if proc.poll() is None:
+                proc.kill()
+            _, err = proc.communicate()
+        ok = top is not None or proc.returncode in (0, 1)
+        if ok:
+            latency.observe(key, time.monotonic() - start)
+        elif proc.returncode is not None and proc.returncode < 0:
+            latency.timed_out(key)  # killed by the timer
+        return ok, top, err or ""
+
+    def _status(self, device: Device, fresh: bool = False) -> Dict[str, Any]:
+        now = time.monotonic()
+        cached = self._status_cache.get(device.address)
+        if cached and not fresh and now - cached[0] < GTV_STATUS_TTL:
+            return {**cached[1], "cached": True, "age": round(now - cached[0], 3)}
+        ok, top, err = self._status_line(device)
+        package = activity = None
+        if top:
+            m = _COMPONENT_RE.search(top)
+            if m:
+                package, activity = m.group(1), m.group(2)
+        result = {"ok": ok, "top": top, "package": package, "activity": activity,
+                  "stdout": top or "", "stderr": err}
+        if ok:
+            self._status_cache[device.address] = (time.monotonic(), result)
+            if package and self._foreground.get(device.id) != (package, activity):
+                self._foreground[device.id] = (package, activity)
+                bus.publish_state(device.id, package=package, activity=activity)
+        return {**result, "cached": False}
+
+    @staticmethod
+    def _keys_of(action: str, params: Dict[str, Any]) -> Optional[List[str]]:
+        if action == "button":
+            return [str(params.get("key", "HOME"))]
+        if action == "keyevent":
+            return [str(params.get("code", "3"))]
+        if action == "sequence":
+            keys = params.get("keys", [])
+            if isinstance(keys, str):
+                keys = [k for k in keys.split(",") if k.strip()]
+            return [str(k) for k in keys or []]
+        return None
+
+    def coalesce(self, queued, incoming):
+        if queued[0] == incoming[0] == "status":
+            fresh = any(str(p.get("fresh", "")).lower() in ("1", "true", "yes", "on")
+                        for _, p in (queued, incoming))
+            return "status", {"fresh": fresh}
+        # Key presses waiting behind a running command go out as one sequence;
+        # an unknown key keeps its own command so it can't fail the others.
+        first, second = self._keys_of(*queued), self._keys_of(*incoming)
+        if first is None or second is None:
+            return None
+        keys = first + second
+        if any(self._keycode(k) is None for k in keys):
+            return None
+        return "sequence", {"keys": keys}
 
     def handle_action(self, registry: DeviceRegistry, device: Device, action: str, params):
         if action == "button":
             return self._button(device, params.get("key", "HOME"))
         if action == "keyevent":
             return self._button(device, str(params.get("code", "3")))
+        if action == "sequence":
+            return self._sequence(device, params.get("keys", []))
         if action == "text":
             return self._text(device, params.get("text", ""))
         if action == "status":
-            return self._status(device)
+            fresh = str(params.get("fresh", "")).lower() in ("1", "true", "yes", "on")
+            return self._status(device, fresh)
         return {"ok": False, "error": f"Unknown action {action}"}
@@ -1,15 +1,31 @@
 from __future__ import annotations
+import json
+import re
+import threading
+import time
 import xml.etree.ElementTree as ET
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool
 
 from . import PluginBase
 from ..registry import DeviceRegistry, Device
-from ..config import HISENSE_DMR_PORT, HISENSE_INSTANCE_ID, HISENSE_CHANNEL
+from ..upnp import EventSubscriber, DescriptionCache, ssdp_search
+from ..events import bus
+from ..latency import model as latency
+from ..metrics import HTTP_CONNECTIONS, TRANSPORT_ERRORS, error_kind
+from ..config import (
+    HISENSE_DMR_PORT, HISENSE_INSTANCE_ID, HISENSE_CHANNEL, HISENSE_POOL_SIZE,
+    HISENSE_EVENTS, HISENSE_EVENT_PORT, HISENSE_SSDP_MATCH, SSDP_ADDRESS, SSDP_CACHE_FILE,
+    DISCOVERY_TIMEOUT,
+)
 
 SOAP_NS = "http://schemas.xmlsoap.org/soap/envelope/"
 RCS_URN = "urn:schemas-upnp-org:service:RenderingControl:1"
+MEDIA_RENDERER = "urn:schemas-upnp-org:device:MediaRenderer:1"
 
 def _soap_envelope(action: str, body_xml: str) -> str:
     return f"""<?xml version="1.0" encoding="utf-8"?>
@@ -25,72 +41,272 @@ def _soap_envelope(action: str, body_xml: str) -> str:
 def _control_url(ip: str) -> str:
     return f"http://{ip}:{HISENSE_DMR_PORT}/control/RenderingControl"
 
-def _post(ip: str, action: str, body_xml: str) -> requests.Response:
-    envelope = _soap_envelope(action, body_xml)
-    headers = {
+def _event_url(ip: str) -> str:
+    return f"http://{ip}:{HISENSE_DMR_PORT}/event/RenderingControl"
+
+
+def _compile_envelope(action: str, arg: Optional[str] = None) -> Tuple[bytes, bytes]:
+    """Pre-render the envelope for action around a single variable argument.
+
+    Returns (head, tail) so a request body is head + value + tail.
+    """
+    body = (f"<InstanceID>{HISENSE_INSTANCE_ID}</InstanceID>"
+            f"<Channel>{HISENSE_CHANNEL}</Channel>")
+    if arg:
+        body += f"<{arg}>\0</{arg}>"
+    head, _, tail = _soap_envelope(action, body).partition("\0")
+    return head.encode("utf-8"), tail.encode("utf-8")
+
+
+_ENVELOPES: Dict[str, Tuple[bytes, bytes]] = {
+    "GetVolume": _compile_envelope("GetVolume"),
+    "SetVolume": _compile_envelope("SetVolume", "DesiredVolume"),
+    "GetMute": _compile_envelope("GetMute"),
+    "SetMute": _compile_envelope("SetMute", "DesiredMute"),
+}
+_HEADERS: Dict[str, Dict[str, str]] = {
+    action: {
         "Content-Type": "text/xml; charset=\"utf-8\"",
         "SOAPACTION": f"\"{RCS_URN}#{action}\"",
     }
-    url = _control_url(ip)
-    resp = requests.post(url, data=envelope.encode("utf-8"), headers=headers, timeout=3)
-    resp.raise_for_status()
-    return resp
-
-def hisense_get_volume(ip: str) -> int:
-    body = f"""
-      <InstanceID>{HISENSE_INSTANCE_ID}</InstanceID>
-      <Channel>{HISENSE_CHANNEL}</Channel>
-    """
-    resp = _post(ip, "GetVolume", body)
-    root = ET.fromstring(resp.text)
-    volume = 0
-    for elem in root.findall(".//CurrentVolume"):
-        try:
-            volume = int(elem.text)
-        except Exception:
-            volume = 0
-    return volume
+    for action in _ENVELOPES
+}
+
+class _CountingPool(HTTPConnectionPool):
+    def _new_conn(self):
+        HTTP_CONNECTIONS.labels("hisense").inc()
+        return super()._new_conn()
+
+
+class _CountingAdapter(HTTPAdapter):
+    """HTTPAdapter whose http:// pools count the TCP connections they open."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            **self.poolmanager.pool_classes_by_scheme, "http": _CountingPool}
+
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def _session(ip: str) -> requests.Session:
+    """Keep-alive session per TV, so repeated calls reuse one TCP connection."""
+    with _sessions_lock:
+        sess = _sessions.get(ip)
+        if sess is None:
+            sess = requests.Session()
+            adapter = _CountingAdapter(pool_connections=1, pool_maxsize=HISENSE_POOL_SIZE,
+                                       pool_block=True, max_retries=0)
+            sess.mount("http://", adapter)
+            _sessions[ip] = sess
+        return sess
+
+
+def _post(ip: str, action: str, value: Any = None, url: Optional[str] = None) -> requests.Response:
+    head, tail = _ENVELOPES[action]
+    data = head + (str(value).encode("ascii") if value is not None else b"") + tail
+    url = url or _control_url(ip)
+
+    def post(timeout: float) -> requests.Response:
+        resp = _session(ip).post(url, data=data, headers=_HEADERS[action], timeout=timeout)
+        resp.raise_for_status()
+        return resp
+
+    # Every RenderingControl call we make is idempotent (Set* take absolute
+    # values), so connection drops and timeouts may be retried.
+    return latency.call(f"http:{ip}", post, 3,
+                        retry_on=(requests.ConnectionError, requests.Timeout),
+                        timeouts=(requests.Timeout,))
+
+
+def _element_text(xml: bytes, tag: str) -> Optional[str]:
+    """Text of the first <tag> in a SOAP reply; regex first, ElementTree if unusual."""
+    m = re.search(rb"<(?:\w+:)?" + tag.encode() + rb">\s*([^<]*?)\s*</", xml)
+    if m:
+        return m.group(1).decode("utf-8", "replace")
+    try:
+        root = ET.fromstring(xml)
+    except ET.ParseError:
+        return None
+    for elem in root.iter():
+        if elem.tag == tag or elem.tag.endswith("}" + tag):
+            return elem.text
+    return None
+
+
+def hisense_get_volume(ip: str, url: Optional[str] = None) -> int:
+    resp = _post(ip, "GetVolume", url=url)
+    try:
+        return int(_element_text(resp.content, "CurrentVolume"))
+    except (TypeError, ValueError):
+        return 0
 
-def hisense_set_volume(ip: str, vol: int) -> None:
+def hisense_set_volume(ip: str, vol: int, url: Optional[str] = None) -> None:
     vol = max(0, min(100, int(vol)))
-    body = f"""
-      <InstanceID>{HISENSE_INSTANCE_ID}</InstanceID>
-      <Channel>{HISENSE_CHANNEL}</Channel>
-      <DesiredVolume>{vol}</DesiredVolume>
-    """
-    _post(ip, "SetVolume", body)
+    _post(ip, "SetVolume", vol, url)
 
-def hisense_get_mute(ip: str) -> bool:
-    body = f"""
-      <InstanceID>{HISENSE_INSTANCE_ID}</InstanceID>
-      <Channel>{HISENSE_CHANNEL}</Channel>
-    """
-    resp = _post(ip, "GetMute", body)
-    root = ET.fromstring(resp.text)
-    for elem in root.findall(".//CurrentMute"):
-        return elem.text == "1"
-    return False
-
-def hisense_set_mute(ip: str, mute: bool) -> None:
-    body = f"""
-      <InstanceID>{HISENSE_INSTANCE_ID}</InstanceID>
-      <Channel>{HISENSE_CHANNEL}</Channel>
-      <DesiredMute>{1 if mute else 0}</DesiredMute>
-    """
-    _post(ip, "SetMute", body)
+def hisense_get_mute(ip: str, url: Optional[str] = None) -> bool:
+    resp = _post(ip, "GetMute", url=url)
+    return _element_text(resp.content, "CurrentMute") == "1"
+
+def hisense_set_mute(ip: str, mute: bool, url: Optional[str] = None) -> None:
+    _post(ip, "SetMute", 1 if mute else 0, url)
+
+
+def _truthy(value: Any) -> bool:
+    return str(value).lower() in ("1", "true", "yes", "on")
 
 
 class HisenseTVPlugin(PluginBase):
     type = "hisense"
     friendly_name = "Hisense TV (UPnP DMR)"
 
-    def discover(self, registry: DeviceRegistry) -> None:
-        """Very simple: if user already knows IPs they can seed registry manually.
+    def __init__(self):
+        # ip -> {"volume": int, "mute": bool, "updated": monotonic time}
+        self._state: Dict[str, Dict[str, Any]] = {}
+        self._state_lock = threading.Lock()
+        # ip -> device id, so state changes can be pushed per device.
+        self._ids: Dict[str, str] = {}
+        self._events: Optional[EventSubscriber] = None
+        if HISENSE_EVENTS:
+            self._events = EventSubscriber(self._on_event, port=HISENSE_EVENT_PORT)
+        self._descriptions = DescriptionCache()
+        try:
+            self._descriptions.load(json.loads(SSDP_CACHE_FILE.read_text()))
+        except (OSError, ValueError):
+            pass
+
+    # --- local state kept current by RenderingControl events ---
+
+    def _on_event(self, ip: str, values: Dict[str, str]) -> None:
+        update: Dict[str, Any] = {}
+        if "Volume" in values:
+            try:
+                update["volume"] = int(values["Volume"])
+            except ValueError:
+                pass
+        if "Mute" in values:
+            update["mute"] = values["Mute"].lower() in ("1", "true")
+        if update:
+            self._remember(ip, **update)
+
+    def _remember(self, ip: str, **values: Any) -> None:
+        with self._state_lock:
+            st = self._state.setdefault(ip, {})
+            changed = {k: v for k, v in values.items() if st.get(k) != v}
+            st.update(values)
+            st["updated"] = time.monotonic()
+            dev_id = self._ids.get(ip)
+        if changed and dev_id:
+            bus.publish_state(dev_id, **changed)
+
+    def _cached(self, device: Device, ip: str, key: str) -> Optional[Any]:
+        """Value from the event-fed cache, or None if it can't be trusted."""
+        if self._events is None:
+            return None
+        url = device.meta.get("rcs_event_url") or _event_url(ip)
+        if not self._events.ensure(ip, url):
+            return None
+        with self._state_lock:
+            return self._state.get(ip, {}).get(key)
+
+    def _get_volume(self, device: Device, ip: str) -> int:
+        v = self._cached(device, ip, "volume")
+        if v is None:
+            v = hisense_get_volume(ip, device.meta.get("rcs_control_url"))
+            self._remember(ip, volume=v)
+        return v
 
-        We only keep already-registered hisense devices (no active discovery).
+    def _set_volume(self, device: Device, ip: str, v: int) -> int:
+        v = max(0, min(100, int(v)))
+        hisense_set_volume(ip, v, device.meta.get("rcs_control_url"))
+        self._remember(ip, volume=v)
+        return v
+
+    def _get_mute(self, device: Device, ip: str) -> bool:
+        m = self._cached(device, ip, "mute")
+        if m is None:
+            m = hisense_get_mute(ip, device.meta.get("rcs_control_url"))
+            self._remember(ip, mute=m)
+        return m
+
+    def _set_mute(self, device: Device, ip: str, m: bool) -> None:
+        hisense_set_mute(ip, m, device.meta.get("rcs_control_url"))
+        self._remember(ip, mute=m)
+
+    def removable(self, device: Device) -> bool:
+        # Hand-seeded TVs (no SSDP identity, or pinned once SSDP adopted
+        # them) stay until the user removes them.
+        return "udn" in device.meta and not device.meta.get("pinned")
+
+    def probe_address(self, device: Device) -> Optional[Tuple[str, int]]:
+        url = urlparse(device.meta.get("rcs_control_url") or _control_url(device.address.split(":")[0]))
+        return url.hostname, url.port or 80
+
+    def discover(self, registry: DeviceRegistry, timeout: Optional[float] = None) -> None:
+        """SSDP search for MediaRenderers, keeping those that look like Hisense TVs.
+
+        Description fetches start as soon as each response arrives; a TV
+        whose LOCATION hasn't changed is served from the description cache.
         """
-        # In future you can add SSDP discovery here; for now we do nothing.
-        return
+        timeout = timeout if timeout is not None else DISCOVERY_TIMEOUT
+        deadline = time.monotonic() + timeout
+        futures = []
+        # Leave part of the budget for description fetches still in flight.
+        ssdp_search(MEDIA_RENDERER, timeout * 0.6,
+                    lambda headers: futures.append(self._descriptions.fetch(headers)),
+                    address=SSDP_ADDRESS)
+        for fut in futures:
+            try:
+                desc = fut.result(timeout=max(deadline - time.monotonic(), 0.0))
+            except Exception:
+                continue
+            device = self._device_from_description(registry, desc)
+            if device:
+                with self._state_lock:
+                    self._ids[device.address] = device.id
+                registry.upsert(device)
+        try:
+            SSDP_CACHE_FILE.write_text(json.dumps(self._descriptions.dump()))
+        except OSError:
+            pass
+
+    def _device_from_description(self, registry: DeviceRegistry,
+                                 desc: Dict[str, Any]) -> Optional[Device]:
+        ident = " ".join((desc.get("manufacturer", ""), desc.get("model", ""),
+                          desc.get("friendly_name", ""))).lower()
+        if HISENSE_SSDP_MATCH not in ident:
+            return None
+        ip = urlparse(desc["location"]).hostname or ""
+        udn = desc.get("udn") or ip
+        # Adopt a hand-seeded entry for the same TV rather than duplicating it.
+        existing = next((d for d in registry.all()
+                         if d.type == self.type and d.address.split(":")[0] == ip), None)
+        dev_id = existing.id if existing else "hisense-" + udn.replace("uuid:", "")[-12:]
+        rcs = desc.get("services", {}).get(RCS_URN, {})
+        meta = {
+            "udn": desc.get("udn", ""),
+            "manufacturer": desc.get("manufacturer", ""),
+            "model": desc.get("model", ""),
+            "model_number": desc.get("model_number", ""),
+            "location": desc["location"],
+        }
+        if rcs.get("control_url"):
+            meta["rcs_control_url"] = rcs["control_url"]
+        if rcs.get("event_url"):
+            meta["rcs_event_url"] = rcs["event_url"]
+        if existing is not None and ("udn" not in existing.meta or existing.meta.get("pinned")):
+            # Adopting doesn't make a hand-seeded (or pinned) TV removable.
+            meta["pinned"] = True
+        return Device(
+            id=dev_id,
+            name=existing.name if existing else (desc.get("friendly_name") or dev_id),
+            type=self.type,
+            address=ip,
+            meta=meta,
+        )
 
     def actions(self) -> Dict[str, str]:
         return {
@@ -103,40 +319,61 @@ class HisenseTVPlugin(PluginBase):
             "toggle_mute": "Toggle mute",
         }
 
+    def coalesce(self, queued, incoming):
+        prev_action, prev = queued
+        action, params = incoming
+        steps = {"volume_up": 1, "volume_down": -1}
+        try:
+            if action == prev_action and action in ("set_volume", "set_mute", "get_volume", "get_mute"):
+                return incoming
+            if prev_action == "set_volume" and action in steps:
+                # A relative step after an absolute write becomes one absolute write.
+                v = int(prev.get("volume", 0)) + steps[action] * int(params.get("step", 5))
+                return "set_volume", {"volume": max(0, min(100, v))}
+            if prev_action in steps and action in steps:
+                net = (steps[prev_action] * int(prev.get("step", 5))
+                       + steps[action] * int(params.get("step", 5)))
+                return ("volume_up" if net >= 0 else "volume_down"), {"step": abs(net)}
+        except (TypeError, ValueError):
+            return None
+        if prev_action == "set_mute" and action == "toggle_mute":
+            return "set_mute", {"mute": not _truthy(prev.get("mute", "false"))}
+        return None
+
     def handle_action(self, registry: DeviceRegistry, device: Device, action: str, params):
         ip = device.address.split(":")[0]
+        with self._state_lock:
+            self._ids[ip] = device.id
         step = int(params.get("step", 5))
         try:
             if action == "get_volume":
-                v = hisense_get_volume(ip)
+                v = self._get_volume(device, ip)
                 return {"ok": True, "volume": v}
             if action == "set_volume":
-                v = int(params.get("volume", 0))
-                hisense_set_volume(ip, v)
+                v = self._set_volume(device, ip, int(params.get("volume", 0)))
                 return {"ok": True, "volume": v}
             if action == "volume_up":
-                cur = hisense_get_volume(ip)
-                new = max(0, min(100, cur + step))
-                hisense_set_volume(ip, new)
+                cur = self._get_volume(device, ip)
+                new = self._set_volume(device, ip, cur + step)
                 return {"ok": True, "from": cur, "to": new}
             if action == "volume_down":
-                cur = hisense_get_volume(ip)
-                new = max(0, min(100, cur - step))
-                hisense_set_volume(ip, new)
+                cur = self._get_volume(device, ip)
+                new = self._set_volume(device, ip, cur - step)
                 return {"ok": True, "from": cur, "to": new}
             if action == "get_mute":
-                m = hisense_get_mute(ip)
+                m = self._get_mute(device, ip)
                 return {"ok": True, "mute": m}
             if action == "set_mute":
-                v = str(params.get("mute", "false")).lower() in ("1", "true", "yes", "on")
-                hisense_set_mute(ip, v)
+                v = _truthy(params.get("mute", "false"))
+                self._set_mute(device, ip, v)
                 return {"ok": True, "mute": v}
             if action == "toggle_mute":
-                cur = hisense_get_mute(ip)
+                cur = self._get_mute(device, ip)
                 new = not cur
-                hisense_set_mute(ip, new)
+                self._set_mute(device, ip, new)
                 return {"ok": True, "from": cur, "to": new}
         except Exception as e:
+            TRANSPORT_ERRORS.labels(self.type, error_kind(e)).inc()
             return {"ok": False, "error": str(e)}
 
         return {"ok": False, "error": f"Unknown action {action}"}
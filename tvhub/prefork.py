@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""Pre-fork serving mode: several HTTP workers, one owner of device state.
+
+The supervisor binds the API port, then forks
+
+  * one broker (tvhub.broker.BrokerServer), which runs tvhub.core as the
+    single-process server would: registry, plugins, device connections,
+    command queues, liveness probing and embedded discovery;
+  * --workers HTTP workers running tvhub.app on the shared listening
+    socket (the kernel spreads connections between them), answering
+    through a BrokerClient instead of their own copy of tvhub.core.
+
+Workers never import tvhub.core (tvhub.app only does when no backend
+was set), so they open no registry, load no plugins and never talk to a
+TV. Adding workers adds request handling capacity while commands from
+every worker still meet in the same per-device queues, behind one set of
+device connections and caches.
+Everything is imported after forking, so no process inherits another's
+sockets, database handles or threads.
+
+Children that die are restarted; SIGTERM/SIGINT stops them all.
+
+    python -m tvhub.prefork --workers 4
+"""
+from __future__ import annotations
+import argparse
+import logging
+import os
+import secrets
+import signal
+import socket
+import sys
+import time
+from typing import Callable, Dict
+
+from .config import HTTP_HOST, HTTP_PORT, HTTP_WORKERS, BROKER_SOCKET
+
+log = logging.getLogger("tvhub")
+
+
+def _run_broker(authkey: bytes) -> None:
+    from .broker import BrokerServer
+    from . import core
+    server = BrokerServer(str(BROKER_SOCKET), authkey)
+    core.start_services()
+    server.serve_forever()
+
+
+def _run_worker(listener: socket.socket, authkey: bytes) -> None:
+    from werkzeug.serving import make_server
+    from .broker import BrokerClient
+    from . import app as web
+    web.backend = BrokerClient(str(BROKER_SOCKET), authkey)
+    host, port = listener.getsockname()[:2]
+    make_server(host, port, web.app, threaded=True, fd=listener.fileno()).serve_forever()
+
+
+def _wait_for_broker(timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if BROKER_SOCKET.exists():
+            return
+        time.sleep(0.05)
+    raise SystemExit(f"broker did not come up on {BROKER_SOCKET}")
+
+
+class Supervisor:
+    def __init__(self, workers: int, host: str = HTTP_HOST, port: int = HTTP_PORT):
+        self.workers = workers
+        self.listener = socket.create_server((host, port), backlog=512)
+        # The broker authenticates workers with a key only this process tree knows.
+        self.authkey = secrets.token_bytes(32)
+        self.children: Dict[int, str] = {}
+        self.stopping = False
+
+    def _fork(self, role: str, target: Callable[[], None]) -> None:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                target()
+            except BaseException:
+                log.exception("tvhub %s exited", role)
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = role
+        log.info("Started %s (pid %d)", role, pid)
+
+    def _start(self, role: str) -> None:
+        if role == "broker":
+            # Workers are restarted into a running broker; a new broker
+            # has to be up before anything talks to it.
+            try:
+                BROKER_SOCKET.unlink()
+            except FileNotFoundError:
+                pass
+            self._fork(role, lambda: _run_broker(self.authkey))
+            try:
+                _wait_for_broker()
+            except SystemExit:
+                # Exiting would orphan the workers (and the broker, if it
+                # is merely slow); take them down with us.
+                self._terminate()
+                raise
+        else:
+            self._fork(role, lambda: _run_worker(self.listener, self.authkey))
+
+    def _stop(self, signum, frame) -> None:
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _terminate(self, timeout: float = 10.0) -> None:
+        """SIGTERM every child and reap it, SIGKILLing any still up after timeout."""
+        self.stopping = True
+        self._stop(signal.SIGTERM, None)
+        deadline = time.monotonic() + timeout
+        while self.children:
+            for pid in list(self.children):
+                try:
+                    done, _ = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    done = pid
+                if done:
+                    self.children.pop(pid, None)
+            if not self.children:
+                break
+            if time.monotonic() >= deadline:
+                for pid in list(self.children):
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                        os.waitpid(pid, 0)
+                    except (ProcessLookupError, ChildProcessError):
+                        pass
+                    self.children.pop(pid, None)
+                break
+            time.sleep(0.05)
+        try:
+            BROKER_SOCKET.unlink()
+        except FileNotFoundError:
+            pass
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        # Fork before any threads exist in this process.
+        self._start("broker")
+        for i in range(self.workers):
+            self._start(f"worker-{i}")
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            role = self.children.pop(pid, None)
+            if role is None or self.stopping:
+                continue
+            log.warning("%s (pid %d) exited with status %d; restarting", role, pid, status)
+            time.sleep(0.5)
+            self._start(role)
+        try:
+            BROKER_SOCKET.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=HTTP_WORKERS,
+                        help="HTTP worker processes (default: TVHUB_WORKERS or CPU count)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+    if not hasattr(os, "fork"):
+        raise SystemExit("tvhub.prefork needs os.fork (use tvhub.app or tvhub.asgi)")
+    Supervisor(max(1, args.workers)).run()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,15 @@
 from __future__ import annotations
 import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
 from dataclasses import dataclass, asdict
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple, Iterator
 
-from .config import DEVICES_FILE, DATA_DIR
+from .config import DEVICES_FILE, DATA_DIR, REGISTRY_BACKEND
+from .metrics import REGISTRY_RELOADS
 
 @dataclass
 class Device:
@@ -14,39 +19,250 @@ class Device:
     address: str  # e.g. 'ip:port' or 'ip'
     meta: Dict[str, Any]
 
+
+class FileWatcher:
+    """Cheap "did this file change?" check.
+
+    Uses inotify on the parent directory where available (so atomic
+    rename-over writes are seen too) and falls back to comparing
+    (mtime, size, inode) from stat() on every check.
+    """
+
+    _IN_MODIFY = 0x002
+    _IN_CLOSE_WRITE = 0x008
+    _IN_MOVED_TO = 0x080
+    _IN_CREATE = 0x100
+    _IN_DELETE = 0x200
+    _IN_NONBLOCK = 0o4000
+    _IN_CLOEXEC = 0o2000000
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._fd: Optional[int] = None
+        self._pending = True
+        self._init_inotify()
+
+    def _init_inotify(self) -> None:
+        if os.environ.get("TVHUB_NO_INOTIFY"):
+            return
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(self._IN_NONBLOCK | self._IN_CLOEXEC)
+            if fd < 0:
+                return
+            mask = (self._IN_MODIFY | self._IN_CLOSE_WRITE | self._IN_MOVED_TO
+                    | self._IN_CREATE | self._IN_DELETE)
+            wd = libc.inotify_add_watch(fd, str(self.path.parent).encode(), mask)
+            if wd < 0:
+                os.close(fd)
+                return
+            self._fd = fd
+        except (OSError, AttributeError):
+            self._fd = None
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self._fd is not None
+
+    def poll(self) -> bool:
+        """Return True if the file may have changed since the last poll."""
+        if self._fd is None:
+            return True
+        changed = self._pending
+        self._pending = False
+        while True:
+            try:
+                if not os.read(self._fd, 4096):
+                    break
+                changed = True
+            except BlockingIOError:
+                break
+            except OSError:
+                # Watch went away (e.g. directory removed); degrade to stat.
+                self.close()
+                return True
+        return changed
+
+    def close(self) -> None:
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = None
+
+
 class DeviceRegistry:
     def __init__(self, path: Path = DEVICES_FILE):
         self.path = path
         DATA_DIR.mkdir(parents=True, exist_ok=True)
         self.devices: Dict[str, Device] = {}
+        # Bumped every time the in-memory device set changes; callers can
+        # compare it to skip work when nothing moved.
+        self.generation = 0
+        self._lock = threading.RLock()
+        self._signature: Optional[Tuple[int, int, int]] = None
+        self._watcher = FileWatcher(self.path)
+        self._batch_depth = 0
+        # Inside batch() writes go to a copy, published on commit; the
+        # batching thread reads the copy, everyone else the committed set.
+        self._staged: Optional[Dict[str, Device]] = None
+        self._batch_owner: Optional[int] = None
+        self._dirty = False
         self.load()
 
-    def load(self) -> None:
-        if not self.path.exists():
-            self.devices = {}
-            return
+    def _stat_signature(self) -> Optional[Tuple[int, int, int]]:
         try:
-            data = json.loads(self.path.read_text())
-            self.devices = {
-                k: Device(**v) for k, v in data.items()
-            }
-        except Exception:
-            self.devices = {}
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def load(self) -> None:
+        with self._lock:
+            signature = self._stat_signature()
+            if signature is None:
+                devices: Dict[str, Device] = {}
+            else:
+                try:
+                    data = json.loads(self.path.read_text())
+                    devices = {
+                        k: Device(**v) for k, v in data.items()
+                    }
+                except Exception:
+                    # Writers replace the file atomically, so this is a
+                    # hand-edit gone wrong; keep serving what we had.
+                    return
+            self._signature = signature
+            if devices != self.devices:
+                self.devices = devices
+                self.generation += 1
+
+    def refresh(self) -> bool:
+        """Reload from disk only if devices.json changed. Returns True if reloaded."""
+        with self._lock:
+            if not self._watcher.poll():
+                return False
+            if self._stat_signature() == self._signature:
+                return False
+            before = self.generation
+            REGISTRY_RELOADS.inc()
+            self.load()
+            return self.generation != before
 
     def save(self) -> None:
+        """Persist devices; inside batch() the write is deferred to commit."""
+        with self._lock:
+            if self._batch_depth:
+                self._dirty = True
+                return
+            self._write()
+
+    def _write(self) -> None:
         data = {k: asdict(v) for k, v in self.devices.items()}
-        self.path.write_text(json.dumps(data, indent=2))
+        payload = json.dumps(data, indent=2).encode("utf-8")
+        fd, tmp = tempfile.mkstemp(prefix=f".{self.path.name}.", suffix=".tmp",
+                                   dir=str(self.path.parent))
+        try:
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        try:
+            dir_fd = os.open(str(self.path.parent), os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        except OSError:
+            pass
+        self._signature = self._stat_signature()
+        self.generation += 1
+
+    @contextmanager
+    def batch(self) -> Iterator["DeviceRegistry"]:
+        """Group upserts/removals into one atomic write of devices.json.
+
+        The registry lock is held for the whole batch, so writes from other
+        threads wait for it, and they keep reading the committed devices
+        until it ends. The outermost batch first picks up changes other
+        processes made to devices.json, so it never writes back a stale
+        copy over them. Batches nest; only the outermost one commits. If
+        the block raises, the staged changes are dropped and nothing is
+        written.
+        """
+        with self._lock:
+            if self._batch_depth == 0:
+                self.refresh()
+                self._staged = dict(self.devices)
+                self._batch_owner = threading.get_ident()
+                self._dirty = False
+            self._batch_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    self._staged = self._batch_owner = None
+                    self._dirty = False
+                raise
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self.devices = self._staged
+                self._staged = self._batch_owner = None
+                if self._dirty:
+                    self._dirty = False
+                    self._write()
+
+    def _view(self) -> Dict[str, Device]:
+        """The devices this thread should see: staged ones inside its own batch."""
+        staged = self._staged
+        if staged is not None and self._batch_owner == threading.get_ident():
+            return staged
+        return self.devices
 
     def all(self) -> List[Device]:
-        return list(self.devices.values())
+        return list(self._view().values())
 
     def get(self, dev_id: str) -> Optional[Device]:
-        return self.devices.get(dev_id)
+        return self._view().get(dev_id)
+
+    # Writers always go through batch(), so even a single upsert starts
+    # from what is on disk.
 
     def upsert(self, device: Device) -> None:
-        self.devices[device.id] = device
-        self.save()
+        with self.batch():
+            self._view()[device.id] = device
+            self.save()
 
     def remove_type(self, dev_type: str) -> None:
-        self.devices = {k: v for k, v in self.devices.items() if v.type != dev_type}
-        self.save()
+        with self.batch():
+            devices = self._view()
+            for dev_id in [k for k, v in devices.items() if v.type == dev_type]:
+                del devices[dev_id]
+            self.save()
+
+    def remove(self, dev_id: str) -> Optional[Device]:
+        with self.batch():
+            device = self._view().pop(dev_id, None)
+            if device is not None:
+                self.save()
+            return device
+
+
+def open_registry():
+    """The registry for the configured backend (TVHUB_REGISTRY=json|sqlite)."""
+    if REGISTRY_BACKEND == "sqlite":
+        from .sqlite_registry import SQLiteDeviceRegistry
+        return SQLiteDeviceRegistry()
+    return DeviceRegistry()
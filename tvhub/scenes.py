@@ -0,0 +1,316 @@
+"""Scenes: named multi-device routines run server-side in one request.
+
+Scenes live in scenes.json next to devices.json::
+
+    {
+      "movie_night": {
+        "steps": [
+          {"id": "home", "device": "adb-1234", "action": "button", "params": {"key": "HOME"}},
+          {"id": "app", "device": "adb-1234", "action": "sequence",
+           "params": {"keys": ["RIGHT", "ENTER"]}, "after": ["home"], "delay": 0.5},
+          {"id": "volume", "device": "hisense-lounge", "action": "set_volume",
+           "params": {"volume": 18}},
+          {"id": "quiet", "selector": {"tag": "bedroom"}, "action": "set_mute",
+           "params": {"mute": true}, "timeout": 3}
+        ]
+      }
+    }
+
+A step targets one "device" or every device matching a "selector" (as for
+bulk actions), waits for the steps listed in "after", sleeps "delay"
+seconds and then has "timeout" seconds to finish. Steps with no pending
+dependencies run concurrently; a step whose dependency failed is skipped.
+
+The file is validated and compiled once when it changes; a scene that
+fails validation is reported by SceneBook.errors and cannot be run.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .registry import FileWatcher
+from .config import SCENES_FILE, SCENE_STEP_TIMEOUT
+
+log = logging.getLogger("tvhub")
+
+Response = Tuple[Dict[str, Any], int]
+
+_STEP_KEYS = {"id", "device", "selector", "action", "params", "after", "delay", "timeout"}
+
+
+class SceneError(ValueError):
+    """A scene definition is malformed."""
+
+
+@dataclass(frozen=True)
+class Step:
+    id: str
+    action: str
+    params: Dict[str, Any]
+    device: Optional[str] = None
+    selector: Optional[Dict[str, Any]] = None
+    after: Tuple[str, ...] = ()
+    delay: float = 0.0
+    timeout: float = SCENE_STEP_TIMEOUT
+
+    def target(self) -> Dict[str, Any]:
+        return {"device": self.device} if self.device else {"selector": self.selector}
+
+
+@dataclass(frozen=True)
+class Scene:
+    name: str
+    # Topologically ordered, so every step comes after its dependencies.
+    steps: Tuple[Step, ...]
+    # step id -> ids of the steps waiting on it
+    dependents: Dict[str, Tuple[str, ...]]
+
+    def roots(self) -> List[Step]:
+        return [s for s in self.steps if not s.after]
+
+
+def _number(spec: Dict[str, Any], key: str, default: float, where: str) -> float:
+    value = spec.get(key, default)
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise SceneError(f"{where}: {key} must be a number")
+    if value < 0 or (key == "timeout" and value == 0):
+        raise SceneError(f"{where}: {key} must be positive")
+    return value
+
+
+def _compile_step(spec: Any, index: int) -> Step:
+    where = f"step {index}"
+    if not isinstance(spec, dict):
+        raise SceneError(f"{where}: must be an object")
+    unknown = set(spec) - _STEP_KEYS
+    if unknown:
+        raise SceneError(f"{where}: unknown keys {', '.join(sorted(unknown))}")
+    step_id = str(spec.get("id") or index)
+    where = f"step {step_id!r}"
+    if not isinstance(spec.get("action"), str) or not spec["action"]:
+        raise SceneError(f"{where}: action is required")
+    device, selector = spec.get("device"), spec.get("selector")
+    if bool(device) == ("selector" in spec):
+        raise SceneError(f"{where}: give exactly one of device or selector")
+    if "selector" in spec and (not isinstance(selector, dict) or not selector):
+        raise SceneError(f"{where}: selector must be a non-empty object")
+    params = spec.get("params") or {}
+    if not isinstance(params, dict):
+        raise SceneError(f"{where}: params must be an object")
+    after = spec.get("after") or []
+    if isinstance(after, str):
+        after = [after]
+    if not isinstance(after, list):
+        raise SceneError(f"{where}: after must be a list of step ids")
+    return Step(
+        id=step_id,
+        action=spec["action"],
+        params=params,
+        device=str(device) if device else None,
+        selector=selector if not device else None,
+        after=tuple(str(a) for a in after),
+        delay=_number(spec, "delay", 0.0, where),
+        timeout=_number(spec, "timeout", SCENE_STEP_TIMEOUT, where),
+    )
+
+
+def compile_scene(name: str, spec: Any) -> Scene:
+    """Validate one scene definition and order its steps; raises SceneError."""
+    raw = spec.get("steps") if isinstance(spec, dict) else spec
+    if not isinstance(raw, list) or not raw:
+        raise SceneError("steps must be a non-empty list")
+    steps: Dict[str, Step] = {}
+    for i, s in enumerate(raw):
+        step = _compile_step(s, i)
+        if step.id in steps:
+            raise SceneError(f"duplicate step id {step.id!r}")
+        steps[step.id] = step
+    dependents: Dict[str, List[str]] = {sid: [] for sid in steps}
+    for step in steps.values():
+        for dep in step.after:
+            if dep not in steps:
+                raise SceneError(f"step {step.id!r}: unknown dependency {dep!r}")
+            dependents[dep].append(step.id)
+    # Kahn's algorithm, keeping file order among steps that are ready together.
+    waiting = {sid: len(set(s.after)) for sid, s in steps.items()}
+    ordered: List[Step] = []
+    ready = [sid for sid, n in waiting.items() if n == 0]
+    while ready:
+        sid = ready.pop(0)
+        ordered.append(steps[sid])
+        for nxt in dict.fromkeys(dependents[sid]):
+            waiting[nxt] -= 1
+            if waiting[nxt] == 0:
+                ready.append(nxt)
+    if len(ordered) != len(steps):
+        cycle = sorted(sid for sid, n in waiting.items() if n)
+        raise SceneError(f"dependency cycle between steps {', '.join(cycle)}")
+    return Scene(name, tuple(ordered),
+                 {sid: tuple(dict.fromkeys(deps)) for sid, deps in dependents.items()})
+
+
+class SceneBook:
+    """Compiled scenes from scenes.json, recompiled only when the file changes."""
+
+    def __init__(self, path: Path = SCENES_FILE):
+        self.path = path
+        self.scenes: Dict[str, Scene] = {}
+        self.errors: Dict[str, str] = {}
+        self._signature: Optional[Tuple[int, int, int]] = None
+        self._watcher = FileWatcher(self.path)
+        self._lock = threading.Lock()
+
+    def _stat_signature(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def refresh(self) -> None:
+        with self._lock:
+            if not self._watcher.poll():
+                return
+            signature = self._stat_signature()
+            if signature == self._signature:
+                return
+            self._signature = signature
+            if signature is None:
+                self.scenes, self.errors = {}, {}
+                return
+            try:
+                data = json.loads(self.path.read_text())
+                if not isinstance(data, dict):
+                    raise ValueError("expected an object of scenes")
+            except (OSError, ValueError) as e:
+                log.error("Ignoring %s: %s", self.path, e)
+                self.errors = {"*": str(e)}
+                return
+            scenes, errors = {}, {}
+            for name, spec in data.items():
+                try:
+                    scenes[name] = compile_scene(name, spec)
+                except SceneError as e:
+                    log.error("Scene %r: %s", name, e)
+                    errors[name] = str(e)
+            self.scenes, self.errors = scenes, errors
+
+    def get(self, name: str) -> Optional[Scene]:
+        self.refresh()
+        return self.scenes.get(name)
+
+    def describe(self) -> Dict[str, Any]:
+        self.refresh()
+        return {
+            "scenes": {name: [{"id": s.id, "action": s.action, "after": list(s.after), **s.target()}
+                              for s in scene.steps]
+                       for name, scene in self.scenes.items()},
+            "errors": dict(self.errors),
+        }
+
+
+# --- running ---
+
+def _record(step: Step, started: float, t0: float, response: Optional[Response],
+            status: str) -> Dict[str, Any]:
+    rec: Dict[str, Any] = {"id": step.id, "action": step.action, **step.target(), "status": status}
+    if response is not None:
+        rec["code"], rec["result"] = response[1], response[0]
+        rec["start_ms"] = round((t0 - started) * 1000, 1)
+        rec["ms"] = round((time.monotonic() - t0) * 1000, 1)
+    return rec
+
+
+def _status(response: Response) -> str:
+    body, code = response
+    if body.get("timed_out"):
+        return "timed_out"
+    return "ok" if code < 400 else "error"
+
+
+def _summary(scene: Scene, records: Dict[str, Dict[str, Any]], started: float) -> Response:
+    steps = [records[s.id] for s in scene.steps]
+    ok = all(r["status"] == "ok" for r in steps)
+    return {"ok": ok, "scene": scene.name, "ms": round((time.monotonic() - started) * 1000, 1),
+            "steps": steps}, (200 if ok else 500)
+
+
+def _release(scene: Scene, done: Step, records: Dict[str, Dict[str, Any]]) -> List[Step]:
+    """Steps that became runnable once `done` finished; skips those blocked by a failure."""
+    by_id = {s.id: s for s in scene.steps}
+    runnable = []
+    for sid in scene.dependents[done.id]:
+        step = by_id[sid]
+        if sid in records or any(dep not in records for dep in step.after):
+            continue
+        if any(records[dep]["status"] != "ok" for dep in step.after):
+            records[sid] = _record(step, 0, 0, None, "skipped")
+            runnable.extend(_release(scene, step, records))
+        else:
+            runnable.append(step)
+    return runnable
+
+
+def run_scene(scene: Scene, call: Callable[[Step], Response], pool: ThreadPoolExecutor) -> Response:
+    """Run a scene's steps on pool, each as soon as its dependencies succeed."""
+    started = time.monotonic()
+    records: Dict[str, Dict[str, Any]] = {}
+
+    def run(step: Step) -> Tuple[float, Response]:
+        if step.delay:
+            time.sleep(step.delay)
+        t0 = time.monotonic()
+        return t0, call(step)
+
+    pending = {pool.submit(run, s): s for s in scene.roots()}
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            step = pending.pop(fut)
+            try:
+                t0, response = fut.result()
+            except Exception as e:
+                t0, response = time.monotonic(), ({"ok": False, "error": str(e)}, 500)
+            records[step.id] = _record(step, started, t0, response, _status(response))
+            for nxt in _release(scene, step, records):
+                pending[pool.submit(run, nxt)] = nxt
+    return _summary(scene, records, started)
+
+
+async def run_scene_async(scene: Scene, call: Callable[[Step], Awaitable[Response]]) -> Response:
+    """run_scene for the asyncio server: one task per step."""
+    started = time.monotonic()
+    records: Dict[str, Dict[str, Any]] = {}
+
+    async def run(step: Step) -> Tuple[float, Response]:
+        if step.delay:
+            await asyncio.sleep(step.delay)
+        t0 = time.monotonic()
+        return t0, await call(step)
+
+    pending = {asyncio.ensure_future(run(s)): s for s in scene.roots()}
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                step = pending.pop(task)
+                try:
+                    t0, response = task.result()
+                except Exception as e:
+                    t0, response = time.monotonic(), ({"ok": False, "error": str(e)}, 500)
+                records[step.id] = _record(step, started, t0, response, _status(response))
+                for nxt in _release(scene, step, records):
+                    pending[asyncio.ensure_future(run(nxt))] = nxt
+    finally:
+        for task in pending:
+            task.cancel()
+    return _summary(scene, records, started)
@@ -0,0 +1,242 @@
+"""DeviceRegistry backed by SQLite in WAL mode (TVHUB_REGISTRY=sqlite).
+
+Same interface as the devices.json registry, so plugins and discovery
+don't care which one they get, but writes are row-level upserts in a
+transaction and readers in other processes never see a half-written
+file. Each write stamps the rows it touches with a new change sequence
+(removed devices are kept as tombstones), which doubles as the registry
+generation: refresh() reads one counter and, if it moved, applies only
+the rows changed since the generation it last saw. changes_since() gives
+the same answer to callers.
+
+On first open an empty database imports devices.json once.
+"""
+from __future__ import annotations
+import json
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .registry import Device
+from .metrics import REGISTRY_RELOADS
+from .config import REGISTRY_DB, DEVICES_FILE, DATA_DIR
+
+log = logging.getLogger("tvhub")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    id      TEXT PRIMARY KEY,
+    name    TEXT NOT NULL,
+    type    TEXT NOT NULL,
+    address TEXT NOT NULL,
+    meta    TEXT NOT NULL,
+    seq     INTEGER NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS devices_type ON devices(type);
+CREATE INDEX IF NOT EXISTS devices_address ON devices(address);
+CREATE INDEX IF NOT EXISTS devices_seq ON devices(seq);
+CREATE TABLE IF NOT EXISTS registry_meta (key TEXT PRIMARY KEY, value);
+INSERT OR IGNORE INTO registry_meta VALUES ('seq', 0);
+"""
+
+
+def _device(row) -> Device:
+    return Device(id=row[0], name=row[1], type=row[2], address=row[3], meta=json.loads(row[4]))
+
+
+class SQLiteDeviceRegistry:
+    def __init__(self, path: Path = REGISTRY_DB, json_path: Path = DEVICES_FILE):
+        self.path = path
+        DATA_DIR.mkdir(parents=True, exist_ok=True)
+        self.devices: Dict[str, Device] = {}
+        # The last change sequence applied to self.devices.
+        self.generation = 0
+        self._lock = threading.RLock()
+        # Autocommit mode; transactions are opened explicitly in batch().
+        self._db = sqlite3.connect(str(path), timeout=10, isolation_level=None,
+                                   check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._batch_depth = 0
+        self._batch_seq: Optional[int] = None
+        # Inside batch() writes go to a copy, published after COMMIT; the
+        # batching thread reads the copy, everyone else the committed set.
+        self._staged: Optional[Dict[str, Device]] = None
+        self._batch_owner: Optional[int] = None
+        self._migrate(json_path)
+        self.load()
+
+    def _migrate(self, json_path: Path) -> None:
+        """Import devices.json into a fresh database (once)."""
+        done = self._db.execute("SELECT value FROM registry_meta WHERE key = 'migrated'").fetchone()
+        if done or self._db.execute("SELECT 1 FROM devices LIMIT 1").fetchone():
+            return
+        try:
+            data = json.loads(json_path.read_text())
+            devices = [Device(**v) for v in data.values()]
+        except FileNotFoundError:
+            devices = []
+        except (OSError, ValueError, TypeError) as e:
+            log.error("Not migrating %s: %s", json_path, e)
+            return
+        with self.batch():
+            for d in devices:
+                self._write(d)
+            self._db.execute("INSERT OR REPLACE INTO registry_meta VALUES ('migrated', ?)",
+                             (str(json_path),))
+        if devices:
+            log.info("Imported %d devices from %s", len(devices), json_path)
+
+    # --- reading ---
+
+    def _current_seq(self) -> int:
+        return self._db.execute("SELECT value FROM registry_meta WHERE key = 'seq'").fetchone()[0]
+
+    def load(self) -> None:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, name, type, address, meta FROM devices WHERE deleted = 0").fetchall()
+            self.devices = {r[0]: _device(r) for r in rows}
+            self.generation = self._current_seq()
+
+    def changes_since(self, generation: int) -> Tuple[int, List[Device], List[str]]:
+        """(current generation, devices added or changed, ids removed) after `generation`."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, name, type, address, meta, seq, deleted FROM devices"
+                " WHERE seq > ? ORDER BY seq", (generation,)).fetchall()
+            current = max([r[5] for r in rows], default=generation)
+        return (current, [_device(r) for r in rows if not r[6]], [r[0] for r in rows if r[6]])
+
+    def refresh(self) -> bool:
+        """Apply rows other writers changed. Returns True if anything moved."""
+        with self._lock:
+            if self._current_seq() == self.generation:
+                return False
+            REGISTRY_RELOADS.inc()
+            self._catch_up()
+            return True
+
+    def _catch_up(self) -> None:
+        current, changed, removed = self.changes_since(self.generation)
+        devices = dict(self.devices)
+        for d in changed:
+            devices[d.id] = d
+        for dev_id in removed:
+            devices.pop(dev_id, None)
+        # Swapped in whole, so readers never see half the changes.
+        self.devices = devices
+        self.generation = max(self.generation, current)
+
+    def _view(self) -> Dict[str, Device]:
+        """The devices this thread should see: staged ones inside its own batch."""
+        staged = self._staged
+        if staged is not None and self._batch_owner == threading.get_ident():
+            return staged
+        return self.devices
+
+    def all(self) -> List[Device]:
+        return list(self._view().values())
+
+    def get(self, dev_id: str) -> Optional[Device]:
+        return self._view().get(dev_id)
+
+    # --- writing ---
+
+    def _seq(self) -> int:
+        """The change sequence for the current transaction."""
+        if self._batch_seq is None:
+            self._db.execute("UPDATE registry_meta SET value = value + 1 WHERE key = 'seq'")
+            self._batch_seq = self._current_seq()
+        return self._batch_seq
+
+    def _write(self, device: Device) -> None:
+        self._db.execute(
+            "INSERT INTO devices (id, name, type, address, meta, seq, deleted)"
+            " VALUES (?, ?, ?, ?, ?, ?, 0)"
+            " ON CONFLICT(id) DO UPDATE SET name = excluded.name, type = excluded.type,"
+            " address = excluded.address, meta = excluded.meta, seq = excluded.seq, deleted = 0",
+            (device.id, device.name, device.type, device.address,
+             json.dumps(device.meta, sort_keys=True), self._seq()))
+        self._view()[device.id] = device
+
+    def _delete(self, ids: List[str]) -> None:
+        seq = self._seq()
+        self._db.executemany("UPDATE devices SET deleted = 1, seq = ? WHERE id = ? AND deleted = 0",
+                             [(seq, dev_id) for dev_id in ids])
+        devices = self._view()
+        for dev_id in ids:
+            devices.pop(dev_id, None)
+
+    @contextmanager
+    def batch(self) -> Iterator["SQLiteDeviceRegistry"]:
+        """Group writes into one transaction (and one change sequence).
+
+        Other threads keep reading the committed devices until the
+        transaction commits. Batches nest; only the outermost one commits.
+        If the block raises, the transaction is rolled back and the staged
+        changes dropped.
+        """
+        with self._lock:
+            if self._batch_depth == 0:
+                # IMMEDIATE takes the write lock now, so the sequence bump
+                # can't race another process's writer.
+                self._db.execute("BEGIN IMMEDIATE")
+                self._batch_seq = None
+                self._staged = dict(self.devices)
+                self._batch_owner = threading.get_ident()
+            self._batch_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    self._db.execute("ROLLBACK")
+                    self._batch_seq = None
+                    self._staged = self._batch_owner = None
+                raise
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                try:
+                    self._db.execute("COMMIT")
+                except BaseException:
+                    self._db.execute("ROLLBACK")
+                    raise
+                finally:
+                    self._batch_seq = None
+                    self._staged = self._batch_owner = None
+                self._catch_up()
+
+    def save(self) -> None:
+        """Writes go straight to the database; kept for interface compatibility."""
+
+    def upsert(self, device: Device) -> None:
+        with self._lock:
+            if self._view().get(device.id) == device:
+                return
+            with self.batch():
+                self._write(device)
+
+    def remove_type(self, dev_type: str) -> None:
+        with self._lock:
+            ids = [d.id for d in self._view().values() if d.type == dev_type]
+            if ids:
+                with self.batch():
+                    self._delete(ids)
+
+    def remove(self, dev_id: str) -> Optional[Device]:
+        with self._lock:
+            device = self._view().get(dev_id)
+            if device is not None:
+                with self.batch():
+                    self._delete([dev_id])
+            return device
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
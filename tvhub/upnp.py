@@ -0,0 +1,430 @@
+"""Small UPnP helpers: SSDP discovery and GENA event subscriptions.
+
+ssdp_search() multicasts an M-SEARCH and reports responses as they arrive;
+DescriptionCache fetches device descriptions (bounded concurrency) and
+reuses them while the LOCATION for a UDN is unchanged. A single
+NotifyServer (HTTP on a local port) receives NOTIFY callbacks for every
+subscription; EventSubscriber SUBSCRIBEs to event URLs, renews the
+subscriptions before they expire and hands parsed LastChange state to a
+callback.
+"""
+from __future__ import annotations
+import logging
+import socket
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse, urljoin
+
+import requests
+
+log = logging.getLogger(__name__)
+
+# (subscription key, {variable name: value}) for every NOTIFY we accept
+EventCallback = Callable[[str, Dict[str, str]], None]
+
+
+def parse_last_change(body: bytes) -> Dict[str, str]:
+    """Flatten a RenderingControl NOTIFY body into {"Volume": "12", "Mute": "0", ...}.
+
+    LastChange is an XML document escaped inside the propertyset; only
+    values for the Master channel (or with no channel) are kept.
+    """
+    out: Dict[str, str] = {}
+    try:
+        root = ET.fromstring(body)
+    except ET.ParseError:
+        return out
+    for prop in root.iter():
+        if not prop.tag.endswith("LastChange") or not prop.text:
+            continue
+        try:
+            event = ET.fromstring(prop.text)
+        except ET.ParseError:
+            continue
+        for elem in event.iter():
+            name = elem.tag.rsplit("}", 1)[-1]
+            val = elem.get("val")
+            if val is None:
+                continue
+            channel = elem.get("channel")
+            if channel not in (None, "Master"):
+                continue
+            out[name] = val
+    return out
+
+
+SSDP_MULTICAST = ("239.255.255.250", 1900)
+
+
+def _parse_ssdp(data: bytes) -> Optional[Dict[str, str]]:
+    lines = data.decode("utf-8", "replace").split("\r\n")
+    if not lines or not lines[0].upper().startswith("HTTP/1.1 200"):
+        return None
+    headers: Dict[str, str] = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().upper()] = value.strip()
+    return headers if "LOCATION" in headers else None
+
+
+def ssdp_search(st: str, timeout: float, on_response: Callable[[Dict[str, str]], None],
+                address: Tuple[str, int] = SSDP_MULTICAST, mx: int = 2) -> int:
+    """Send M-SEARCH for st and call on_response(headers) for each new responder.
+
+    Responses are handled as they arrive, de-duplicated by USN/LOCATION.
+    Returns the number of distinct responders.
+    """
+    msg = ("M-SEARCH * HTTP/1.1\r\n"
+           f"HOST: {address[0]}:{address[1]}\r\n"
+           'MAN: "ssdp:discover"\r\n'
+           f"MX: {mx}\r\n"
+           f"ST: {st}\r\n\r\n").encode("ascii")
+    seen = set()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+        sock.bind(("", 0))
+        deadline = time.monotonic() + timeout
+        sock.sendto(msg, address)
+        # A second probe shortly after covers a lost first datagram.
+        resend_at = time.monotonic() + min(0.5, timeout / 3)
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if resend_at and now >= resend_at:
+                sock.sendto(msg, address)
+                resend_at = 0.0
+            wait = deadline - now
+            if resend_at:
+                wait = min(wait, max(resend_at - now, 0.0))
+            sock.settimeout(max(wait, 0.001))
+            try:
+                data, _ = sock.recvfrom(8192)
+            except socket.timeout:
+                continue
+            headers = _parse_ssdp(data)
+            if headers is None:
+                continue
+            key = (headers.get("USN", ""), headers["LOCATION"])
+            if key in seen:
+                continue
+            seen.add(key)
+            on_response(headers)
+    finally:
+        sock.close()
+    return len(seen)
+
+
+def _text(elem: Optional[ET.Element], path: str, ns: Dict[str, str]) -> str:
+    if elem is None:
+        return ""
+    found = elem.find(path, ns)
+    return (found.text or "").strip() if found is not None and found.text else ""
+
+
+def parse_description(xml: bytes, location: str) -> Dict[str, Any]:
+    """Pull identity and absolute service URLs out of a UPnP device description."""
+    ns = {"d": "urn:schemas-upnp-org:device-1-0"}
+    root = ET.fromstring(xml)
+    device = root.find("d:device", ns)
+    base = _text(root, "d:URLBase", ns) or location
+    services: Dict[str, Dict[str, str]] = {}
+    if device is not None:
+        for svc in device.iter("{urn:schemas-upnp-org:device-1-0}service"):
+            st = _text(svc, "d:serviceType", ns)
+            services[st] = {
+                "control_url": urljoin(base, _text(svc, "d:controlURL", ns)),
+                "event_url": urljoin(base, _text(svc, "d:eventSubURL", ns)),
+            }
+    return {
+        "udn": _text(device, "d:UDN", ns),
+        "friendly_name": _text(device, "d:friendlyName", ns),
+        "manufacturer": _text(device, "d:manufacturer", ns),
+        "model": _text(device, "d:modelName", ns),
+        "model_number": _text(device, "d:modelNumber", ns),
+        "location": location,
+        "services": services,
+    }
+
+
+def _udn_from_usn(usn: str) -> str:
+    return usn.split("::", 1)[0]
+
+
+class DescriptionCache:
+    """Device descriptions keyed by UDN, refetched only when LOCATION changes.
+
+    fetch() returns a Future so many descriptions can be pulled in
+    parallel through a small, bounded worker pool.
+    """
+
+    def __init__(self, workers: int = 4, http_timeout: float = 3.0):
+        self.http_timeout = http_timeout
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tvhub-ssdp")
+        self._by_udn: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.fetches = 0
+
+    def load(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        with self._lock:
+            self._by_udn.update(entries)
+
+    def dump(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return dict(self._by_udn)
+
+    def _get(self, location: str) -> Dict[str, Any]:
+        resp = requests.get(location, timeout=self.http_timeout)
+        resp.raise_for_status()
+        desc = parse_description(resp.content, location)
+        with self._lock:
+            self.fetches += 1
+            if desc["udn"]:
+                self._by_udn[desc["udn"]] = desc
+        return desc
+
+    def fetch(self, headers: Dict[str, str]) -> "Future[Dict[str, Any]]":
+        location = headers["LOCATION"]
+        udn = _udn_from_usn(headers.get("USN", ""))
+        with self._lock:
+            cached = self._by_udn.get(udn) if udn else None
+        if cached is not None and cached.get("location") == location:
+            fut: Future = Future()
+            fut.set_result(cached)
+            return fut
+        return self._pool.submit(self._get, location)
+
+
+def local_ip_for(remote_ip: str) -> str:
+    """Address of the interface we'd use to reach remote_ip (no packets sent)."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect((remote_ip, 9))
+        return s.getsockname()[0]
+    except OSError:
+        return "127.0.0.1"
+    finally:
+        s.close()
+
+
+class _NotifyHandler(BaseHTTPRequestHandler):
+    server_version = "tvhub-gena/1"
+
+    def do_NOTIFY(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        self.server.dispatch(self.headers.get("SID", ""), body)
+
+    def log_message(self, fmt, *args):
+        log.debug("notify: " + fmt, *args)
+
+
+class NotifyServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, on_notify: Optional[Callable[[str, bytes], None]] = None):
+        super().__init__(("0.0.0.0", port), _NotifyHandler)
+        self.on_notify = on_notify
+        self._thread = threading.Thread(target=self.serve_forever, name="tvhub-gena", daemon=True)
+        self._thread.start()
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def dispatch(self, sid: str, body: bytes) -> None:
+        if self.on_notify:
+            try:
+                self.on_notify(sid, body)
+            except Exception:
+                log.exception("NOTIFY handler failed")
+
+
+class _Subscription:
+    def __init__(self, key: str, event_url: str):
+        self.key = key
+        self.event_url = event_url
+        self.sid: Optional[str] = None
+        self.expires = 0.0
+        self.duration = 0.0
+        self.failed_at = 0.0
+        # A SUBSCRIBE is in flight; others wait for its outcome instead of
+        # sending their own (each would get, and leak, a SID).
+        self.pending = False
+
+    @property
+    def active(self) -> bool:
+        return self.sid is not None and time.monotonic() < self.expires
+
+
+class EventSubscriber:
+    """GENA subscriptions keyed by an arbitrary string (we use the device IP)."""
+
+    RETRY_AFTER = 30.0
+    # NOTIFYs for SIDs we don't know yet are held this long, at most EARLY_MAX.
+    EARLY_TTL = 5.0
+    EARLY_MAX = 32
+
+    def __init__(self, on_event: EventCallback, port: int = 0, timeout: int = 300,
+                 http_timeout: float = 3.0):
+        self.on_event = on_event
+        self.port = port
+        self.timeout = timeout
+        self.http_timeout = http_timeout
+        self._server: Optional[NotifyServer] = None
+        self._subs: Dict[str, _Subscription] = {}
+        self._by_sid: Dict[str, str] = {}
+        self._early: Dict[str, Tuple[float, bytes]] = {}
+        self._lock = threading.Lock()
+        self._renewer: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _ensure_server(self) -> NotifyServer:
+        if self._server is None:
+            self._server = NotifyServer(self.port, self._notify)
+            self._renewer = threading.Thread(target=self._renew_loop, name="tvhub-gena-renew",
+                                             daemon=True)
+            self._renewer.start()
+        return self._server
+
+    def _notify(self, sid: str, body: bytes) -> None:
+        with self._lock:
+            key = self._by_sid.get(sid)
+            if key is None:
+                # The initial event can beat the SUBSCRIBE response; hold it
+                # until _set_sid() learns the SID. Ones nobody claims (a
+                # stale SID, a failed SUBSCRIBE) age out or make room.
+                now = time.monotonic()
+                for old in [s for s, (at, _) in self._early.items() if now - at > self.EARLY_TTL]:
+                    del self._early[old]
+                if len(self._early) >= self.EARLY_MAX:
+                    del self._early[next(iter(self._early))]
+                self._early[sid] = (now, body)
+                return
+        values = parse_last_change(body)
+        if values:
+            self.on_event(key, values)
+
+    def is_active(self, key: str) -> bool:
+        sub = self._subs.get(key)
+        return bool(sub and sub.active)
+
+    def ensure(self, key: str, event_url: str) -> bool:
+        """Subscribe to event_url unless already subscribed; returns True if active.
+
+        A failed attempt is not retried for RETRY_AFTER seconds so an
+        eventing-less TV doesn't cost a SUBSCRIBE on every call.
+        """
+        with self._lock:
+            sub = self._subs.get(key)
+            if sub and sub.active:
+                return True
+            if sub and sub.event_url == event_url and \
+                    time.monotonic() - sub.failed_at < self.RETRY_AFTER:
+                return False
+            if sub is None or sub.event_url != event_url:
+                sub = _Subscription(key, event_url)
+                self._subs[key] = sub
+            if sub.pending:
+                return False
+            sub.pending = True
+            server = self._ensure_server()
+        return self._subscribe(sub, server)
+
+    def _subscribe(self, sub: _Subscription, server: NotifyServer) -> bool:
+        """Send SUBSCRIBE for sub; the caller has set sub.pending under the lock."""
+        try:
+            return self._send_subscribe(sub, server)
+        finally:
+            with self._lock:
+                sub.pending = False
+
+    def _send_subscribe(self, sub: _Subscription, server: NotifyServer) -> bool:
+        host = urlparse(sub.event_url).hostname or ""
+        callback = f"<http://{local_ip_for(host)}:{server.port}/notify/{sub.key}>"
+        try:
+            resp = requests.request("SUBSCRIBE", sub.event_url, headers={
+                "CALLBACK": callback,
+                "NT": "upnp:event",
+                "TIMEOUT": f"Second-{self.timeout}",
+            }, timeout=self.http_timeout)
+            resp.raise_for_status()
+            sid = resp.headers["SID"]
+        except (requests.RequestException, KeyError) as e:
+            log.info("SUBSCRIBE %s failed: %s", sub.event_url, e)
+            sub.failed_at = time.monotonic()
+            return False
+        self._set_sid(sub, sid, resp.headers.get("TIMEOUT"))
+        return True
+
+    def _renew(self, sub: _Subscription) -> bool:
+        try:
+            resp = requests.request("SUBSCRIBE", sub.event_url, headers={
+                "SID": sub.sid or "",
+                "TIMEOUT": f"Second-{self.timeout}",
+            }, timeout=self.http_timeout)
+            resp.raise_for_status()
+        except requests.RequestException as e:
+            log.info("renew %s failed, resubscribing: %s", sub.event_url, e)
+            with self._lock:
+                self._by_sid.pop(sub.sid or "", None)
+                sub.sid = None
+                if sub.pending:
+                    return False
+                sub.pending = True
+            return self._subscribe(sub, self._ensure_server())
+        self._set_sid(sub, resp.headers.get("SID") or sub.sid, resp.headers.get("TIMEOUT"))
+        return True
+
+    def _set_sid(self, sub: _Subscription, sid: str, timeout_header: Optional[str]) -> None:
+        seconds = self.timeout
+        if timeout_header and timeout_header.lower().startswith("second-"):
+            try:
+                seconds = int(timeout_header.split("-", 1)[1])
+            except ValueError:
+                pass
+        with self._lock:
+            if sub.sid and sub.sid != sid:
+                self._by_sid.pop(sub.sid, None)
+            sub.sid = sid
+            sub.duration = seconds
+            sub.expires = time.monotonic() + seconds
+            self._by_sid[sid] = sub.key
+            early = self._early.pop(sid, None)
+        if early is not None and time.monotonic() - early[0] <= self.EARLY_TTL:
+            values = parse_last_change(early[1])
+            if values:
+                self.on_event(sub.key, values)
+
+    def _renew_loop(self) -> None:
+        while not self._stop.wait(5.0):
+            now = time.monotonic()
+            with self._lock:
+                due = [s for s in self._subs.values()
+                       if s.sid is not None and s.expires - now < s.duration / 2]
+            for sub in due:
+                self._renew(sub)
+
+    def close(self) -> None:
+        self._stop.set()
+        with self._lock:
+            subs = [s for s in self._subs.values() if s.sid]
+        for sub in subs:
+            try:
+                requests.request("UNSUBSCRIBE", sub.event_url, headers={"SID": sub.sid},
+                                 timeout=self.http_timeout)
+            except requests.RequestException:
+                pass
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
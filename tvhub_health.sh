@@ -18,7 +18,7 @@ log_section() {
 # ----------------------------------------------------
 log_section "SYSTEMD SERVICES STATUS"
 
-for svc in tvhub tvhub-discover tvhub-discover.timer; do
+for svc in tvhub tvhub-discoverd tvhub-discover tvhub-discover.timer; do
     echo "### $svc:" >> "$OUT"
     systemctl status "$svc" --no-pager -l 2>&1 >> "$OUT"
     echo "" >> "$OUT"
@@ -155,6 +155,10 @@ log_section "API TEST"
 
 curl -s http://127.0.0.1:10001/api/devices | jq . >> "$OUT" 2>&1
 
+echo "" >> "$OUT"
+echo "### /metrics (errors, spawns, connections, reloads):" >> "$OUT"
+curl -s http://127.0.0.1:10001/metrics | grep -E '^tvhub_(transport_errors|subprocess_spawns|http_connections|registry_reloads|discovery_runs)' >> "$OUT" 2>&1
+
 # ----------------------------------------------------
 # 10. Summary
 # ----------------------------------------------------